@@ -53,6 +53,9 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'info.middleware.RolesMiddleware',
+    'info.middleware.ReplicaMiddleware',
+    'info.middleware.ShardMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -85,8 +88,80 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # keep connections open between requests
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # seconds to wait for the write lock before "database is locked"
+            'timeout': 20,
+            # take the write lock when a transaction starts, instead of failing
+            # when a reading transaction tries to write
+            'transaction_mode': 'IMMEDIATE',
+        },
+    }
+}
+
+# PostgreSQL is used when DB_ENGINE=postgresql, configured by the DB_* variables.
+# With DB_POOL=1 connections come from a psycopg pool of DB_POOL_MAX_SIZE, which
+# replaces persistent connections.
+if os.environ.get('DB_ENGINE') == 'postgresql':
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get('DB_NAME', 'college_erp'),
+        'USER': os.environ.get('DB_USER', 'postgres'),
+        'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+        'HOST': os.environ.get('DB_HOST', 'localhost'),
+        'PORT': os.environ.get('DB_PORT', '5432'),
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {},
     }
+    if os.environ.get('DB_POOL') == '1':
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 2)),
+            'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', 20)),
+        }
+
+# A read replica of the default database, for reports and API reads, when
+# DB_REPLICA_HOST (PostgreSQL) or DB_REPLICA_NAME (a copy of the SQLite file) is set
+READ_REPLICA = None
+if os.environ.get('DB_REPLICA_HOST') or os.environ.get('DB_REPLICA_NAME'):
+    READ_REPLICA = 'replica'
+    DATABASES[READ_REPLICA] = dict(DATABASES['default'], OPTIONS=dict(DATABASES['default']['OPTIONS']),
+                                   TEST={'MIRROR': 'default'})
+    for key in ('NAME', 'HOST', 'PORT', 'USER', 'PASSWORD'):
+        if os.environ.get('DB_REPLICA_' + key):
+            DATABASES[READ_REPLICA][key] = os.environ['DB_REPLICA_' + key]
+
+# Optional department shards: DB_SHARDS=shard1=NAME,... adds databases configured
+# like the default one, and DEPT_SHARDS=CSE=shard1,... places departments on them
+for shard in filter(None, os.environ.get('DB_SHARDS', '').split(',')):
+    alias, name = shard.split('=')
+    DATABASES[alias] = dict(DATABASES['default'], NAME=name, OPTIONS=dict(DATABASES['default']['OPTIONS']))
+DEPT_SHARDS = dict(shard.split('=') for shard in filter(None, os.environ.get('DEPT_SHARDS', '').split(',')))
+
+# Ids of the department rows created on the n-th database of DEPT_SHARDS, the
+# default one being the 0th, start after n * SHARD_ID_BLOCK (set by sync_shards)
+SHARD_ID_BLOCK = 10 ** 8
+
+DATABASE_ROUTERS = ['info.sharding.ShardRouter', 'info.routers.ReplicaRouter']
+
+# Seconds a user reads from the primary after a write, while the replica catches up
+REPLICA_STICKY_SECONDS = 10
+
+# Pragmas for a SQLite database serving concurrent requests. WAL lets readers run
+# alongside the writer, and with it synchronous=NORMAL only syncs at checkpoints.
+# WAL is stored in the database file, so the profile is only run on new connections,
+# as SQLITE_PRAGMAS, when SQLITE_PROFILE=1 is set in the environment of the server.
+SQLITE_PROFILE = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -32000,           # KiB
+    'temp_store': 'MEMORY',
 }
+SQLITE_PRAGMAS = SQLITE_PROFILE if os.environ.get('SQLITE_PROFILE') == '1' else {}
 
 
 # Password validation
@@ -129,12 +204,77 @@ STATIC_URL = '/static/'
 
 LOGIN_REDIRECT_URL = '/'
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    }
+}
+
+# Cache alias and lifetime in seconds of authenticated API tokens. Deleted tokens
+# are only forgotten by the process deleting them, run with a cache shared by the
+# server processes when there are several (manage.py check --deploy warns)
+API_TOKEN_CACHE = 'default'
+API_TOKEN_CACHE_TIMEOUT = 300
+
+# Cache alias and lifetime in seconds of the version stamps behind the API ETags,
+# which are stored in the database. With a cache local to each process, another
+# process sees a change when its copy expires, set a shared backend and None to
+# see it at once
+API_VERSION_CACHE = 'default'
+API_VERSION_TIMEOUT = 60
+
+# Seconds before the cursor of /api/changes/ whose rows are sent again, longer
+# than a write transaction runs, so rows committed late are not skipped
+CHANGES_OVERLAP = 60
+
+# Cache alias and lifetime in seconds of the student API responses
+API_RESPONSE_CACHE = 'default'
+API_RESPONSE_CACHE_TIMEOUT = 600
+
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'apis.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ),
 }
+
+# Number of (class, course) sections kept in the in-process attendance engine,
+# which serves the teacher roster API and reloads a section when another process
+# bumped the attendance version of its class in API_VERSION_CACHE
+ATTENDANCE_ENGINE_SECTIONS = 128
+
+# Create AttendanceClass rows only when a class is recorded or cancelled,
+# scheduled classes are computed from AssignTime and AttendanceRange
+ATTENDANCE_LAZY = False
+
+# Device taps up to DEVICE_TAP_EARLY minutes before a period count for it, the
+# timetable index of the devices API is rebuilt every DEVICE_TIMETABLE_TTL seconds
+DEVICE_TAP_EARLY = 10
+DEVICE_TIMETABLE_TTL = 60
+
+# Percentage below which students are listed by the shortages API
+ATTENDANCE_SHORTAGE_THRESHOLD = 75
+
+# Queued shortage and marks emails are sent by send_notifications through
+# EMAIL_BACKEND, NOTIFICATION_BATCH messages per send over one connection
+NOTIFICATION_BATCH = 100
+
+# Queue heavy admin operations such as the attendance reset as jobs, run by
+# `manage.py run_worker`. Failed jobs are retried after JOB_RETRY_DELAY seconds,
+# doubled every attempt, and running jobs older than JOB_TIMEOUT are run again
+BACKGROUND_JOBS = False
+JOB_MAX_ATTEMPTS = 3
+JOB_RETRY_DELAY = 30
+JOB_TIMEOUT = 3600
+
+# Hand attendance and marks writes to a single writer thread, which commits the
+# writes received within ATTENDANCE_WRITE_BEHIND_INTERVAL seconds together
+ATTENDANCE_WRITE_BEHIND = False
+ATTENDANCE_WRITE_BEHIND_INTERVAL = 0.005
+ATTENDANCE_WRITE_BEHIND_BATCH = 100
@@ -0,0 +1,75 @@
+"""
+Token authentication backed by a cache of token -> (user and roles, student or teacher profile).
+
+Entries are bounded by the cache backend and expire after API_TOKEN_CACHE_TIMEOUT
+seconds. They are dropped when the token is deleted (djoser logout, user deletion)
+or when the user or one of its profiles is saved.
+
+Entries are only dropped from the cache of the process making the change. With
+several server processes API_TOKEN_CACHE must be a cache shared by them, such as
+Memcached or Redis, otherwise a deleted token keeps working in the other processes
+until its entry expires. The apis.W001 check warns about a process-local cache.
+"""
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from info.models import Student, Teacher, User
+
+
+def token_cache():
+    return caches[getattr(settings, 'API_TOKEN_CACHE', 'default')]
+
+
+def token_cache_key(key):
+    return 'api-token:%s' % key
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+
+    def authenticate_credentials(self, key):
+        cache = token_cache()
+        entry = cache.get(token_cache_key(key))
+        if entry is None:
+            user, token = super().authenticate_credentials(key)
+            student = teacher = None
+            # roles are cached with the user
+            if user.is_student:
+                # the user hint finds the shard of the student, see info.sharding
+                student = Student.objects.db_manager(hints={'instance': user}).select_related(
+                    'class_id__dept').filter(user=user).first()
+            if user.is_teacher:
+                teacher = Teacher.objects.select_related('dept').filter(user=user).first()
+            entry = (user, token, student, teacher)
+            cache.set(token_cache_key(key), entry, getattr(settings, 'API_TOKEN_CACHE_TIMEOUT', 300))
+        user, token, student, teacher = entry
+        # fill the reverse one-to-one caches, a missing profile is cached as missing,
+        # reading it raises RelatedObjectDoesNotExist without a query
+        User.student.related.set_cached_value(user, student)
+        User.teacher.related.set_cached_value(user, teacher)
+        return user, token
+
+
+@checks.register(checks.Tags.caches, deploy=True)
+def check_token_cache(app_configs, **kwargs):
+    if isinstance(token_cache(), LocMemCache):
+        return [checks.Warning(
+            'API_TOKEN_CACHE is local to each process, a deleted token stays valid in the other '
+            'processes for up to API_TOKEN_CACHE_TIMEOUT seconds.',
+            hint='Point API_TOKEN_CACHE to a cache shared by the server processes, or run a single process.',
+            id='apis.W001')]
+    return []
+
+
+def forget_token(sender, instance, **kwargs):
+    token_cache().delete(token_cache_key(instance.key))
+
+
+def forget_user_tokens(sender, instance, **kwargs):
+    user_id = instance.user_id if sender in (Student, Teacher) else instance.pk
+    if user_id is not None:
+        keys = Token.objects.filter(user_id=user_id).values_list('key', flat=True)
+        token_cache().delete_many([token_cache_key(k) for k in keys])
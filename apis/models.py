@@ -1,3 +1,19 @@
 from django.db import models
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_save, post_delete
+from rest_framework.authtoken.models import Token
+
+from info.models import Student, Teacher
+from .authentication import forget_token, forget_user_tokens
 
 # Create your models here.
+
+
+# Triggers
+
+post_delete.connect(forget_token, sender=Token)
+post_save.connect(forget_user_tokens, sender=get_user_model())
+post_save.connect(forget_user_tokens, sender=Student)
+post_delete.connect(forget_user_tokens, sender=Student)
+post_save.connect(forget_user_tokens, sender=Teacher)
+post_delete.connect(forget_user_tokens, sender=Teacher)
@@ -3,25 +3,30 @@ from rest_framework import serializers
 from info.models import *
 
 
-class DetailSerializer(serializers.ModelSerializer):
+class DynamicFieldsModelSerializer(serializers.ModelSerializer):
+    """
+    ModelSerializer taking a `fields` argument that limits the fields it outputs.
+    """
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+def select_fields(rows, fields):
+    """
+    Fast path for list endpoints built from .values() dicts:
+    limits each row to the requested fields, None keeps them all.
+    """
+    if fields is None:
+        return rows
+    return [{k: v for k, v in row.items() if k in fields} for row in rows]
+
+
+class DetailSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = Student
         fields = '__all__'
-
-
-class AttendanceSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = AttendanceTotal
-        fields = '__all__'
-
-
-class MarksSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = Marks
-        fields = '__all__'
-
-
-class TimeTableSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = AssignTime
-        fields = '__all__'
@@ -1,3 +1,468 @@
+import math
+import time
+from datetime import date, timedelta
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import connection
+from django.contrib.auth.models import Permission
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date
+
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from info.models import Dept, Class, Course, Teacher, Student, Assign, AssignTime, User, AttendanceClass, Attendance
+from info.models import AttendanceRange, AttendanceTotal, Marks, DeviceEvent, StudentWeekRollup, VersionStamp
+from info.jobs import work
+from info.records import record_attendance
+from apis.authentication import check_token_cache
+from apis.views import attendance_summary
+from info.timetable import index as timetable_index
+from info import versions
 
 # Create your tests here.
+
+
+class StudentAPITest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        dept = Dept.objects.create(id='AP', name='Api Dept')
+        cls.cl = Class.objects.create(id='AP1A', dept=dept, sem=1, section='A')
+        cls.cr = Course.objects.create(id='AP101', dept=dept, name='Apis', shortname='AP')
+        t = Teacher.objects.create(id='AP_T', dept=dept, name='Api Teacher')
+        cls.ass = Assign.objects.create(class_id=cls.cl, course=cls.cr, teacher=t)
+        cls.user = User.objects.create(username='api_student')
+        cls.stud = Student.objects.create(USN='AP001', name='Api Student', class_id=cls.cl, user=cls.user)
+        cls.token = Token.objects.create(user=cls.user)
+        # the stamps are in the table, the cache is cleared before each test
+        cache.clear()
+        versions.versions(versions.KINDS, cls.stud.USN, cls.cl.id)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def test_details(self):
+        # token lookup, roles, student profile and version stamps
+        with self.assertNumQueries(4):
+            resp = self.client.get('/api/details/')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data['data']['USN'], 'AP001')
+        # then served by the token cache
+        with self.assertNumQueries(0):
+            resp = self.client.get('/api/details/')
+        self.assertEqual(resp.data['data']['USN'], 'AP001')
+
+    def test_missing_profile_cached(self):
+        teacher = User.objects.create(username='api_not_student')
+        Teacher.objects.create(id='AP_T2', dept_id='AP', name='Teacher', user=teacher)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=teacher).key)
+        self.client.get('/api/details/')
+        # the cached token says the user has no student profile
+        with self.assertNumQueries(0):
+            resp = self.client.get('/api/details/')
+        self.assertEqual(resp.status_code, 400)
+
+    def test_local_token_cache_check(self):
+        self.assertEqual([w.id for w in check_token_cache(None)], ['apis.W001'])
+
+    def test_token_deletion_invalidates_cache(self):
+        self.assertEqual(self.client.get('/api/details/').status_code, 200)
+        self.token.delete()
+        self.assertEqual(self.client.get('/api/details/').status_code, 401)
+
+    def test_logout_invalidates_cache(self):
+        self.assertEqual(self.client.get('/api/details/').status_code, 200)
+        self.assertEqual(self.client.post('/api/auth/token/logout/').status_code, 204)
+        self.assertEqual(self.client.get('/api/details/').status_code, 401)
+
+    def test_profile_change_invalidates_cache(self):
+        self.client.get('/api/details/')
+        self.stud.name = 'Renamed'
+        self.stud.save()
+        self.assertEqual(self.client.get('/api/details/').data['data']['name'], 'Renamed')
+
+    def test_marks_and_attendance(self):
+        resp = self.client.get('/api/marks/')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data['user_marks'], {'Apis': 0})
+        resp = self.client.get('/api/attendance/')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(resp.data['user_attendance']), 1)
+
+    def test_sparse_fields(self):
+        resp = self.client.get('/api/details/', {'fields': 'USN,name'})
+        self.assertEqual(resp.data['data'], {'USN': 'AP001', 'name': 'Api Student'})
+        resp = self.client.get('/api/attendance/', {'fields': 'course,attendance,classes_to_attend'})
+        self.assertEqual(resp.data['user_attendance'], [{'course': 'AP101', 'attendance': 0, 'classes_to_attend': 0}])
+        resp = self.client.get('/api/dashboard/', {'fields': 'marks'})
+        self.assertEqual(list(resp.data), ['marks'])
+        self.assertEqual(self.client.get('/api/marks/', {'fields': 'Apis'}).data['user_marks'], {'Apis': 0})
+        self.assertEqual(self.client.get('/api/marks/', {'fields': 'Other'}).data['user_marks'], {})
+
+    def test_conditional_get(self):
+        resp = self.client.get('/api/attendance/')
+        etag = resp['ETag']
+        with self.assertNumQueries(0):
+            resp = self.client.get('/api/attendance/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 304)
+        # other kinds and other classes do not invalidate the copy
+        versions.bump('marks', classes=[self.cl.id])
+        versions.bump('attendance', classes=['OTHER'])
+        self.assertEqual(self.client.get('/api/attendance/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        versions.bump('attendance', students=[self.stud.USN])
+        resp = self.client.get('/api/attendance/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp['ETag'], etag)
+
+        # a new course of the class
+        etag = resp['ETag']
+        other = Assign.objects.create(class_id=self.cl, teacher=self.ass.teacher, course=Course.objects.create(
+            id='AP102', dept_id='AP', name='More Apis', shortname='MA'))
+        resp = self.client.get('/api/attendance/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(len(resp.data['user_attendance']), 2)
+        etag = resp['ETag']
+        other.delete()
+        resp = self.client.get('/api/attendance/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(len(resp.data['user_attendance']), 1)
+
+    def test_stamps_expire(self):
+        resp = self.client.get('/api/attendance/')
+        etag = resp['ETag']
+        # the cached stamps expire and are read again unchanged from the database,
+        # the cached response and the client's copy stay valid
+        with mock.patch('time.time', return_value=time.time() + 120):
+            with self.assertNumQueries(1):
+                self.assertEqual(self.client.get('/api/attendance/')['ETag'], etag)
+            with self.assertNumQueries(0):
+                resp = self.client.get('/api/attendance/', HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(resp.status_code, 304)
+            versions.bump('attendance', students=[self.stud.USN])
+            self.assertEqual(self.client.get('/api/attendance/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_last_modified(self):
+        now = versions.bump('marks', classes=[self.cl.id])
+        # not sent during the second of the last change
+        self.assertFalse(self.client.get('/api/marks/').has_header('Last-Modified'))
+        with mock.patch('time.time', return_value=now + 5):
+            resp = self.client.get('/api/marks/')
+            last_modified = resp['Last-Modified']
+            self.assertEqual(last_modified, http_date(math.ceil(now)))
+            self.assertEqual(self.client.get('/api/marks/', HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+            Marks.objects.filter(studentcourse__student=self.stud).update(marks1=15)
+            versions.bump('marks', students=[self.stud.USN])
+            resp = self.client.get('/api/marks/', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data['user_marks'], {'Apis': 15})
+        with mock.patch('time.time', return_value=now + 10):
+            self.assertEqual(self.client.get('/api/marks/')['Last-Modified'], http_date(math.ceil(now + 5)))
+
+    def test_response_cache(self):
+        self.assertEqual(self.client.get('/api/marks/').data['user_marks'], {'Apis': 0})
+        with self.assertNumQueries(0):
+            resp = self.client.get('/api/marks/')
+        self.assertEqual(resp.data['user_marks'], {'Apis': 0})
+        Marks.objects.filter(studentcourse__student=self.stud).update(marks1=15)
+        # served from cache until the write path bumps the stamp
+        self.assertEqual(self.client.get('/api/marks/').data['user_marks'], {'Apis': 0})
+        versions.bump('marks', classes=[self.cl.id])
+        self.assertEqual(self.client.get('/api/marks/').data['user_marks'], {'Apis': 15})
+
+    def test_changes(self):
+        AttendanceRange.objects.create(start_date=date(2025, 1, 1), end_date=date(2025, 1, 2))
+        AssignTime.objects.create(assign=self.ass, day='Monday', period='7:30 - 8:30')
+        resp = self.client.get('/api/changes/')
+        self.assertTrue(resp.data['attendance_reset'])
+        self.assertEqual(len(resp.data['marks']), 6)
+        self.assertEqual(len(resp.data['timetable']), 1)
+
+        assc = AttendanceClass.objects.create(assign=self.ass, date='2025-01-06', status=1)
+        a = Attendance.objects.create(course=self.cr, student=self.stud, attendanceclass=assc, date=assc.date)
+        with self.settings(CHANGES_OVERLAP=0):
+            resp = self.client.get('/api/changes/', {'since': resp.data['cursor']})
+        self.assertFalse(resp.data['attendance_reset'])
+        self.assertEqual([r['id'] for r in resp.data['attendance']], [a.id])
+        self.assertEqual(resp.data['marks'], [])
+        self.assertNotIn('timetable', resp.data)
+
+        # a row stamped before the cursor and committed after the call, and the rows
+        # of the overlap window, are sent again
+        cursor = resp.data['cursor']
+        assc = AttendanceClass.objects.create(assign=self.ass, date='2025-01-07', status=1)
+        late = Attendance.objects.create(course=self.cr, student=self.stud, attendanceclass=assc, date=assc.date)
+        Attendance.objects.filter(id=late.id).update(modified=parse_datetime(cursor) - timedelta(seconds=5))
+        resp = self.client.get('/api/changes/', {'since': cursor})
+        self.assertEqual(sorted(r['id'] for r in resp.data['attendance']), [a.id, late.id])
+        self.assertEqual(resp.data['cursor'], cursor)
+        with self.settings(CHANGES_OVERLAP=0):
+            resp = self.client.get('/api/changes/', {'since': resp.data['cursor']})
+        self.assertEqual(resp.data['attendance'], [])
+        self.assertEqual(self.client.get('/api/changes/', {'since': 'yesterday'}).status_code, 400)
+
+    def test_changes_after_expiry(self):
+        assc = AttendanceClass.objects.create(assign=self.ass, date='2025-01-06', status=1)
+        Attendance.objects.create(course=self.cr, student=self.stud, attendanceclass=assc, date=assc.date)
+        cursor = self.client.get('/api/changes/').data['cursor']
+        # the cached stamps expired, nothing changed
+        with mock.patch('time.time', return_value=time.time() + 120), self.settings(CHANGES_OVERLAP=0):
+            resp = self.client.get('/api/changes/', {'since': cursor})
+        self.assertFalse(resp.data['attendance_reset'])
+        self.assertEqual(resp.data['attendance'], [])
+        self.assertNotIn('timetable', resp.data)
+        # a reset whose stamp is not in this process's cache
+        VersionStamp.objects.filter(key=versions.version_key('attendance', 'all')).update(stamp=time.time() + 1)
+        with self.settings(CHANGES_OVERLAP=0):
+            resp = self.client.get('/api/changes/', {'since': resp.data['cursor']})
+        self.assertTrue(resp.data['attendance_reset'])
+        self.assertEqual(len(resp.data['attendance']), 1)
+
+    def test_attendance_history_pages(self):
+        ids = []
+        for d in ('2025-01-07', '2025-01-06', '2025-01-06', '2025-01-08', '2025-01-06'):
+            assc = AttendanceClass.objects.create(assign=self.ass, date=d, status=1)
+            ids.append((d, Attendance.objects.create(
+                course=self.cr, student=self.stud, attendanceclass=assc, date=d).id))
+        url, seen = '/api/attendance/AP101/history/?limit=2', []
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                resp = self.client.get(url)
+            self.assertFalse(any('OFFSET' in q['sql'] for q in queries))
+            self.assertLessEqual(len(resp.data['results']), 2)
+            seen += [r['id'] for r in resp.data['results']]
+            url = resp.data['next']
+        self.assertEqual(seen, [i for d, i in sorted(ids)])
+        self.assertEqual(self.client.get('/api/attendance/AP101/history/', {'cursor': 'x'}).status_code, 400)
+
+    def test_not_a_student(self):
+        self.client.force_authenticate(User.objects.create(username='api_other'))
+        resp = self.client.get('/api/details/')
+        self.assertEqual(resp.status_code, 400)
+
+    def test_dashboard(self):
+        AttendanceRange.objects.create(start_date=date(2025, 1, 1), end_date=date(2025, 1, 2))
+        assc = AttendanceClass.objects.create(assign=self.ass, date='2025-01-06', status=1)
+        Attendance.objects.create(course=self.cr, student=self.stud, attendanceclass=assc, date=assc.date, status=True)
+        AssignTime.objects.create(assign=self.ass, day='Tuesday', period='7:30 - 8:30')
+        AssignTime.objects.create(assign=self.ass, day='Monday', period='8:30 - 9:30')
+        self.client.get('/api/details/')
+        # version stamps, attendance, courses, marks and timetable
+        with self.assertNumQueries(5):
+            resp = self.client.get('/api/dashboard/')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data['profile']['USN'], 'AP001')
+        self.assertEqual(resp.data['attendance'][0]['attended'], 1)
+        self.assertEqual(resp.data['attendance'][0]['attendance'], 100.0)
+        self.assertEqual(resp.data['marks'][0]['marks']['Semester End Exam'], 0)
+        self.assertEqual([r['day'] for r in resp.data['timetable']], ['Monday', 'Tuesday'])
+
+
+class TeacherAPITest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        dept = Dept.objects.create(id='TA', name='Teacher Api Dept')
+        cls.cl = Class.objects.create(id='TA1A', dept=dept, sem=1, section='A')
+        cr = Course.objects.create(id='TA101', dept=dept, name='Rosters', shortname='RO')
+        cls.user = User.objects.create(username='api_teacher')
+        cls.t = Teacher.objects.create(id='TA_T', dept=dept, name='Api Teacher', user=cls.user)
+        cls.ass = Assign.objects.create(class_id=cls.cl, course=cr, teacher=cls.t)
+        other = Teacher.objects.create(id='TA_O', dept=dept, name='Other Teacher')
+        cls.other_ass = Assign.objects.create(class_id=cls.cl, course=Course.objects.create(
+            id='TA102', dept=dept, name='Other', shortname='OT'), teacher=other)
+        for i in range(3):
+            Student.objects.create(USN='TA00%d' % i, name='Student %d' % i, class_id=cls.cl)
+        cls.token = Token.objects.create(user=cls.user)
+        cache.clear()
+        versions.versions(versions.KINDS, 'TA000', cls.cl.id)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def mark(self, assign_id, entries, day='2026-10-19'):
+        return self.client.post('/api/teacher/assigns/%d/attendance/' % assign_id,
+                                {'date': day, 'attendance': entries}, format='json')
+
+    def test_assigns(self):
+        resp = self.client.get('/api/teacher/assigns/')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(resp.data['assigns']), 1)
+        self.assertEqual(resp.data['assigns'][0]['course'], 'TA101')
+        self.assertEqual(resp.data['assigns'][0]['students'], 3)
+
+    def test_mark_and_roster(self):
+        entries = [{'usn': 'TA000', 'present': True}, {'usn': 'TA001', 'present': False},
+                   {'usn': 'TA002', 'present': True}]
+        self.client.get('/api/teacher/assigns/')
+        # assign, roster, meeting lookup and insert, then in a savepoint existing rows, one
+        # upsert, a read and a write per rollup table and for the totals, the shortage notification
+        # of TA001 with its course name, the class update, and a read and a write of the version stamps
+        with self.assertNumQueries(19):
+            resp = self.mark(self.ass.id, entries)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data['changed'], 3)
+        assc = AttendanceClass.objects.get(id=resp.data['attendanceclass'])
+        self.assertEqual(assc.status, 1)
+        self.assertEqual(Attendance.objects.filter(attendanceclass=assc).count(), 3)
+
+        # submitting again updates in place
+        entries[1]['present'] = True
+        resp = self.mark(self.ass.id, entries)
+        self.assertEqual(resp.data['attendanceclass'], assc.id)
+        self.assertEqual(resp.data['changed'], 1)
+        self.assertEqual(Attendance.objects.filter(attendanceclass=assc, status=True).count(), 3)
+
+        staff = APIClient()
+        staff.force_authenticate(User.objects.create(username='api_hod', is_staff=True))
+        resp = staff.get('/api/trends/TA1A/')
+        self.assertEqual([(t['date'], t['present'], t['total']) for t in resp.data['trend']],
+                         [(date(2026, 10, 19), 3, 3)])
+        resp = staff.get('/api/trends/TA1A/', {'by': 'week'})
+        self.assertEqual([(t['date'], t['present'], t['total']) for t in resp.data['trend']],
+                         [(date(2026, 10, 19), 3, 3)])
+        self.assertEqual(self.client.get('/api/trends/TA1A/').status_code, 403)
+
+        resp = self.client.get('/api/teacher/assigns/%d/roster/' % self.ass.id)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual([(s['USN'], s['attended'], s['total']) for s in resp.data['students']],
+                         [('TA000', 1, 1), ('TA001', 1, 1), ('TA002', 1, 1)])
+        resp = self.client.get('/api/teacher/assigns/%d/roster/' % self.ass.id, {'start': '2026-10-20'})
+        self.assertEqual([s['total'] for s in resp.data['students']], [0, 0, 0])
+        resp = self.client.get('/api/teacher/assigns/%d/roster/' % self.ass.id, {'end': '19/10/2026'})
+        self.assertEqual(resp.status_code, 400)
+
+    def test_shortages(self):
+        self.mark(self.ass.id, [{'usn': 'TA000', 'present': True}, {'usn': 'TA001', 'present': False}])
+        self.mark(self.ass.id, [{'usn': 'TA000', 'present': False}, {'usn': 'TA001', 'present': True}],
+                  day='2026-10-20')
+        self.mark(self.ass.id, [{'usn': 'TA000', 'present': True}, {'usn': 'TA001', 'present': True}],
+                  day='2026-10-21')
+        staff = APIClient()
+        staff.force_authenticate(User.objects.create(username='api_hod', is_staff=True))
+        resp = staff.get('/api/shortages/', {'class_id': 'TA1A'})
+        self.assertEqual(resp.status_code, 200)
+        # 2 of 3 classes, 1 more to reach 75%
+        self.assertEqual([(s['USN'], s['attended'], s['total'], s['classes_to_attend']) for s in resp.data['shortages']],
+                         [('TA000', 2, 3, 1), ('TA001', 2, 3, 1)])
+        self.assertEqual(staff.get('/api/shortages/', {'threshold': 60}).data['shortages'], [])
+        self.assertEqual(len(staff.get('/api/shortages/', {'limit': 1}).data['shortages']), 1)
+        self.assertEqual(staff.get('/api/shortages/', {'threshold': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/shortages/').status_code, 403)
+
+    def test_invalid_attendance(self):
+        self.assertEqual(self.mark(self.ass.id, [{'usn': 'TA000'}]).status_code, 400)
+        self.assertEqual(self.mark(self.ass.id, [], day='19/10/2026').status_code, 400)
+        resp = self.mark(self.ass.id, [{'usn': 'NOPE', 'present': True}])
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(resp.data['students'], ['NOPE'])
+        self.assertFalse(AttendanceClass.objects.filter(assign=self.ass).exists())
+
+    def test_other_teachers_assign(self):
+        self.assertEqual(self.client.get('/api/teacher/assigns/%d/roster/' % self.other_ass.id).status_code, 404)
+        self.assertEqual(self.mark(self.other_ass.id, [{'usn': 'TA000', 'present': True}]).status_code, 404)
+
+    def test_not_a_teacher(self):
+        user = User.objects.create(username='api_nobody')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=user).key)
+        self.assertEqual(self.client.get('/api/teacher/assigns/').status_code, 403)
+
+
+class DeviceTapTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        dept = Dept.objects.create(id='DV', name='Device Dept')
+        cl = Class.objects.create(id='DV1A', dept=dept, sem=1, section='A')
+        cr = Course.objects.create(id='DV101', dept=dept, name='Taps', shortname='TP')
+        t = Teacher.objects.create(id='DV_T', dept=dept, name='Device Teacher')
+        cls.ass = Assign.objects.create(class_id=cl, course=cr, teacher=t)
+        # without signals, no AttendanceRange is needed
+        AssignTime.objects.bulk_create([AssignTime(assign=cls.ass, day='Monday', period='12:40 - 1:30')])
+        for i in range(2):
+            Student.objects.create(USN='DV00%d' % i, name='Student %d' % i, class_id=cl)
+        cls.user = User.objects.create(username='reader')
+        cls.user.user_permissions.add(Permission.objects.get(codename='add_deviceevent'))
+        cls.token = Token.objects.create(user=cls.user)
+
+    def setUp(self):
+        cache.clear()
+        timetable_index.invalidate()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def tap(self, events):
+        return self.client.post('/api/devices/taps/', [
+            {'key': key, 'usn': usn, 'timestamp': ts, 'device': 'door-1'} for key, usn, ts in events], format='json')
+
+    def test_taps(self):
+        # 2026-10-19 is a Monday, the second tap is in the early window of the period
+        resp = self.tap([('k1', 'DV000', '2026-10-19T13:00:00Z'), ('k2', 'DV001', '2026-10-19T12:35:00Z'),
+                         ('k3', 'DV001', '2026-10-19T10:40:00Z'), ('k4', 'NOPE', '2026-10-19T13:00:00Z')])
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data, {'accepted': 4, 'duplicates': 0, 'unmatched': 2})
+        assc = AttendanceClass.objects.get(assign=self.ass, date=date(2026, 10, 19))
+        # taps only mark the present students, the teacher still takes the class
+        self.assertEqual(assc.status, 0)
+        self.assertEqual(sorted(Attendance.objects.filter(attendanceclass=assc, status=True).values_list(
+            'student_id', flat=True)), ['DV000', 'DV001'])
+        self.assertEqual(DeviceEvent.objects.filter(attendanceclass=assc).count(), 2)
+        # the class counts once the teacher took it, with the taps
+        self.assertFalse(AttendanceTotal.objects.exists())
+        stud = Student.objects.get(USN='DV000')
+        self.assertEqual([(c['attended'], c['total']) for c in attendance_summary(stud)], [(0, 0)])
+        self.assertEqual(AttendanceTotal(student=stud, course_id='DV101').total_class, 0)
+        record_attendance(assc, {'DV001': False})
+        self.assertEqual(sorted(AttendanceTotal.objects.values_list('student_id', 'present_count', 'total_count')),
+                         [('DV000', 1, 1), ('DV001', 0, 1)])
+        self.assertEqual([(c['attended'], c['total']) for c in attendance_summary(stud)], [(1, 1)])
+
+    def test_cancelled_class(self):
+        AttendanceClass.objects.create(assign=self.ass, date=date(2026, 10, 19), status=2)
+        self.assertEqual(self.tap([('k1', 'DV000', '2026-10-19T13:00:00Z')]).data['unmatched'], 1)
+        self.assertFalse(Attendance.objects.exists())
+
+    def test_retry_is_idempotent(self):
+        events = [('k1', 'DV000', '2026-10-19T13:00:00Z'), ('k1', 'DV000', '2026-10-19T13:00:00Z')]
+        self.assertEqual(self.tap(events).data, {'accepted': 1, 'duplicates': 1, 'unmatched': 0})
+        self.assertEqual(self.tap(events).data, {'accepted': 0, 'duplicates': 2, 'unmatched': 0})
+        self.assertEqual(Attendance.objects.filter(student='DV000').count(), 1)
+        self.assertEqual(DeviceEvent.objects.count(), 1)
+
+    def test_timetable_change(self):
+        self.assertEqual(self.tap([('k1', 'DV000', '2026-10-20T13:00:00Z')]).data['unmatched'], 1)
+        at = AssignTime.objects.get(assign=self.ass)
+        at.day = 'Tuesday'
+        at.save()
+        self.assertEqual(self.tap([('k2', 'DV000', '2026-10-20T13:00:00Z')]).data['unmatched'], 0)
+
+    def test_invalid_and_forbidden(self):
+        self.assertEqual(self.tap([('k1', 'DV000', 'yesterday')]).status_code, 400)
+        user = User.objects.create(username='not_a_reader')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=user).key)
+        self.assertEqual(self.tap([('k1', 'DV000', '2026-10-19T13:00:00Z')]).status_code, 403)
+
+
+class JobAPITest(TestCase):
+
+    def test_enqueue_and_poll(self):
+        staff = APIClient()
+        staff.force_authenticate(User.objects.create(username='api_jobs', is_staff=True))
+        resp = staff.post('/api/jobs/', {'name': 'rebuild_rollups'}, format='json')
+        self.assertEqual(resp.status_code, 202)
+        self.assertEqual(resp.data['status'], 'queued')
+        StudentWeekRollup.objects.create(student=Student.objects.create(USN='JA000', name='s', class_id=Class.objects.create(
+            id='JA1A', dept=Dept.objects.create(id='JA', name='Jobs Api'), sem=1, section='A')),
+            course=Course.objects.create(id='JA101', dept_id='JA', name='c', shortname='c'), week=date(2026, 10, 19))
+        work()
+        resp = staff.get('/api/jobs/%d/' % resp.data['id'])
+        self.assertEqual((resp.data['status'], resp.data['progress']), ('done', 100))
+        self.assertEqual(resp.data['result'], {'class_days': 0, 'student_weeks': 0})
+        self.assertEqual(staff.post('/api/jobs/', {'name': 'nope'}, format='json').status_code, 400)
+        self.assertEqual(staff.get('/api/jobs/999/').status_code, 404)
+        self.assertEqual(APIClient().get('/api/jobs/1/').status_code, 401)
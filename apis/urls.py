@@ -6,6 +6,17 @@ from django.contrib import admin
 urlpatterns = [
     path('details/', api_view.DetailView.as_view()),
     path('attendance/', api_view.AttendanceView.as_view()),
+    path('attendance/<slug:course_id>/history/', api_view.AttendanceHistoryView.as_view()),
     path('marks/', api_view.MarksView.as_view()),
     path('timetable/', api_view.TimetableView.as_view()),
+    path('dashboard/', api_view.DashboardView.as_view()),
+    path('changes/', api_view.ChangesView.as_view()),
+    path('teacher/assigns/', api_view.TeacherAssignView.as_view()),
+    path('teacher/assigns/<int:assign_id>/roster/', api_view.RosterView.as_view()),
+    path('teacher/assigns/<int:assign_id>/attendance/', api_view.MarkAttendanceView.as_view()),
+    path('devices/taps/', api_view.DeviceTapView.as_view()),
+    path('trends/<slug:class_id>/', api_view.TrendView.as_view()),
+    path('shortages/', api_view.ShortageView.as_view()),
+    path('jobs/', api_view.JobView.as_view()),
+    path('jobs/<int:job_id>/', api_view.JobStatusView.as_view()),
 ]
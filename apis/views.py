@@ -3,7 +3,7 @@ from info.models import *
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.authtoken.models import Token
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny, BasePermission
 from rest_framework.pagination import PageNumberPagination
 from itertools import chain
 from rest_framework import serializers, status
@@ -13,126 +13,583 @@ from rest_framework.generics import get_object_or_404
 from rest_framework import generics
 from rest_framework import mixins
 from rest_framework import status
-from django.db.models import Sum, Count
+from django.db.models import Sum, Count, Q, F
 from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils import timezone
+from functools import wraps
+import base64
+import hashlib
+import math
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from rest_framework.utils.urls import replace_query_param
 import apis.serializers as api_ser
+from info import versions
+from info.attendance_engine import engine
+from info.records import record_attendance, record_taps
+from info import jobs
+from info.writebehind import write
+from info.sharding import shard_rows
 
 
-class DetailView(APIView):
+def response_cache():
+    return caches[getattr(settings, 'API_RESPONSE_CACHE', 'default')]
+
+
+def conditional(*kinds):
     """
-    Returns user's info.
+    Decorator of a student API get method adding ETag and Last-Modified headers
+    derived from the version stamps of the given kinds. Requests whose copy is
+    still current get a 304 and the others are served from a per-student response
+    cache, both without running the view. A write bumping a stamp changes the key,
+    which invalidates exactly the students and classes it affected.
+    """
+    def decorator(get):
+        @wraps(get)
+        def wrapper(self, request, *args, **kwargs):
+            try:
+                stud = self.get_student()
+            except Student.DoesNotExist:
+                return get(self, request, *args, **kwargs)
+            stamps = versions.versions(kinds, stud.USN, stud.class_id_id)
+            digest = hashlib.md5(repr((stud.USN, request.get_full_path(), stamps)).encode()).hexdigest()
+            etag = '"%s"' % digest
+            # Last-Modified has whole seconds, it is only sent once the second of the
+            # last change is over, so that a later change always gets a later date
+            last_modified = math.ceil(max(stamps))
+            if last_modified > time.time():
+                last_modified = None
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                cache = response_cache()
+                data = cache.get('api-response:' + digest)
+                if data is not None:
+                    response = Response(data, status=status.HTTP_200_OK)
+                else:
+                    response = get(self, request, *args, **kwargs)
+                    if response.status_code != status.HTTP_200_OK:
+                        return response
+                    cache.set('api-response:' + digest, response.data,
+                              getattr(settings, 'API_RESPONSE_CACHE_TIMEOUT', 600))
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+            return response
+        return wrapper
+    return decorator
+
+
+class StudentAPIView(APIView):
+    """
+    Base view for the student APIs.
+    The user is already resolved by the authentication classes, so the student
+    profile is fetched once per request, together with its class and department.
     """
     permission_classes = [IsAuthenticated, ]
 
+    def get_student(self):
+        if not hasattr(self, '_student'):
+            user = self.request.user
+            if User.student.related.is_cached(user):
+                # filled by CachedTokenAuthentication
+                self._student = user.student
+            else:
+                self._student = Student.objects.select_related('class_id__dept').get(user=user)
+        return self._student
+
+    def get_fields(self):
+        """Fields requested with ?fields=a,b, or None for all of them."""
+        fields = self.request.query_params.get('fields')
+        if not fields:
+            return None
+        return {f.strip() for f in fields.split(',') if f.strip()}
+
+
+class DetailView(StudentAPIView):
+    """
+    Returns user's info.
+    """
+
+    @conditional('profile')
     def get(self, request):
         try:
-            # fetching token sent in request header by the user.
-            us = Token.objects.filter(user=request.user)
-            if(us):          # checking for authentication using token authentication.
-
-                # getting user from in-built user model class.
-                user = User.objects.filter(auth_token=us[0]).first()
-                # getting student from student model by filtering based on user that we got.
-                details = Student.objects.get(user=user)
-                serializer = api_ser.DetailSerializer(
-                    details, context={'request': request})       # Serializing the data into Json format.
-                return Response({'data': serializer.data, }, status=status.HTTP_200_OK)
-            else:
-                return Response({'message': 'User not authenticated'}, status=status.HTTP_400_BAD_REQUEST)
+            details = self.get_student()
+            serializer = api_ser.DetailSerializer(
+                details, fields=self.get_fields(), context={'request': request})       # Serializing the data into Json format.
+            return Response({'data': serializer.data, }, status=status.HTTP_200_OK)
         except Exception as e:
             return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
 
 
-class AttendanceView(APIView):
+class AttendanceView(StudentAPIView):
     """
     This view is used to return user's attendance 
     that is to check user's attendance.
     """
-    permission_classes = [IsAuthenticated, ]
 
+    @conditional('attendance')
     def get(self, request):
         try:
-            token = Token.objects.filter(user=request.user).first()
-            if(token):  # checking for authentication using token authentication.
-                # getting user from in-built user model class.
-                user = User.objects.get(auth_token=token)
-                # getting student from student model by filtering based on user that we got.
-                stud = Student.objects.get(user=user)
-                # using ass_list and att_list we get the classes assigned to that user
-                ass_list = Assign.objects.filter(class_id_id=stud.class_id)
-                # and respectively their attendance
-                att_list = []
-                for ass in ass_list:
-                    try:
-                        a = AttendanceTotal.objects.get(
-                            student=stud, course=ass.course)
-                    except AttendanceTotal.DoesNotExist:
-                        a = AttendanceTotal(student=stud, course=ass.course)
-                        a.save()
-                    att_list.append(a)
-                serializer = api_ser.AttendanceSerializer(
-                    att_list, many=True, context={'request': request})     # Serializing the data into Json format.
-                return Response({'user_attendance': serializer.data, }, status=status.HTTP_200_OK)
-            else:
-                # returning not authenticated message when user isn't authenticated with status code 400.
-                return Response({'message': 'User not authenticated'}, status=status.HTTP_400_BAD_REQUEST)
+            stud = self.get_student()
+            # attendance counts of every course of the user's class, from .values() rows
+            summary = attendance_summary(stud)
+            totals = dict(AttendanceTotal.objects.filter(student=stud).values_list('course_id', 'id'))
+            missing = [AttendanceTotal(student=stud, course_id=a['course']) for a in summary if a['course'] not in totals]
+            if missing:
+                AttendanceTotal.objects.bulk_create(missing, ignore_conflicts=True)
+                totals = dict(AttendanceTotal.objects.filter(student=stud).values_list('course_id', 'id'))
+            att_list = [dict(id=totals.get(a['course']), student=stud.USN, **a) for a in summary]
+            return Response({'user_attendance': api_ser.select_fields(att_list, self.get_fields()), },
+                            status=status.HTTP_200_OK)
         except Exception as e:
             return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
 
 
-class MarksView(APIView):
+class MarksView(StudentAPIView):
     """
     This view is used to return user's marks 
     that is to check user's marks in different subjects as given by the teacher.
+    ?fields= picks courses by name.
     """
-    permission_classes = [IsAuthenticated, ]
 
+    @conditional('marks')
     def get(self, request):
         try:
-            token = Token.objects.filter(user=request.user).first()
-            if(token):  # checking for authentication using token authentication.
-                user = User.objects.get(auth_token=token)
-                stud = Student.objects.get(user=user)
-
-                # using ass_list and sc_list we retrieve all the subjects assigned
-                ass_list = Assign.objects.filter(class_id_id=stud.class_id)
-                # and then their respective marks. Store them in a dictionary and return it to the user.
-                sc_list = []
-                for ass in ass_list:
-                    sc = StudentCourse.objects.get(
-                        student=stud, course=ass.course)
-                    sc_list.append(sc)
-                sc_total = {}
-                for sc in sc_list:
-                    for m in sc.marks_set.all():
-                        sc_total[m.studentcourse.course.name] = m.marks1
-                return Response({'user_marks': sc_total, }, status=status.HTTP_200_OK)
-            else:
-                return Response({'message': 'User not authenticated'}, status=status.HTTP_400_BAD_REQUEST)
+            stud = self.get_student()
+            # marks of all the courses in one query, stored in a dictionary keyed by course name.
+            m_list = Marks.objects.filter(studentcourse__student=stud)
+            fields = self.get_fields()
+            if fields is not None:
+                m_list = m_list.filter(studentcourse__course__name__in=fields)
+            sc_total = {}
+            for name, marks in m_list.values_list('studentcourse__course__name', 'marks1').order_by(
+                    'studentcourse__course_id', 'id'):
+                sc_total[name] = marks
+            return Response({'user_marks': sc_total, }, status=status.HTTP_200_OK)
         except Exception as e:
             return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
 
 
-class TimetableView(APIView):
+class TimetableView(StudentAPIView):
     """
     This view is used to check user's class timetable
     It returns the respective class' timetable to which the user is assigned.
     """
 
-    permission_classes = [IsAuthenticated, ]
+    @conditional('timetable')
+    def get(self, request):
+        try:
+            stud = self.get_student()
+            asst = AssignTime.objects.filter(
+                assign__class_id=stud.class_id_id).values('id', 'period', 'day', 'assign')
+            return Response({'user_marks': api_ser.select_fields(list(asst), self.get_fields()), },
+                            status=status.HTTP_200_OK)
+        except Exception as e:
+            return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
+
+def attendance_summary(stud):
+    """Per course attendance of a student in the classes taken, from one aggregate query."""
+    counts = Attendance.objects.filter(student=stud, attendanceclass__status=1).values('course_id').annotate(
+        total=Count('id'), attended=Count('id', filter=Q(status=True)))
+    counts = {c['course_id']: c for c in counts}
+    summary = []
+    for course in Assign.objects.filter(class_id=stud.class_id_id).values(
+            'course_id', 'course__name', 'course__shortname').distinct().order_by('course_id'):
+        c = counts.get(course['course_id'], {'attended': 0, 'total': 0})
+        summary.append({
+            'course': course['course_id'],
+            'name': course['course__name'],
+            'shortname': course['course__shortname'],
+            'attended': c['attended'],
+            'total': c['total'],
+            'attendance': attendance_percentage(c['attended'], c['total']),
+            'classes_to_attend': classes_to_attend(c['attended'], c['total']),
+        })
+    return summary
+
+
+def marks_summary(stud):
+    """Marks of a student grouped per course, from one query."""
+    marks = {}
+    for m in Marks.objects.filter(studentcourse__student=stud).values(
+            'studentcourse__course_id', 'studentcourse__course__name', 'name', 'marks1').order_by(
+            'studentcourse__course_id', 'id'):
+        course = marks.setdefault(m['studentcourse__course_id'], {
+            'course': m['studentcourse__course_id'], 'name': m['studentcourse__course__name'], 'marks': {}})
+        course['marks'][m['name']] = m['marks1']
+    return list(marks.values())
+
+
+def timetable_rows(class_id):
+    """Weekly timetable of a class in day and period order, from one query."""
+    day_order = {d[0]: i for i, d in enumerate(DAYS_OF_WEEK)}
+    period_order = {t[0]: i for i, t in enumerate(time_slots)}
+    rows = list(AssignTime.objects.filter(assign__class_id=class_id).values(
+        'day', 'period', course=F('assign__course_id'), teacher=F('assign__teacher__name')))
+    rows.sort(key=lambda r: (day_order.get(r['day'], 0), period_order.get(r['period'], 0)))
+    return rows
+
+
+class DashboardView(StudentAPIView):
+    """
+    Returns the profile, attendance, marks and timetable of the user in one response,
+    built from a fixed number of queries.
+    """
 
+    @conditional('profile', 'attendance', 'marks', 'timetable')
     def get(self, request):
         try:
-            token = Token.objects.filter(user=request.user).first()
-            if(token):  # checking for authentication using token authentication.
-                user = User.objects.get(auth_token=token)
-                stud = Student.objects.get(user=user)
-                asst = AssignTime.objects.filter(
-                    assign__class_id=stud.class_id)
-                serializer = api_ser.TimeTableSerializer(
-                    asst, many=True, context={'request': request})     # Serializing the data into Json format.
-                return Response({'user_marks': serializer.data, }, status=status.HTTP_200_OK)
+            stud = self.get_student()
+            sections = {
+                'profile': lambda: api_ser.DetailSerializer(stud, context={'request': request}).data,
+                'attendance': lambda: attendance_summary(stud),
+                'marks': lambda: marks_summary(stud),
+                'timetable': lambda: timetable_rows(stud.class_id_id),
+            }
+            # ?fields= picks sections, the others are not queried
+            fields = self.get_fields()
+            data = {name: build() for name, build in sections.items() if fields is None or name in fields}
+            return Response(data, status=status.HTTP_200_OK)
+        except Exception as e:
+            return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
+
+
+class ChangesView(StudentAPIView):
+    """
+    Incremental sync for mobile clients.
+    Returns the attendance, marks and timetable rows of the user changed since
+    the ?since= cursor of the previous call, and the cursor for the next one.
+    Without a cursor, or after attendance was reset, everything is returned.
+
+    Rows are stamped with their modified time before their transaction commits,
+    so a row can show up after newer ones. The cursor is the latest change seen
+    and rows modified up to CHANGES_OVERLAP seconds before it are sent again,
+    clients replace the rows they already have by id.
+    """
+    # the cursor must not run ahead of rows the replica has yet to receive
+    read_replica = False
+
+    def get(self, request):
+        try:
+            stud = self.get_student()
+            since = request.query_params.get('since')
+            if since:
+                since = parse_datetime(since)
+                if since is None:
+                    return Response({'message': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+            # deletions are not tracked row by row, an attendance reset or a timetable
+            # change bumps a version stamp and the whole set is sent again. The stamps
+            # are read from the table, a cached copy can miss a reset made elsewhere
+            # and the cursor would then run past it
+            stamps = versions.versions(('attendance', 'timetable'), stud.USN, stud.class_id_id, cached=False)
+            # to the microsecond, as in the cursor
+            reset, timetable = (datetime.fromtimestamp(s, tz=dt_timezone.utc) for s in (stamps[2], max(stamps[4:])))
+            attendance_reset = not since or reset > since
+            timetable_changed = not since or timetable > since
+
+            att_list = Attendance.objects.filter(student=stud)
+            m_list = Marks.objects.filter(studentcourse__student=stud)
+            if since:
+                overlap = since - timedelta(seconds=getattr(settings, 'CHANGES_OVERLAP', 60))
+                m_list = m_list.filter(modified__gt=overlap)
+                if not attendance_reset:
+                    att_list = att_list.filter(modified__gt=overlap)
+            attendance = list(att_list.values('id', 'course', 'attendanceclass', 'date', 'status', 'modified'))
+            marks = list(m_list.values('id', 'name', 'marks1', 'modified', course=F('studentcourse__course_id')))
+            seen = [r.pop('modified') for r in chain(attendance, marks)]
+            seen += [reset, timetable] + ([since] if since else [])
+            data = {
+                'cursor': max(seen).astimezone(dt_timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+                'attendance_reset': attendance_reset,
+                'attendance': attendance,
+                'marks': marks,
+            }
+            if timetable_changed:
+                data['timetable'] = timetable_rows(stud.class_id_id)
+            return Response(data, status=status.HTTP_200_OK)
+        except Exception as e:
+            return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
+
+
+class AttendanceHistoryView(StudentAPIView):
+    """
+    Per class attendance history of the user in a course, ordered by (date, id).
+    Pages are keyset paginated with an opaque ?cursor=, so deep pages cost the same as the first.
+    """
+    page_size = 50
+    max_page_size = 200
+
+    @conditional('attendance')
+    def get(self, request, course_id):
+        try:
+            stud = self.get_student()
+            limit = min(int(request.query_params.get('limit', self.page_size)), self.max_page_size)
+            att_list = Attendance.objects.filter(student=stud, course=course_id)
+            cursor = request.query_params.get('cursor')
+            if cursor:
+                try:
+                    d, i = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+                    d, i = datetime.strptime(d, '%Y-%m-%d').date(), int(i)
+                except ValueError:
+                    return Response({'message': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+                # date >= d bounds the index range, the rest skips the rows of d already sent
+                att_list = att_list.filter(Q(date__gte=d) & (Q(date__gt=d) | Q(id__gt=i)))
+            rows = list(att_list.order_by('date', 'id').values(
+                'id', 'date', 'status', 'attendanceclass')[:limit + 1])
+            next_url = None
+            if len(rows) > limit:
+                rows = rows[:limit]
+                last = '%s|%d' % (rows[-1]['date'].isoformat(), rows[-1]['id'])
+                next_url = replace_query_param(request.build_absolute_uri(), 'cursor',
+                                               base64.urlsafe_b64encode(last.encode()).decode())
+            return Response({'next': next_url, 'results': rows}, status=status.HTTP_200_OK)
+        except Exception as e:
+            return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
+
+
+class IsTeacher(BasePermission):
+    message = 'User is not a teacher'
+
+    def has_permission(self, request, view):
+        return bool(request.user and request.user.is_authenticated and request.user.is_teacher)
+
+
+class TeacherAPIView(APIView):
+    """
+    Base view for the teacher APIs.
+    As for the students, the teacher profile comes with the cached token.
+    """
+    permission_classes = [IsAuthenticated, IsTeacher]
+
+    def get_teacher(self):
+        if not hasattr(self, '_teacher'):
+            user = self.request.user
+            if User.teacher.related.is_cached(user):
+                # filled by CachedTokenAuthentication
+                self._teacher = user.teacher
             else:
-                return Response({'message': 'User not authenticated'}, status=status.HTTP_400_BAD_REQUEST)
+                self._teacher = Teacher.objects.select_related('dept').get(user=user)
+        return self._teacher
+
+    def get_assign(self, assign_id):
+        """An assignment of the user, 404 for the others."""
+        return get_object_or_404(Assign, id=assign_id, teacher=self.get_teacher().id)
+
+
+class TeacherAssignView(TeacherAPIView):
+    """
+    Returns the classes and courses assigned to the user with the size of each class.
+    """
+
+    def get(self, request):
+        try:
+            teacher = self.get_teacher()
+            # the classes of other departments can be on other shards
+            ass_list = shard_rows(Assign.objects.filter(teacher=teacher.id).values(
+                'id', 'class_id', 'course', course_name=F('course__name'),
+                course_shortname=F('course__shortname')).annotate(
+                students=Count('class_id__student')).order_by('class_id', 'course'))
+            ass_list.sort(key=lambda a: (a['class_id'], a['course']))
+            return Response({'assigns': ass_list, }, status=status.HTTP_200_OK)
         except Exception as e:
             return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
+
+
+class RosterView(TeacherAPIView):
+    """
+    Returns the students of an assigned class with their attendance in the course,
+    from the attendance engine. ?start= and ?end= limit it to the classes of a date range.
+    """
+    # a section loaded from a lagging replica would be kept under the current version stamp
+    read_replica = False
+
+    def get(self, request, assign_id):
+        ass = self.get_assign(assign_id)
+        try:
+            span = {}
+            for name in ('start', 'end'):
+                if request.query_params.get(name):
+                    span[name] = parse_date(request.query_params[name])
+                    if span[name] is None:
+                        raise ValueError(request.query_params[name])
+            counts = engine.percentages(ass.class_id_id, ass.course_id, **span)
+            rows = []
+            for usn, name in Student.objects.filter(class_id=ass.class_id_id).values_list('USN', 'name').order_by('USN'):
+                attended, total, percentage = counts.get(usn, (0, 0, 0))
+                rows.append({'USN': usn, 'name': name, 'attended': attended, 'total': total, 'attendance': percentage})
+            return Response({'class_id': ass.class_id_id, 'course': ass.course_id, 'students': rows, },
+                            status=status.HTTP_200_OK)
+        except Exception as e:
+            return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
+
+
+class MarkAttendanceView(TeacherAPIView):
+    """
+    Records the attendance of a class of an assignment in one request.
+    Expects {"date": "YYYY-MM-DD", "attendance": [{"usn": ..., "present": true}, ...]}.
+    The class of that date is created if needed and students already marked are updated.
+    """
+
+    def post(self, request, assign_id):
+        ass = self.get_assign(assign_id)
+        try:
+            d = datetime.strptime(request.data['date'], '%Y-%m-%d').date()
+            statuses = {e['usn']: bool(e['present']) for e in request.data['attendance']}
+        except (KeyError, TypeError, ValueError):
+            return Response({'message': 'Invalid attendance'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            roster = set(Student.objects.filter(class_id=ass.class_id_id).values_list('USN', flat=True))
+            unknown = sorted(set(statuses) - roster)
+            if unknown:
+                return Response({'message': 'Students not in class', 'students': unknown},
+                                status=status.HTTP_400_BAD_REQUEST)
+            assc = AttendanceClass.objects.filter(assign=ass, date=d).order_by('id').first()
+            if assc is None:
+                assc = AttendanceClass.objects.create(assign=ass, date=d)
+            assc.assign = ass
+            changes = write(record_attendance, assc, statuses)
+            return Response({'attendanceclass': assc.id, 'recorded': len(statuses), 'changed': len(changes), },
+                            status=status.HTTP_200_OK)
+        except Exception as e:
+            return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
+
+
+class CanRecordTaps(BasePermission):
+    message = 'User cannot record device events'
+
+    def has_permission(self, request, view):
+        return bool(request.user and request.user.has_perm('info.add_deviceevent'))
+
+
+class DeviceTapView(APIView):
+    """
+    Ingests batches of taps from classroom readers.
+    Expects [{"key": ..., "usn": ..., "timestamp": ISO 8601, "device": ...}, ...], the key
+    identifying the event for retries. Each tap marks the student present in the class
+    of their timetable at that time.
+    """
+    permission_classes = [IsAuthenticated, CanRecordTaps]
+    max_batch = 5000
+
+    def post(self, request):
+        events = []
+        try:
+            if len(request.data) > self.max_batch:
+                return Response({'message': 'At most %d events per batch' % self.max_batch},
+                                status=status.HTTP_400_BAD_REQUEST)
+            for e in request.data:
+                timestamp = parse_datetime(e['timestamp'])
+                if timestamp is None:
+                    raise ValueError(e['timestamp'])
+                if timezone.is_naive(timestamp):
+                    timestamp = timezone.make_aware(timestamp)
+                events.append({'key': str(e['key']), 'usn': str(e['usn']), 'device': str(e['device']),
+                               'timestamp': timestamp})
+        except (KeyError, TypeError, ValueError):
+            return Response({'message': 'Invalid events'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            return Response(write(record_taps, events), status=status.HTTP_200_OK)
+        except Exception as e:
+            return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
+
+
+class TrendView(APIView):
+    """
+    Attendance trend of a class per day, or per week with ?by=week, for staff users
+    such as department heads. Read from the rollup tables, on the shard of the class,
+    ?course= limits it to a course and ?start= and ?end= to a date range.
+    """
+    permission_classes = [IsAdminUser, ]
+
+    def get(self, request, class_id):
+        try:
+            by = request.query_params.get('by', 'day')
+            if by == 'day':
+                rows, field = ClassDayRollup.objects.filter(class_id=class_id), 'date'
+            elif by == 'week':
+                rows, field = StudentWeekRollup.objects.filter(student__class_id=class_id), 'week'
+            else:
+                return Response({'message': 'by is day or week'}, status=status.HTTP_400_BAD_REQUEST)
+            if request.query_params.get('course'):
+                rows = rows.filter(course=request.query_params['course'])
+            if request.query_params.get('start'):
+                rows = rows.filter(**{field + '__gte': request.query_params['start']})
+            if request.query_params.get('end'):
+                rows = rows.filter(**{field + '__lte': request.query_params['end']})
+            trend = [{'date': r[field], 'present': r['present'], 'total': r['total'],
+                      'attendance': attendance_percentage(r['present'], r['total'])}
+                     for r in rows.values(field).annotate(present=Sum('present'), total=Sum('total')).order_by(field)]
+            return Response({'class_id': class_id, 'by': by, 'trend': trend, }, status=status.HTTP_200_OK)
+        except Exception as e:
+            return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
+
+
+class ShortageView(APIView):
+    """
+    Students under the attendance threshold, ATTENDANCE_SHORTAGE_THRESHOLD or ?threshold=,
+    lowest first, for staff users. Read from the counts kept in AttendanceTotal, ?class_id=,
+    ?dept= and ?course= narrow the list and ?limit= caps it.
+    """
+    permission_classes = [IsAdminUser, ]
+
+    def get(self, request):
+        try:
+            threshold = float(request.query_params.get('threshold', settings.ATTENDANCE_SHORTAGE_THRESHOLD))
+            if not 0 < threshold < 100:
+                return Response({'message': 'threshold is between 0 and 100'}, status=status.HTTP_400_BAD_REQUEST)
+            limit = int(request.query_params.get('limit', 500))
+            rows = AttendanceTotal.objects.filter(total_count__gt=0, percentage__lt=threshold)
+            if request.query_params.get('class_id'):
+                rows = rows.filter(student__class_id=request.query_params['class_id'])
+            if request.query_params.get('dept'):
+                rows = rows.filter(student__class_id__dept=request.query_params['dept'])
+            if request.query_params.get('course'):
+                rows = rows.filter(course=request.query_params['course'])
+            # the lowest of every department shard, merged
+            order = ('percentage', 'student', 'course')
+            rows = shard_rows(rows.values('student', 'student__name', 'student__class_id', 'course',
+                                          'present_count', 'total_count', 'percentage').order_by(*order)[:limit])
+            rows.sort(key=lambda r: tuple(r[f] for f in order))
+            shortages = [{'USN': r['student'], 'name': r['student__name'], 'class_id': r['student__class_id'],
+                          'course': r['course'], 'attended': r['present_count'], 'total': r['total_count'],
+                          'attendance': r['percentage'],
+                          'classes_to_attend': classes_to_attend(r['present_count'], r['total_count'], threshold)}
+                         for r in rows[:limit]]
+            return Response({'threshold': threshold, 'shortages': shortages, }, status=status.HTTP_200_OK)
+        except Exception as e:
+            return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
+
+
+def job_status(j):
+    return {'id': j.id, 'name': j.name, 'status': j.status, 'progress': j.progress, 'message': j.message,
+            'result': j.result, 'attempts': j.attempts, 'created': j.created, 'finished': j.finished, }
+
+
+class JobView(APIView):
+    """
+    Queue a registered job for staff users, POST {name, args, kwargs}, and return
+    it with 202. Its status is polled at /api/jobs/<id>/.
+    """
+    permission_classes = [IsAdminUser, ]
+
+    def post(self, request):
+        try:
+            name = request.data.get('name')
+            if name not in jobs.registry:
+                return Response({'message': 'unknown job', 'jobs': sorted(jobs.registry)},
+                                status=status.HTTP_400_BAD_REQUEST)
+            j = jobs.registry[name].enqueue(*request.data.get('args', []), **request.data.get('kwargs', {}))
+            return Response(job_status(j), status=status.HTTP_202_ACCEPTED)
+        except Exception as e:
+            return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
+
+
+class JobStatusView(APIView):
+    permission_classes = [IsAdminUser, ]
+
+    def get(self, request, job_id):
+        return Response(job_status(get_object_or_404(Job, id=job_id)), status=status.HTTP_200_OK)
@@ -1,28 +1,99 @@
-from datetime import timedelta, datetime
+from datetime import datetime
 
+from django.conf import settings
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from django.http import HttpResponseRedirect
-from django.urls import path
-
-from .models import Dept, Class, Student, Attendance, Course, Teacher, Assign, AssignTime, AttendanceClass
-from .models import StudentCourse, Marks, User, AttendanceRange
+from django.db import DEFAULT_DB_ALIAS
+from django.http import HttpResponseRedirect, QueryDict
+from django.urls import path, reverse
+from django.utils import timezone
+
+from .models import Dept, Class, Student, Course, Teacher, Assign, AssignTime, AttendanceClass
+from .models import StudentCourse, Marks, User, Holiday, Leave, Substitution, DeviceEvent
+from .models import Notification, Job
+from .leave import plan_leaves
+from .sharding import fan_out, is_sharded, run_on_shards, shard_aliases, shard_for, use_alias
+from .records import delete_classes
+from .tasks import reset_attendance
+from . import versions
 
 # Register your models here.
 
-days = {
-    'Monday': 1,
-    'Tuesday': 2,
-    'Wednesday': 3,
-    'Thursday': 4,
-    'Friday': 5,
-    'Saturday': 6,
-}
-
-
-def daterange(start_date, end_date):
-    for n in range(int((end_date - start_date).days)):
-        yield start_date + timedelta(n)
+def admin_shard(request):
+    """
+    The shard picked in the Database filter of a changelist, kept by the pages opened
+    from it, the default database otherwise. None without DEPT_SHARDS.
+    """
+    if not getattr(settings, 'DEPT_SHARDS', None):
+        return None
+    alias = request.GET.get(ShardFilter.parameter_name) or QueryDict(
+        request.GET.get('_changelist_filters', '')).get(ShardFilter.parameter_name)
+    return alias if alias in shard_aliases() else DEFAULT_DB_ALIAS
+
+
+class ShardFilter(admin.SimpleListFilter):
+    title = 'database'
+    parameter_name = 'shard'
+
+    def lookups(self, request, model_admin):
+        # the rows of every shard are counted in parallel
+        counts = fan_out(lambda alias: model_admin.model.objects.using(alias).count())
+        return [(alias, '%s (%d)' % (alias, count)) for alias, count in counts.items()]
+
+    def choices(self, changelist):
+        # one database at a time, the default one unless another is picked
+        for alias, title in self.lookup_choices:
+            yield {
+                'selected': (self.value() or DEFAULT_DB_ALIAS) == alias,
+                'query_string': changelist.get_query_string({self.parameter_name: alias}),
+                'display': title,
+            }
+
+    def queryset(self, request, queryset):
+        # ShardedAdmin.get_queryset already reads from the shard
+        return queryset
+
+
+class ShardedAdmin(admin.ModelAdmin):
+    """
+    Admin of department rows, see info.sharding. With DEPT_SHARDS the changelist
+    has a Database filter, and the pages read and write the shard picked there.
+    """
+
+    def get_list_filter(self, request):
+        list_filter = super().get_list_filter(request)
+        if admin_shard(request):
+            return (ShardFilter,) + tuple(list_filter)
+        return list_filter
+
+    def get_queryset(self, request):
+        qs = super().get_queryset(request)
+        alias = admin_shard(request)
+        return qs.using(alias) if alias else qs
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if is_sharded(db_field.related_model):
+            kwargs.setdefault('using', admin_shard(request))
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+    def get_formset_kwargs(self, request, obj, inline, prefix):
+        kwargs = super().get_formset_kwargs(request, obj, inline, prefix)
+        if obj is not None and obj._state.db:
+            kwargs['queryset'] = kwargs['queryset'].using(obj._state.db)
+        return kwargs
+
+    # the queries without a row to follow, such as those of the triggers, go to the shard too
+    def changelist_view(self, request, extra_context=None):
+        with use_alias(admin_shard(request)):
+            return super().changelist_view(request, extra_context)
+
+    def changeform_view(self, request, object_id=None, form_url='', extra_context=None):
+        with use_alias(admin_shard(request)):
+            return super().changeform_view(request, object_id, form_url, extra_context)
+
+    def delete_view(self, request, object_id, extra_context=None):
+        with use_alias(admin_shard(request)):
+            return super().delete_view(request, object_id, extra_context)
 
 
 class ClassInline(admin.TabularInline):
@@ -36,13 +107,20 @@ class DeptAdmin(admin.ModelAdmin):
     search_fields = ('name', 'id')
     ordering = ['name']
 
+    def get_formset_kwargs(self, request, obj, inline, prefix):
+        kwargs = super().get_formset_kwargs(request, obj, inline, prefix)
+        if obj is not None:
+            # the classes of a department are on its shard
+            kwargs['queryset'] = kwargs['queryset'].using(shard_for(obj.pk))
+        return kwargs
+
 
 class StudentInline(admin.TabularInline):
     model = Student
     extra = 0
 
 
-class ClassAdmin(admin.ModelAdmin):
+class ClassAdmin(ShardedAdmin):
     list_display = ('id', 'dept', 'sem', 'section')
     search_fields = ('id', 'dept__name', 'sem', 'section')
     ordering = ['dept__name', 'sem', 'section']
@@ -60,7 +138,7 @@ class AssignTimeInline(admin.TabularInline):
     extra = 0
 
 
-class AssignAdmin(admin.ModelAdmin):
+class AssignAdmin(ShardedAdmin):
     inlines = [AssignTimeInline]
     list_display = ('class_id', 'course', 'teacher')
     search_fields = ('class_id__dept__name', 'class_id__id', 'course__name', 'teacher__name', 'course__shortname')
@@ -73,14 +151,18 @@ class MarksInline(admin.TabularInline):
     extra = 0
 
 
-class StudentCourseAdmin(admin.ModelAdmin):
+class StudentCourseAdmin(ShardedAdmin):
     inlines = [MarksInline]
     list_display = ('student', 'course',)
     search_fields = ('student__name', 'course__name', 'student__class_id__id', 'student__class_id__dept__name')
     ordering = ('student__class_id__dept__name', 'student__class_id__id', 'student__USN')
 
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        versions.bump('marks', students=[form.instance.student_id])
 
-class StudentAdmin(admin.ModelAdmin):
+
+class StudentAdmin(ShardedAdmin):
     list_display = ('USN', 'name', 'class_id')
     search_fields = ('USN', 'name', 'class_id__id', 'class_id__dept__name')
     ordering = ['class_id__dept__name', 'class_id__id', 'USN']
@@ -92,11 +174,17 @@ class TeacherAdmin(admin.ModelAdmin):
     ordering = ['dept__name', 'name']
 
 
-class AttendanceClassAdmin(admin.ModelAdmin):
+class AttendanceClassAdmin(ShardedAdmin):
     list_display = ('assign', 'date', 'status')
     ordering = ['assign', 'date']
     change_list_template = 'admin/attendance/attendance_change_list.html'
 
+    def delete_model(self, request, obj):
+        delete_classes(AttendanceClass.objects.filter(id=obj.id))
+
+    def delete_queryset(self, request, queryset):
+        delete_classes(queryset)
+
     def get_urls(self):
         urls = super().get_urls()
         my_urls = [
@@ -105,34 +193,82 @@ class AttendanceClassAdmin(admin.ModelAdmin):
         return my_urls + urls
 
     def reset_attd(self, request):
-
-        start_date = datetime.strptime(request.POST['startdate'], '%Y-%m-%d').date()
-        end_date = datetime.strptime(request.POST['enddate'], '%Y-%m-%d').date()
-
-        try:
-            a = AttendanceRange.objects.all()[:1].get()
-            a.start_date = start_date
-            a.end_date = end_date
-            a.save()
-        except AttendanceRange.DoesNotExist:
-            a = AttendanceRange(start_date=start_date, end_date=end_date)
-            a.save()
-
-        Attendance.objects.all().delete()
-        AttendanceClass.objects.all().delete()
-        for asst in AssignTime.objects.all():
-            for single_date in daterange(start_date, end_date):
-                if single_date.isoweekday() == days[asst.day]:
-                    try:
-                        AttendanceClass.objects.get(date=single_date.strftime("%Y-%m-%d"), assign=asst.assign)
-                    except AttendanceClass.DoesNotExist:
-                        a = AttendanceClass(date=single_date.strftime("%Y-%m-%d"), assign=asst.assign)
-                        a.save()
-
+        start_date = datetime.strptime(request.POST['startdate'], '%Y-%m-%d').date().isoformat()
+        end_date = datetime.strptime(request.POST['enddate'], '%Y-%m-%d').date().isoformat()
+        if settings.BACKGROUND_JOBS:
+            j = reset_attendance.enqueue(start_date, end_date)
+            self.message_user(request, "Attendance reset queued as job %d." % j.id)
+            return HttpResponseRedirect(reverse('admin:info_job_change', args=(j.id,)))
+        reset_attendance(start_date, end_date)
         self.message_user(request, "Attendance Dates reset successfully!")
         return HttpResponseRedirect("../")
 
 
+class HolidayAdmin(admin.ModelAdmin):
+    list_display = ('name', 'start_date', 'end_date', 'dept')
+    list_filter = ('dept',)
+    ordering = ['-start_date']
+
+
+class SubstitutionInline(admin.TabularInline):
+    model = Substitution
+    extra = 0
+    raw_id_fields = ['attendanceclass', 'assigntime', 'teacher']
+
+
+class LeaveAdmin(admin.ModelAdmin):
+    inlines = [SubstitutionInline]
+    list_display = ('teacher', 'start_date', 'end_date')
+    search_fields = ('teacher__name', 'teacher__dept__name')
+    ordering = ['-start_date']
+    actions = ['plan_substitutes']
+
+    def get_formset_kwargs(self, request, obj, inline, prefix):
+        kwargs = super().get_formset_kwargs(request, obj, inline, prefix)
+        if obj is not None:
+            # the substitutions are on the shard of the department of the teacher
+            kwargs['queryset'] = kwargs['queryset'].using(shard_for(obj.teacher.dept_id))
+        return kwargs
+
+    def plan_substitutes(self, request, queryset):
+        # the classes missed are planned on the shard they are on
+        leaves = list(queryset.select_related('teacher'))
+        results = run_on_shards(plan_leaves, leaves).values()
+        planned = [s for p, u in results for s in p]
+        uncovered = [c for p, u in results for c in u]
+        self.message_user(request, "%d substitutions planned, %d classes left uncovered." % (len(planned), len(uncovered)))
+    plan_substitutes.short_description = 'Plan substitutes for selected leaves'
+
+
+class DeviceEventAdmin(ShardedAdmin):
+    list_display = ('usn', 'device', 'timestamp', 'attendanceclass')
+    list_filter = ('device',)
+    search_fields = ('usn', 'key')
+    raw_id_fields = ['attendanceclass']
+    ordering = ['-timestamp']
+
+
+class NotificationAdmin(ShardedAdmin):
+    list_display = ('student', 'kind', 'created', 'sent')
+    list_filter = ('kind', 'sent')
+    search_fields = ('student__USN', 'student__name')
+    raw_id_fields = ['student']
+    ordering = ['-created']
+
+
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'status', 'progress', 'message', 'attempts', 'created', 'finished')
+    list_filter = ('status', 'name')
+    readonly_fields = ('started', 'finished', 'worker', 'created')
+    ordering = ['-id']
+    actions = ['retry']
+
+    def retry(self, request, queryset):
+        n = queryset.filter(status='failed').update(status='queued', attempts=0, run_after=timezone.now(), error='')
+        self.message_user(request, "%d jobs queued again." % n)
+    retry.short_description = 'Run selected failed jobs again'
+
+
 admin.site.register(User, UserAdmin)
 admin.site.register(Dept, DeptAdmin)
 admin.site.register(Class, ClassAdmin)
@@ -142,3 +278,8 @@ admin.site.register(Teacher, TeacherAdmin)
 admin.site.register(Assign, AssignAdmin)
 admin.site.register(StudentCourse, StudentCourseAdmin)
 admin.site.register(AttendanceClass, AttendanceClassAdmin)
+admin.site.register(Holiday, HolidayAdmin)
+admin.site.register(Leave, LeaveAdmin)
+admin.site.register(DeviceEvent, DeviceEventAdmin)
+admin.site.register(Notification, NotificationAdmin)
+admin.site.register(Job, JobAdmin)
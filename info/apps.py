@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class InfoConfig(AppConfig):
     name = 'info'
+
+    def ready(self):
+        # registers the jobs run by run_worker
+        from . import tasks  # noqa: F401
@@ -0,0 +1,169 @@
+"""
+In-process attendance matrices for dashboard queries.
+
+A section is one (class, course) pair. Its attendance is loaded once into a
+student x meeting matrix of bytearrays, kept current by the attendance write
+paths and evicted least-recently-used when too many sections are loaded.
+
+Every process has its own engine. A section remembers the attendance version
+stamp of its class it is current with, and is loaded again when the stamp was
+bumped by a write of another process, such as a reset run by a job worker.
+This needs API_VERSION_CACHE to be shared by the processes.
+"""
+import threading
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .models import Attendance, AttendanceClass, Student, attendance_percentage
+from . import versions
+
+# cell values of the matrix
+UNMARKED = 0
+ABSENT = 1
+PRESENT = 2
+
+
+class SectionMatrix:
+    """Attendance of one class in one course, one bytearray row per student."""
+
+    def __init__(self, class_id, course_id):
+        self.class_id = class_id
+        self.course_id = course_id
+        self.dates = []       # meeting dates, sorted
+        self.meetings = []    # AttendanceClass ids, same order as dates
+        self.columns = {}     # AttendanceClass id -> column
+        self.rows = OrderedDict()  # USN -> bytearray
+        self.stamp = 0        # attendance version of the class the matrix is current with
+
+    @classmethod
+    def load(cls, class_id, course_id):
+        m = cls(class_id, course_id)
+        # the classes not taken yet, or cancelled, are left out
+        meeting_list = AttendanceClass.objects.filter(
+            assign__class_id=class_id, assign__course=course_id, status=1).order_by('date', 'id').values_list('id', 'date')
+        for meeting_id, date in meeting_list:
+            m.meetings.append(meeting_id)
+            m.dates.append(date)
+        m.columns = {meeting_id: j for j, meeting_id in enumerate(m.meetings)}
+
+        width = len(m.meetings)
+        for usn in Student.objects.filter(class_id=class_id).order_by('USN').values_list('USN', flat=True):
+            m.rows[usn] = bytearray(width)
+
+        att_list = Attendance.objects.filter(course=course_id, student__class_id=class_id).values_list(
+            'student_id', 'attendanceclass_id', 'status')
+        for usn, meeting_id, status in att_list:
+            j = m.columns.get(meeting_id)
+            row = m.rows.get(usn)
+            if j is not None and row is not None:
+                row[j] = PRESENT if status else ABSENT
+        return m
+
+    def _column(self, meeting_id, date):
+        j = self.columns.get(meeting_id)
+        if j is not None:
+            return j
+        # extra classes can be added at any date, keep columns sorted by date
+        j = bisect_right(self.dates, date)
+        self.dates.insert(j, date)
+        self.meetings.insert(j, meeting_id)
+        for row in self.rows.values():
+            row[j:j] = bytes(1)
+        self.columns = {mid: k for k, mid in enumerate(self.meetings)}
+        return j
+
+    def set(self, meeting_id, date, statuses):
+        j = self._column(meeting_id, date)
+        for usn, status in statuses.items():
+            row = self.rows.get(usn)
+            if row is None:
+                row = self.rows[usn] = bytearray(len(self.meetings))
+            row[j] = PRESENT if status else ABSENT
+
+    def _span(self, start, end):
+        lo = 0 if start is None else bisect_left(self.dates, start)
+        hi = len(self.dates) if end is None else bisect_right(self.dates, end)
+        return lo, hi
+
+    def counts(self, start=None, end=None):
+        """Return {USN: (attended, total)} for meetings between start and end, inclusive."""
+        lo, hi = self._span(start, end)
+        result = {}
+        for usn, row in self.rows.items():
+            cells = row[lo:hi]
+            result[usn] = (cells.count(PRESENT), hi - lo - cells.count(UNMARKED))
+        return result
+
+
+class AttendanceEngine:
+    """LRU cache of section matrices answering range and threshold queries."""
+
+    def __init__(self, max_sections=None):
+        if max_sections is None:
+            max_sections = getattr(settings, 'ATTENDANCE_ENGINE_SECTIONS', 128)
+        self.max_sections = max_sections
+        self._sections = OrderedDict()
+        self._lock = threading.RLock()
+
+    def section(self, class_id, course_id):
+        key = (class_id, course_id)
+        # read before loading, a write made meanwhile leaves the section stale
+        stamp = versions.class_version('attendance', class_id)
+        with self._lock:
+            m = self._sections.get(key)
+            if m is None or m.stamp < stamp:
+                m = self._sections[key] = SectionMatrix.load(class_id, course_id)
+                m.stamp = stamp
+                while len(self._sections) > self.max_sections:
+                    self._sections.popitem(last=False)
+            else:
+                self._sections.move_to_end(key)
+            return m
+
+    def is_loaded(self, class_id, course_id):
+        return (class_id, course_id) in self._sections
+
+    def record(self, class_id, course_id, meeting_id, date, statuses, previous=None, stamp=None):
+        """
+        Apply {USN: present} for one meeting to a loaded section.
+        Sections that are not loaded are left cold, they are read fresh on next use.
+        previous and stamp are the version of the class before and after the write,
+        a section missing writes made before it by other processes is dropped.
+        """
+        with self._lock:
+            m = self._sections.get((class_id, course_id))
+            if m is None:
+                return
+            if previous is not None and m.stamp < previous:
+                del self._sections[(class_id, course_id)]
+                return
+            m.set(meeting_id, date, statuses)
+            if stamp is not None:
+                m.stamp = stamp
+
+    def evict(self, class_id=None, course_id=None):
+        with self._lock:
+            if class_id is None and course_id is None:
+                self._sections.clear()
+                return
+            for key in list(self._sections):
+                if class_id in (None, key[0]) and course_id in (None, key[1]):
+                    del self._sections[key]
+
+    def percentages(self, class_id, course_id, start=None, end=None):
+        """Return {USN: (attended, total, percentage)} for the section."""
+        with self._lock:
+            counts = self.section(class_id, course_id).counts(start, end)
+        return {usn: (a, t, attendance_percentage(a, t)) for usn, (a, t) in counts.items()}
+
+    def below(self, class_id, course_id, threshold=75, start=None, end=None):
+        """Return [(USN, percentage)] of students under threshold, lowest first."""
+        result = [(usn, p) for usn, (a, t, p) in self.percentages(class_id, course_id, start, end).items()
+                  if t and p < threshold]
+        result.sort(key=lambda x: x[1])
+        return result
+
+
+engine = AttendanceEngine()
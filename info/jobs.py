@@ -0,0 +1,106 @@
+"""
+Background jobs stored in the Job table.
+
+Functions decorated with @job are called as usual, and queued with
+fn.enqueue(*args, **kwargs), which returns the Job row to poll. The arguments
+must be JSON serializable. Workers started with `manage.py run_worker` claim
+the queued jobs one at a time, several workers can run side by side. A failed
+job is retried after JOB_RETRY_DELAY seconds, doubled on every attempt, until
+it has run max_attempts times. A job still running after JOB_TIMEOUT seconds
+is taken to have lost its worker and is claimed again.
+"""
+import contextvars
+import os
+import socket
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Job
+
+registry = {}
+_current = contextvars.ContextVar('current_job', default=None)
+
+
+def job(fn=None, *, name=None, max_attempts=None):
+    """Register fn as a job, under name or its module and function name."""
+    def register(fn):
+        key = name or '%s.%s' % (fn.__module__, fn.__name__)
+        registry[key] = fn
+
+        def enqueue(*args, run_after=None, **kwargs):
+            return Job.objects.create(
+                name=key, args=list(args), kwargs=kwargs, run_after=run_after or timezone.now(),
+                max_attempts=max_attempts or getattr(settings, 'JOB_MAX_ATTEMPTS', 3))
+        fn.job_name = key
+        fn.enqueue = enqueue
+        return fn
+    return register(fn) if fn else register
+
+
+def progress(percent, message=''):
+    """Report the progress of the running job, does nothing outside of a job."""
+    j = _current.get()
+    if j is not None:
+        j.progress = min(max(int(percent), 0), 100)
+        j.message = message[:200]
+        Job.objects.filter(id=j.id).update(progress=j.progress, message=j.message)
+
+
+def worker_name():
+    return '%s:%d' % (socket.gethostname(), os.getpid())
+
+
+def claim(worker):
+    """Claim the next job due, or return None."""
+    now = timezone.now()
+    stale = now - timedelta(seconds=getattr(settings, 'JOB_TIMEOUT', 3600))
+    due = Job.objects.filter(Q(status='queued', run_after__lte=now) | Q(status='running', started__lt=stale))
+    for j in due.order_by('run_after', 'id')[:10]:
+        # only one worker changes the row from the state it was read in
+        if Job.objects.filter(id=j.id, status=j.status, attempts=j.attempts).update(
+                status='running', started=now, worker=worker, attempts=j.attempts + 1):
+            j.refresh_from_db()
+            return j
+    return None
+
+
+def run(j):
+    """Run a claimed job and record its result, or its error and the next attempt."""
+    token = _current.set(j)
+    try:
+        fn = registry.get(j.name)
+        if fn is None:
+            raise LookupError('no job named %s' % j.name)
+        j.result = fn(*j.args, **j.kwargs)
+        j.status, j.progress, j.error = 'done', 100, ''
+    except Exception:
+        j.error = traceback.format_exc()
+        if j.attempts < j.max_attempts:
+            delay = getattr(settings, 'JOB_RETRY_DELAY', 30) * 2 ** (j.attempts - 1)
+            j.status, j.run_after = 'queued', timezone.now() + timedelta(seconds=delay)
+        else:
+            j.status = 'failed'
+    finally:
+        _current.reset(token)
+    j.finished = timezone.now()
+    j.save(update_fields=['status', 'progress', 'result', 'error', 'run_after', 'finished'])
+    return j
+
+
+def work(worker=None, limit=None):
+    """Run the jobs due until there are none left, or limit of them, and return the count."""
+    worker = worker or worker_name()
+    count = 0
+    while limit is None or count < limit:
+        close_old_connections()
+        j = claim(worker)
+        if j is None:
+            break
+        run(j)
+        count += 1
+    return count
@@ -0,0 +1,109 @@
+"""
+Substitute planning for teacher leave.
+
+All affected classes of a set of leaves are planned together against a free
+slot index of the whole timetable, and the substitutions are saved in one batch.
+"""
+from collections import defaultdict, Counter
+from datetime import timedelta
+from itertools import chain
+
+from django.db import transaction
+
+from .models import AssignTime, AttendanceClass, Leave, Substitution, Teacher, class_dates, closed_dates, dept_closed_dates
+from .sharding import current_alias
+
+
+def free_slot_index():
+    """Return {(day, period): set of teacher ids busy in that slot} for the weekly timetable."""
+    busy = defaultdict(set)
+    for teacher_id, day, period in AssignTime.objects.values_list('assign__teacher_id', 'day', 'period'):
+        busy[(day, period)].add(teacher_id)
+    return busy
+
+
+def plan_leaves(leaves):
+    """
+    Find a substitute for every class missed during the given leaves.
+    Substitutes are free department colleagues, the least loaded is picked first.
+    Returns (substitutions created, [(AttendanceClass, AssignTime)] left uncovered).
+    """
+    leaves = list(leaves)
+    if not leaves:
+        return [], []
+    start_date = min(l.start_date for l in leaves)
+    end_date = max(l.end_date for l in leaves)
+
+    # every leave of the period, colleagues away on other leaves cannot substitute
+    on_leave = defaultdict(set)
+    overlapping = Leave.objects.filter(start_date__lte=end_date, end_date__gte=start_date)
+    for l in chain(leaves, overlapping):
+        for n in range((l.end_date - l.start_date).days + 1):
+            on_leave[l.start_date + timedelta(n)].add(l.teacher_id)
+
+    teacher_ids = {l.teacher_id for l in leaves}
+    asst_list = list(AssignTime.objects.filter(assign__teacher_id__in=teacher_ids).select_related(
+        'assign__class_id', 'assign__teacher'))
+    depts = {asst.assign.teacher.dept_id for asst in asst_list}
+    colleagues = defaultdict(list)
+    for t_id, dept_id in Teacher.objects.filter(dept__in=depts).values_list('id', 'dept_id'):
+        colleagues[dept_id].append(t_id)
+
+    # missed (AssignTime, date, leave) triples, skipping closed days
+    closed = closed_dates(start_date, end_date + timedelta(1))
+    missed = []
+    for l in leaves:
+        for asst in asst_list:
+            if asst.assign.teacher_id != l.teacher_id:
+                continue
+            dept_closed = dept_closed_dates(closed, asst.assign.class_id.dept_id)
+            for single_date in class_dates(asst.day, l.start_date, l.end_date + timedelta(1), dept_closed):
+                missed.append((asst, single_date, l))
+    if not missed:
+        return [], []
+
+    assign_ids = {asst.assign_id for asst, d, l in missed}
+    meetings = {(a.assign_id, a.date): a for a in AttendanceClass.objects.filter(
+        assign__in=assign_ids, date__range=(start_date, end_date))}
+    new_meetings = {}
+    for asst, single_date, l in missed:
+        key = (asst.assign_id, single_date)
+        if key not in meetings and key not in new_meetings:
+            new_meetings[key] = AttendanceClass(assign_id=asst.assign_id, date=single_date)
+
+    # current substitutions count towards load and occupy their slot
+    load = Counter()
+    taken = defaultdict(set)
+    covered = set()
+    for s in Substitution.objects.filter(attendanceclass__date__range=(start_date, end_date)).select_related(
+            'attendanceclass', 'assigntime'):
+        load[s.teacher_id] += 1
+        taken[(s.attendanceclass.date, s.assigntime.period)].add(s.teacher_id)
+        covered.add((s.attendanceclass_id, s.assigntime_id))
+
+    busy = free_slot_index()
+    planned = []
+    uncovered = []
+    with transaction.atomic(using=current_alias()):
+        if new_meetings:
+            # lazy mode: materialize the missed classes in one batch
+            AttendanceClass.objects.bulk_create(new_meetings.values())
+            meetings.update({(a.assign_id, a.date): a for a in AttendanceClass.objects.filter(
+                assign__in=assign_ids, date__range=(start_date, end_date))})
+
+        missed.sort(key=lambda x: (x[1], x[0].period, x[0].id))
+        for asst, single_date, l in missed:
+            assc = meetings[(asst.assign_id, single_date)]
+            if assc.status == 2 or (assc.id, asst.id) in covered:
+                continue
+            unavailable = busy[(asst.day, asst.period)] | on_leave[single_date] | taken[(single_date, asst.period)]
+            free = [t_id for t_id in colleagues[asst.assign.teacher.dept_id] if t_id not in unavailable]
+            if not free:
+                uncovered.append((assc, asst))
+                continue
+            sub = min(free, key=lambda t_id: (load[t_id], t_id))
+            load[sub] += 1
+            taken[(single_date, asst.period)].add(sub)
+            planned.append(Substitution(attendanceclass=assc, assigntime=asst, teacher_id=sub, leave=l))
+        Substitution.objects.bulk_create(planned)
+    return planned, uncovered
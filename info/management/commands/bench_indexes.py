@@ -0,0 +1,120 @@
+import random
+import time
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from info.models import Dept, Class, Course, Teacher, Student, Assign, AssignTime, AttendanceClass, Attendance, \
+    StudentCourse, DAYS_OF_WEEK, time_slots
+
+INDEXED_MODELS = (Attendance, AttendanceClass, StudentCourse, AssignTime)
+
+
+class Command(BaseCommand):
+    help = 'Time the hot attendance queries with and without the composite indexes, ' \
+           'on synthetic rows in a throwaway test database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000, help='Attendance rows to generate')
+        parser.add_argument('--classes', type=int, default=20)
+        parser.add_argument('--students', type=int, default=50, help='Students per class')
+        parser.add_argument('--courses', type=int, default=5, help='Courses per class')
+        parser.add_argument('--repeat', type=int, default=200, help='Queries per shape')
+
+    def handle(self, *args, **options):
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.populate(options)
+            before = self.run_queries(options['repeat'], indexed=False)
+            after = self.run_queries(options['repeat'], indexed=True)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self.stdout.write('%-38s %12s %12s %9s' % ('query', 'before (ms)', 'after (ms)', 'speedup'))
+        for name in before:
+            b, a = before[name], after[name]
+            self.stdout.write('%-38s %12.3f %12.3f %8.1fx' % (name, b, a, b / a if a else 0))
+
+    def populate(self, options):
+        self.stdout.write('Generating %d attendance rows...' % options['rows'])
+        dept = Dept.objects.create(id='BENCH', name='Benchmark')
+        teacher = Teacher.objects.create(id='BENCH_T', dept=dept, name='Bench Teacher')
+        classes = Class.objects.bulk_create(
+            [Class(id='BENCH%d' % i, dept=dept, sem=1, section=str(i)) for i in range(options['classes'])])
+        courses = Course.objects.bulk_create(
+            [Course(id='BENCHC%d' % i, dept=dept, name='Bench %d' % i) for i in range(options['courses'])])
+        Student.objects.bulk_create([Student(USN='BENCH%d_%d' % (i, j), class_id=cl, name='s')
+                                     for i, cl in enumerate(classes) for j in range(options['students'])])
+        Assign.objects.bulk_create([Assign(class_id=cl, course=cr, teacher=teacher) for cl in classes for cr in courses])
+        self.assigns = list(Assign.objects.filter(teacher=teacher))
+        self.students = {cl.id: list(cl.student_set.all()) for cl in classes}
+        StudentCourse.objects.bulk_create([StudentCourse(student=s, course=cr)
+                                           for cl in classes for s in self.students[cl.id] for cr in courses])
+        slots = [(d[0], p[0]) for d in DAYS_OF_WEEK for p in time_slots]
+        AssignTime.objects.bulk_create([AssignTime(assign=a, day=slots[i % len(slots)][0], period=slots[i % len(slots)][1])
+                                        for i, a in enumerate(self.assigns)])
+
+        meetings = max(1, options['rows'] // (len(self.assigns) * options['students']))
+        start = date(2020, 1, 1)
+        AttendanceClass.objects.bulk_create([AttendanceClass(assign=a, date=start + timedelta(n), status=1)
+                                             for a in self.assigns for n in range(meetings)], batch_size=5000)
+        batch = []
+        for assc in AttendanceClass.objects.filter(assign__in=self.assigns).select_related('assign').iterator():
+            for s in self.students[assc.assign.class_id_id]:
+                batch.append(Attendance(course_id=assc.assign.course_id, student=s, attendanceclass=assc,
+                                        date=assc.date, status=random.random() < 0.8))
+            if len(batch) >= 20000:
+                Attendance.objects.bulk_create(batch)
+                batch = []
+        Attendance.objects.bulk_create(batch)
+
+    def set_indexes(self, indexed):
+        with connection.schema_editor() as editor:
+            for model in INDEXED_MODELS:
+                for index in model._meta.indexes:
+                    if indexed:
+                        editor.add_index(model, index)
+                    else:
+                        editor.remove_index(model, index)
+        if connection.vendor in ('sqlite', 'postgresql'):
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+    def run_queries(self, repeat, indexed):
+        self.set_indexes(indexed)
+        rnd = random.Random(1)
+        picks = []
+        for n in range(repeat):
+            a = rnd.choice(self.assigns)
+            picks.append((a, rnd.choice(self.students[a.class_id_id])))
+        first = AttendanceClass.objects.filter(assign__in=self.assigns).values_list('id', flat=True)
+        assc_ids = {a.id: list(first.filter(assign=a)) for a in self.assigns}
+
+        shapes = {
+            'Attendance(course, student, status)':
+                lambda a, s: Attendance.objects.filter(course=a.course_id, student=s, status='True').count(),
+            'Attendance(course, student)':
+                lambda a, s: Attendance.objects.filter(course=a.course_id, student=s).count(),
+            'Attendance(attendanceclass, course)':
+                lambda a, s: len(Attendance.objects.filter(attendanceclass=assc_ids[a.id][-1], course=a.course_id)),
+            'AttendanceClass(assign, date)':
+                lambda a, s: len(AttendanceClass.objects.filter(assign=a, date__lte=date(2020, 3, 1)).order_by('-date')),
+            'StudentCourse(course, student)':
+                lambda a, s: StudentCourse.objects.get(course=a.course_id, student=s),
+            'AssignTime(class, day, period)':
+                lambda a, s: AssignTime.objects.filter(assign__class_id=a.class_id_id, day='Monday',
+                                                       period='7:30 - 8:30').exists(),
+        }
+        result = {}
+        for name, query in shapes.items():
+            best = None
+            # best of three rounds to keep noise out of the comparison
+            for r in range(3):
+                started = time.perf_counter()
+                for a, s in picks:
+                    query(a, s)
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            result[name] = best * 1000 / repeat
+        return result
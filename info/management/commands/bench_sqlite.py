@@ -0,0 +1,146 @@
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, connections, OperationalError
+from django.test.utils import override_settings
+
+from apis.views import attendance_summary, marks_summary, timetable_rows
+from info.models import Dept, Class, Course, Teacher, Student, Assign, AttendanceClass, Attendance, \
+    StudentCourse, Marks, MarksClass, test_name
+from info.records import record_attendance, record_marks
+
+# SQLite as Django configures it without a profile
+DEFAULT_PROFILE = {
+    'pragmas': {'journal_mode': 'DELETE', 'synchronous': 'FULL'},
+    'options': {'timeout': 5},
+    'persistent': False,
+}
+
+
+class Command(BaseCommand):
+    help = 'Run concurrent readers and writers with the ERP queries on a temporary SQLite database, ' \
+           'with SQLite defaults and with the configured profile.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=8)
+        parser.add_argument('--writers', type=int, default=4)
+        parser.add_argument('--seconds', type=float, default=5)
+        parser.add_argument('--classes', type=int, default=10)
+        parser.add_argument('--students', type=int, default=60, help='Students per class')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            self.stderr.write('The default database is not SQLite.')
+            return
+        tuned = {
+            'pragmas': getattr(settings, 'SQLITE_PROFILE', {}),
+            'options': dict(connection.settings_dict['OPTIONS']),
+            'persistent': connection.settings_dict['CONN_MAX_AGE'] != 0,
+        }
+        with tempfile.TemporaryDirectory() as tmp:
+            connection.settings_dict['TEST']['NAME'] = os.path.join(tmp, 'bench.sqlite3')
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                self.populate(options)
+                results = [('sqlite defaults', self.run(DEFAULT_PROFILE, options)),
+                           ('profile', self.run(tuned, options))]
+            finally:
+                connection.close()
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self.stdout.write('%-16s %12s %12s %10s' % ('', 'reads/s', 'writes/s', 'errors'))
+        for name, (reads, writes, errors) in results:
+            self.stdout.write('%-16s %12.0f %12.0f %10d' % (
+                name, reads / options['seconds'], writes / options['seconds'], errors))
+
+    def populate(self, options):
+        dept = Dept.objects.create(id='BENCH', name='Benchmark')
+        teacher = Teacher.objects.create(id='BENCH_T', dept=dept, name='Bench Teacher')
+        classes = Class.objects.bulk_create(
+            [Class(id='BENCH%d' % i, dept=dept, sem=1, section=str(i)) for i in range(options['classes'])])
+        courses = Course.objects.bulk_create(
+            [Course(id='BENCHC%d' % i, dept=dept, name='Bench %d' % i) for i in range(5)])
+        Assign.objects.bulk_create([Assign(class_id=cl, course=cr, teacher=teacher) for cl in classes for cr in courses])
+        self.assigns = list(Assign.objects.filter(teacher=teacher).select_related('class_id'))
+        Student.objects.bulk_create([Student(USN='BENCH%d_%d' % (i, j), class_id=cl, name='s')
+                                     for i, cl in enumerate(classes) for j in range(options['students'])])
+        self.students = {cl.id: list(Student.objects.filter(class_id=cl)) for cl in classes}
+        StudentCourse.objects.bulk_create([StudentCourse(student=s, course=cr)
+                                           for cl in classes for s in self.students[cl.id] for cr in courses])
+        Marks.objects.bulk_create([Marks(studentcourse=sc, name=t[0])
+                                   for sc in StudentCourse.objects.all() for t in test_name])
+        MarksClass.objects.bulk_create([MarksClass(assign=a, name=t[0]) for a in self.assigns for t in test_name])
+        start = date(2020, 1, 1)
+        AttendanceClass.objects.bulk_create([AttendanceClass(assign=a, date=start + timedelta(n))
+                                             for a in self.assigns for n in range(40)])
+        rnd = random.Random(1)
+        for a in self.assigns:
+            assc_list = list(AttendanceClass.objects.filter(assign=a)[:30])
+            Attendance.objects.bulk_create([
+                Attendance(course_id=a.course_id, student=s, attendanceclass=assc, date=assc.date,
+                           status=rnd.random() < 0.8) for assc in assc_list for s in self.students[a.class_id_id]])
+        self.meetings = list(AttendanceClass.objects.select_related('assign__class_id'))
+        self.tests = list(MarksClass.objects.select_related('assign__class_id'))
+
+    def read(self, rnd):
+        # the student dashboard
+        stud = rnd.choice(self.students[rnd.choice(self.assigns).class_id_id])
+        attendance_summary(stud)
+        marks_summary(stud)
+        timetable_rows(stud.class_id_id)
+
+    def write(self, rnd):
+        # a teacher submitting attendance or marks for a whole class
+        if rnd.random() < 0.8:
+            assc = rnd.choice(self.meetings)
+            record_attendance(assc, {s.USN: rnd.random() < 0.8 for s in self.students[assc.assign.class_id_id]})
+        else:
+            mc = rnd.choice(self.tests)
+            record_marks(mc, {s.USN: rnd.randrange(21) for s in self.students[mc.assign.class_id_id]})
+
+    def run(self, profile, options):
+        counts = {'read': 0, 'write': 0, 'errors': 0}
+        lock = threading.Lock()
+        stop = time.monotonic() + options['seconds']
+
+        def worker(op, seed):
+            rnd = random.Random(seed)
+            n = errors = 0
+            try:
+                while time.monotonic() < stop:
+                    try:
+                        op(rnd)
+                        n += 1
+                    except OperationalError:
+                        errors += 1
+                    if not profile['persistent']:
+                        # a new connection per request, as with CONN_MAX_AGE = 0
+                        connection.close()
+            finally:
+                connection.close()
+                with lock:
+                    counts[op.__name__] += n
+                    counts['errors'] += errors
+
+        settings_dict = connections.settings[connection.alias]
+        old_options = settings_dict['OPTIONS']
+        settings_dict['OPTIONS'] = profile['options']
+        connection.close()
+        try:
+            with override_settings(SQLITE_PRAGMAS=profile['pragmas']):
+                threads = [threading.Thread(target=worker, args=(self.read, i)) for i in range(options['readers'])]
+                threads += [threading.Thread(target=worker, args=(self.write, 1000 + i))
+                            for i in range(options['writers'])]
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join()
+        finally:
+            settings_dict['OPTIONS'] = old_options
+        return counts['read'], counts['write'], counts['errors']
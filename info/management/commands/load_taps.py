@@ -0,0 +1,80 @@
+import random
+import time
+from datetime import datetime, timedelta
+
+from django.contrib.auth.models import Permission
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from info.models import Dept, Class, Course, Teacher, Student, Assign, AssignTime, User, DAYS_OF_WEEK, time_slots
+from info.timetable import index as timetable_index, parse_slot
+
+
+class Command(BaseCommand):
+    help = 'Post synthetic device taps to the ingestion API, in a throwaway test database, ' \
+           'and report the events per second.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=int, default=50000)
+        parser.add_argument('--batch', type=int, default=1000, help='Events per request')
+        parser.add_argument('--classes', type=int, default=20)
+        parser.add_argument('--students', type=int, default=60, help='Students per class')
+
+    def handle(self, *args, **options):
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            client = self.populate(options)
+            events = self.events(options)
+            batches = [events[i:i + options['batch']] for i in range(0, len(events), options['batch'])]
+            for name in ('first delivery', 'retry'):
+                started = time.perf_counter()
+                totals = {'accepted': 0, 'duplicates': 0, 'unmatched': 0}
+                for batch in batches:
+                    resp = client.post('/api/devices/taps/', batch, format='json')
+                    for k, v in resp.data.items():
+                        totals[k] += v
+                elapsed = time.perf_counter() - started
+                self.stdout.write('%-15s %8.0f events/s  %s' % (name, len(events) / elapsed, totals))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def populate(self, options):
+        dept = Dept.objects.create(id='LOAD', name='Load')
+        teacher = Teacher.objects.create(id='LOAD_T', dept=dept, name='Load Teacher')
+        classes = Class.objects.bulk_create(
+            [Class(id='LOAD%d' % i, dept=dept, sem=1, section=str(i)) for i in range(options['classes'])])
+        courses = Course.objects.bulk_create(
+            [Course(id='LOADC%d' % i, dept=dept, name='Load %d' % i) for i in range(len(time_slots))])
+        Assign.objects.bulk_create([Assign(class_id=cl, course=cr, teacher=teacher) for cl in classes for cr in courses])
+        # every period of the week is taught, one course per period
+        assigns = {(a.class_id_id, a.course_id): a for a in Assign.objects.filter(teacher=teacher)}
+        AssignTime.objects.bulk_create([
+            AssignTime(assign=assigns[cl.id, courses[j].id], day=d[0], period=p[0])
+            for cl in classes for d in DAYS_OF_WEEK for j, p in enumerate(time_slots)])
+        Student.objects.bulk_create([Student(USN='LOAD%d_%d' % (i, j), class_id=cl, name='s')
+                                     for i, cl in enumerate(classes) for j in range(options['students'])])
+        self.students = list(Student.objects.filter(class_id__dept=dept).values_list('USN', flat=True))
+        timetable_index.invalidate()
+
+        user = User.objects.create(username='load_reader')
+        user.user_permissions.add(Permission.objects.get(codename='add_deviceevent'))
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=user).key)
+        return client
+
+    def events(self, options):
+        rnd = random.Random(1)
+        # a Monday in the past, taps spread over the periods of the week
+        monday = timezone.localdate() - timedelta(days=timezone.localdate().weekday() + 7)
+        slots = [parse_slot(p[0]) for p in time_slots]
+        events = []
+        for n in range(options['events']):
+            day = monday + timedelta(days=rnd.randrange(len(DAYS_OF_WEEK)))
+            start, end = rnd.choice(slots)
+            moment = datetime.combine(day, start) + timedelta(minutes=rnd.randrange(-5, 30))
+            events.append({'key': 'load-%d' % n, 'usn': rnd.choice(self.students), 'device': 'door-%d' % (n % 50),
+                           'timestamp': timezone.make_aware(moment).isoformat()})
+        return events
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from info.tasks import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Recompute the daily class and weekly student attendance rollups from the attendance rows.'
+
+    def handle(self, *args, **options):
+        counts = rebuild_rollups()
+        self.stdout.write('%d class days, %d student weeks' % (counts['class_days'], counts['student_weeks']))
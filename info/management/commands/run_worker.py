@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from info.jobs import work, worker_name
+
+
+class Command(BaseCommand):
+    help = 'Run the queued background jobs. Several workers can run at the same time.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sleep', type=float, default=2,
+                            help='seconds to wait when there is no job to run')
+        parser.add_argument('--burst', action='store_true',
+                            help='stop once the queue is empty')
+
+    def handle(self, *args, **options):
+        worker = worker_name()
+        self.stdout.write('worker %s started' % worker)
+        while True:
+            count = work(worker)
+            if count:
+                self.stdout.write('%d jobs run' % count)
+            if options['burst']:
+                return
+            time.sleep(options['sleep'])
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from info.notifications import send_pending
+
+
+class Command(BaseCommand):
+    help = 'Email the queued attendance shortage and marks notifications, one message per address.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0,
+                            help='keep running and send the queue every INTERVAL seconds')
+
+    def handle(self, *args, **options):
+        while True:
+            sent = send_pending()
+            if sent or not options['interval']:
+                self.stdout.write('%d messages sent' % sent)
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from info.models import Class, Student, Attendance, Marks
+from info.sharding import fan_out
+
+
+def shard_counts(alias):
+    return [m.objects.using(alias).count() for m in (Class, Student, Attendance, Marks)]
+
+
+class Command(BaseCommand):
+    help = 'Count the department rows of every shard, querying the shards in parallel.'
+
+    def handle(self, *args, **options):
+        self.stdout.write('%-16s %10s %10s %12s %10s' % ('database', 'classes', 'students', 'attendance', 'marks'))
+        for alias, counts in fan_out(shard_counts).items():
+            self.stdout.write('%-16s %10d %10d %12d %10d' % ((alias,) + tuple(counts)))
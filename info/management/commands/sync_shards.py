@@ -0,0 +1,30 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from info.sharding import id_start, reserve_ids, shard_aliases, shared_models
+
+
+class Command(BaseCommand):
+    help = 'Migrate the department shards, give each its own block of ids and copy the shared rows ' \
+           '(users, departments, courses, teachers, ...) from the default database to them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--no-migrate', action='store_true', help='Only copy the shared rows')
+
+    def handle(self, *args, **options):
+        shards = [alias for alias in shard_aliases() if alias != DEFAULT_DB_ALIAS]
+        if not shards:
+            self.stdout.write('DEPT_SHARDS is empty, nothing to do.')
+            return
+        for alias in shards:
+            if not options['no_migrate']:
+                call_command('migrate', database=alias, verbosity=0)
+            reserve_ids(alias)
+            self.stdout.write('%s: ids from %d' % (alias, id_start(alias) + 1))
+            for model in shared_models():
+                objs = list(model.objects.using(DEFAULT_DB_ALIAS).all())
+                fields = [f.name for f in model._meta.concrete_fields if not f.primary_key]
+                model.objects.using(alias).bulk_create(objs, batch_size=500, update_conflicts=True,
+                                                       unique_fields=[model._meta.pk.name], update_fields=fields)
+                self.stdout.write('%s: %d %s rows' % (alias, len(objs), model._meta.model_name))
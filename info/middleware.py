@@ -0,0 +1,104 @@
+from django.conf import settings
+from django.contrib.auth.middleware import get_user
+from django.utils.functional import SimpleLazyObject
+
+from .models import ROLES_SESSION_KEY
+from .routers import replica_reads
+from .sharding import request_shard_of, url_shard
+
+
+class RolesMiddleware:
+    """
+    Primes request.user.roles from the session, where it is stored at login,
+    so role checks in views and templates do not query the profile tables.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.user = SimpleLazyObject(lambda: self.get_user(request))
+        return self.get_response(request)
+
+    def get_user(self, request):
+        user = get_user(request)
+        if user.is_authenticated:
+            roles = request.session.get(ROLES_SESSION_KEY)
+            if roles is None:
+                # sessions created before roles were stored
+                request.session[ROLES_SESSION_KEY] = sorted(user.roles)
+            else:
+                user.__dict__['roles'] = frozenset(roles)
+        return user
+
+
+class ReplicaMiddleware:
+    """
+    Serves the reads of reporting GET requests from the read replica, see info.routers.
+    Clients are pinned to the primary for REPLICA_STICKY_SECONDS after a write request,
+    so a teacher sees the attendance they just submitted. The pin is a signed cookie,
+    which every process serving the client reads.
+    """
+    pin_cookie = 'replica_pin'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not getattr(settings, 'READ_REPLICA', None):
+            return self.get_response(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            reads = getattr(request, 'replica_reads', None)
+            if reads is not None:
+                reads.__exit__(None, None, None)
+        if reads is None and request.method not in ('GET', 'HEAD') and response.status_code < 400:
+            seconds = getattr(settings, 'REPLICA_STICKY_SECONDS', 10)
+            response.set_signed_cookie(self.pin_cookie, '1', max_age=seconds, httponly=True, samesite='Lax',
+                                       secure=request.is_secure())
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not getattr(settings, 'READ_REPLICA', None) or request.method not in ('GET', 'HEAD'):
+            return None
+        url_name = request.resolver_match.url_name or ''
+        # class based views carry the mark on their class, False keeps an API view on the primary
+        marked = getattr(getattr(view_func, 'view_class', view_func), 'read_replica', None)
+        if marked is False or not (marked or url_name.endswith('_changelist') or request.path.startswith('/api/')):
+            return None
+        if self.pinned(request):
+            return None
+        # left in __call__, once the response is rendered
+        request.replica_reads = replica_reads()
+        request.replica_reads.__enter__()
+        return None
+
+    def pinned(self, request):
+        # the signature carries the time the cookie was set, older pins are ignored
+        return request.get_signed_cookie(
+            self.pin_cookie, default=None, max_age=getattr(settings, 'REPLICA_STICKY_SECONDS', 10)) is not None
+
+
+class ShardMiddleware:
+    """
+    Sends the queries of department rows to the shard of the class, assign, ...
+    named in the URL, or else of the student or teacher making the request, see
+    info.sharding. The user is looked up at the first such query, once the API
+    views have authenticated it.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not getattr(settings, 'DEPT_SHARDS', None):
+            return self.get_response(request)
+        with request_shard_of(request):
+            return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if getattr(settings, 'DEPT_SHARDS', None):
+            alias = url_shard(view_kwargs)
+            if alias:
+                request.shard = alias
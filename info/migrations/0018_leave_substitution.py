@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('info', '0017_holiday'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Leave',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start_date', models.DateField()),
+                ('end_date', models.DateField()),
+                ('teacher', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='info.teacher')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Substitution',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('assigntime', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='info.assigntime')),
+                ('attendanceclass', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='info.attendanceclass')),
+                ('leave', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='info.leave')),
+                ('teacher', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='info.teacher')),
+            ],
+            options={
+                'unique_together': {('attendanceclass', 'assigntime')},
+            },
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('info', '0018_leave_substitution'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='assigntime',
+            index=models.Index(fields=['assign', 'day', 'period'], name='info_asst_assign_day_period'),
+        ),
+        migrations.AddIndex(
+            model_name='assigntime',
+            index=models.Index(fields=['day', 'period'], name='info_asst_day_period'),
+        ),
+        migrations.AddIndex(
+            model_name='attendance',
+            index=models.Index(fields=['course', 'student', 'status'], name='info_att_course_stud_status'),
+        ),
+        migrations.AddIndex(
+            model_name='attendance',
+            index=models.Index(fields=['attendanceclass', 'course'], name='info_att_class_course'),
+        ),
+        migrations.AddIndex(
+            model_name='attendance',
+            index=models.Index(condition=models.Q(('status', True)), fields=['course', 'student'], name='info_att_present'),
+        ),
+        migrations.AddIndex(
+            model_name='attendanceclass',
+            index=models.Index(fields=['assign', 'date'], name='info_attc_assign_date'),
+        ),
+        migrations.AddIndex(
+            model_name='studentcourse',
+            index=models.Index(fields=['course', 'student'], name='info_sc_course_student'),
+        ),
+    ]
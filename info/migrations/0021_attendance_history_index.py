@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('info', '0020_modified_timestamps'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='attendance',
+            index=models.Index(fields=['student', 'course', 'date', 'id'], name='info_att_history'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('info', '0021_attendance_history_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeviceEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=100, unique=True)),
+                ('device', models.CharField(max_length=100)),
+                ('usn', models.CharField(max_length=100)),
+                ('timestamp', models.DateTimeField()),
+                ('received', models.DateTimeField(auto_now_add=True)),
+                ('attendanceclass', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='info.attendanceclass')),
+            ],
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:06
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def remove_duplicates(apps, schema_editor):
+    # classes confirmed twice have two rows per student, keep the latest
+    Attendance = apps.get_model('info', 'Attendance')
+    db = schema_editor.connection.alias
+    dups = Attendance.objects.using(db).values('attendanceclass', 'student').annotate(
+        n=Count('id'), last=Max('id')).filter(n__gt=1)
+    for d in dups.iterator():
+        Attendance.objects.using(db).filter(attendanceclass=d['attendanceclass'], student=d['student']).exclude(
+            id=d['last']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('info', '0022_deviceevent'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='attendance',
+            constraint=models.UniqueConstraint(fields=('attendanceclass', 'student'), name='info_att_class_student'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('info', '0023_attendance_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClassDayRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('present', models.PositiveIntegerField(default=0)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('class_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='info.class')),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='info.course')),
+            ],
+            options={
+                'unique_together': {('class_id', 'course', 'date')},
+            },
+        ),
+        migrations.CreateModel(
+            name='StudentWeekRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('week', models.DateField()),
+                ('present', models.PositiveIntegerField(default=0)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='info.course')),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='info.student')),
+            ],
+            options={
+                'unique_together': {('student', 'course', 'week')},
+            },
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:14
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def fill_counts(apps, schema_editor):
+    Attendance = apps.get_model('info', 'Attendance')
+    AttendanceTotal = apps.get_model('info', 'AttendanceTotal')
+    db = schema_editor.connection.alias
+    totals = []
+    # only the classes taken count, as in info.rollups
+    for r in Attendance.objects.using(db).filter(attendanceclass__status=1).values('student_id', 'course_id').annotate(
+            present_count=Count('id', filter=Q(status=True)), total_count=Count('id')).order_by():
+        r['percentage'] = round(r['present_count'] / r['total_count'] * 100, 2)
+        totals.append(AttendanceTotal(**r))
+    AttendanceTotal.objects.using(db).bulk_create(
+        totals, batch_size=1000, update_conflicts=True, unique_fields=['student', 'course'],
+        update_fields=['present_count', 'total_count', 'percentage'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('info', '0024_attendance_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attendancetotal',
+            name='percentage',
+            field=models.FloatField(db_index=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='attendancetotal',
+            name='present_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='attendancetotal',
+            name='total_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_counts, migrations.RunPython.noop),
+    ]
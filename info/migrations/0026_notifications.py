@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('info', '0025_attendance_shortage_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='student',
+            name='parent_email',
+            field=models.EmailField(blank=True, max_length=254),
+        ),
+        migrations.CreateModel(
+            name='Notification',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('shortage', 'Attendance shortage'), ('marks', 'Marks published')], max_length=20)),
+                ('text', models.TextField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('sent', models.DateTimeField(blank=True, db_index=True, null=True)),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='info.student')),
+            ],
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('info', '0027_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attendanceclass',
+            name='holiday',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='info.holiday'),
+        ),
+    ]
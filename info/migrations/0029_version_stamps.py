@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('info', '0028_attendanceclass_holiday'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VersionStamp',
+            fields=[
+                ('key', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('stamp', models.FloatField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:18
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('info', '0029_version_stamps'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='attendance',
+            name='info_att_class_course',
+        ),
+        migrations.RemoveIndex(
+            model_name='attendance',
+            name='info_att_present',
+        ),
+    ]
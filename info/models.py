@@ -1,9 +1,17 @@
 from django.db import models
 import math
+from django.conf import settings
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.contrib.auth.models import AbstractUser
-from django.db.models.signals import post_save, post_delete
+from django.contrib.auth.signals import user_logged_in
+from django.utils import timezone
+from django.utils.functional import cached_property
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.db.backends.signals import connection_created
 from datetime import timedelta
+from . import versions
+from .db import configure_sqlite
+from .sharding import ShardedQuerySet, copy_to_shards, locate, on_shard_of, shard_aliases, shard_for, use_alias
 
 # Create your models here.
 sex_choice = (
@@ -42,18 +50,32 @@ test_name = (
 )
 
 
+ROLES_SESSION_KEY = 'roles'
+
+
 class User(AbstractUser):
+    @cached_property
+    def roles(self):
+        """
+        Set of the profiles ('student', 'teacher') this user has.
+        Resolved with at most one query per user object, or primed from the session by RolesMiddleware.
+        """
+        related = {'student': User.student.related, 'teacher': User.teacher.related}
+        if all(r.is_cached(self) for r in related.values()):
+            return frozenset(name for name, r in related.items() if r.get_cached_value(self) is not None)
+        row = User.objects.filter(pk=self.pk).values_list('student', 'teacher').first() or (None, None)
+        if row[0] is None and getattr(settings, 'DEPT_SHARDS', None):
+            # the student profile can be on the shard of its department
+            row = (locate(Student, user=self.pk), row[1])
+        return frozenset(name for name, pk in zip(related, row) if pk is not None)
+
     @property
     def is_student(self):
-        if hasattr(self, 'student'):
-            return True
-        return False
+        return 'student' in self.roles
 
     @property
     def is_teacher(self):
-        if hasattr(self, 'teacher'):
-            return True
-        return False
+        return 'teacher' in self.roles
 
 
 class Dept(models.Model):
@@ -81,6 +103,8 @@ class Class(models.Model):
     section = models.CharField(max_length=100)
     sem = models.IntegerField()
 
+    objects = ShardedQuerySet.as_manager()
+
     class Meta:
         verbose_name_plural = 'classes'
 
@@ -96,6 +120,9 @@ class Student(models.Model):
     name = models.CharField(max_length=200)
     sex = models.CharField(max_length=50, choices=sex_choice, default='Male')
     DOB = models.DateField(default='1998-01-01')
+    parent_email = models.EmailField(blank=True)
+
+    objects = ShardedQuerySet.as_manager()
 
     def __str__(self):
         return self.name
@@ -118,6 +145,8 @@ class Assign(models.Model):
     course = models.ForeignKey(Course, on_delete=models.CASCADE)
     teacher = models.ForeignKey(Teacher, on_delete=models.CASCADE)
 
+    objects = ShardedQuerySet.as_manager()
+
     class Meta:
         unique_together = (('course', 'class_id', 'teacher'),)
 
@@ -127,21 +156,60 @@ class Assign(models.Model):
         te = Teacher.objects.get(id=self.teacher_id)
         return '%s : %s : %s' % (te.name, cr.shortname, cl)
 
+    def scheduled_classes(self, until):
+        """
+        AttendanceClass list of this assign up to until, newest first.
+        In lazy mode, timetable dates without a row are returned as unsaved AttendanceClass objects.
+        """
+        att_list = list(self.attendanceclass_set.filter(date__lte=until).order_by('-date'))
+        if not settings.ATTENDANCE_LAZY:
+            return att_list
+        try:
+            r = AttendanceRange.objects.all()[:1].get()
+        except AttendanceRange.DoesNotExist:
+            return att_list
+        seen = {a.date for a in att_list}
+        end_date = min(r.end_date, until + timedelta(1))
+        closed = dept_closed_dates(closed_dates(r.start_date, end_date), self.class_id.dept_id)
+        for asst in self.assigntime_set.all():
+            for single_date in class_dates(asst.day, r.start_date, end_date, closed):
+                if single_date not in seen:
+                    seen.add(single_date)
+                    att_list.append(AttendanceClass(assign=self, date=single_date))
+        att_list.sort(key=lambda a: a.date, reverse=True)
+        return att_list
+
 
 class AssignTime(models.Model):
     assign = models.ForeignKey(Assign, on_delete=models.CASCADE)
     period = models.CharField(max_length=50, choices=time_slots, default='11:00 - 11:50')
     day = models.CharField(max_length=15, choices=DAYS_OF_WEEK)
+    modified = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = ShardedQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['assign', 'day', 'period'], name='info_asst_assign_day_period'),
+            models.Index(fields=['day', 'period'], name='info_asst_day_period'),
+        ]
 
 
 class AttendanceClass(models.Model):
     assign = models.ForeignKey(Assign, on_delete=models.CASCADE)
     date = models.DateField()
     status = models.IntegerField(default=0)
+    # the holiday that cancelled the class, opened again when the holiday is removed
+    holiday = models.ForeignKey('Holiday', on_delete=models.SET_NULL, null=True, blank=True)
+
+    objects = ShardedQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Attendance'
         verbose_name_plural = 'Attendance'
+        indexes = [
+            models.Index(fields=['assign', 'date'], name='info_attc_assign_date'),
+        ]
 
 
 class Attendance(models.Model):
@@ -150,6 +218,23 @@ class Attendance(models.Model):
     attendanceclass = models.ForeignKey(AttendanceClass, on_delete=models.CASCADE, default=1)
     date = models.DateField(default='2018-10-23')
     status = models.BooleanField(default='True')
+    modified = models.DateTimeField(auto_now=True)
+
+    objects = ShardedQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # (course, student, status) covers the AttendanceTotal counts, the lookups
+            # by class use the unique (attendanceclass, student) constraint below
+            models.Index(fields=['course', 'student', 'status'], name='info_att_course_stud_status'),
+            models.Index(fields=['student', 'modified'], name='info_att_student_modified'),
+            # keyset pagination of a student's history in a course
+            models.Index(fields=['student', 'course', 'date', 'id'], name='info_att_history'),
+        ]
+        constraints = [
+            # one row per student and class, the target of the bulk upserts
+            models.UniqueConstraint(fields=['attendanceclass', 'student'], name='info_att_class_student'),
+        ]
 
     def __str__(self):
         sname = Student.objects.get(name=self.student)
@@ -157,58 +242,78 @@ class Attendance(models.Model):
         return '%s : %s' % (sname.name, cname.shortname)
 
 
+def attendance_percentage(att_class, total_class):
+    if total_class == 0:
+        return 0
+    return round(att_class / total_class * 100, 2)
+
+
+def classes_to_attend(att_class, total_class, threshold=75):
+    # consecutive classes needed to reach the threshold, 75% by default
+    ratio = threshold / 100
+    cta = math.ceil((ratio * total_class - att_class) / (1 - ratio))
+    if cta < 0:
+        return 0
+    return cta
+
+
 class AttendanceTotal(models.Model):
     course = models.ForeignKey(Course, on_delete=models.CASCADE)
     student = models.ForeignKey(Student, on_delete=models.CASCADE)
+    # kept current by the attendance write paths, see info.rollups
+    present_count = models.PositiveIntegerField(default=0)
+    total_count = models.PositiveIntegerField(default=0)
+    percentage = models.FloatField(default=0, db_index=True)
+
+    objects = ShardedQuerySet.as_manager()
 
     class Meta:
         unique_together = (('student', 'course'),)
 
+    # the counts below only include the classes taken by the teacher, as the maintained ones
     @property
     def att_class(self):
         stud = Student.objects.get(name=self.student)
         cr = Course.objects.get(name=self.course)
-        att_class = Attendance.objects.filter(course=cr, student=stud, status='True').count()
+        att_class = Attendance.objects.filter(course=cr, student=stud, attendanceclass__status=1, status='True').count()
         return att_class
 
     @property
     def total_class(self):
         stud = Student.objects.get(name=self.student)
         cr = Course.objects.get(name=self.course)
-        total_class = Attendance.objects.filter(course=cr, student=stud).count()
+        total_class = Attendance.objects.filter(course=cr, student=stud, attendanceclass__status=1).count()
         return total_class
 
     @property
     def attendance(self):
         stud = Student.objects.get(name=self.student)
         cr = Course.objects.get(name=self.course)
-        total_class = Attendance.objects.filter(course=cr, student=stud).count()
-        att_class = Attendance.objects.filter(course=cr, student=stud, status='True').count()
-        if total_class == 0:
-            attendance = 0
-        else:
-            attendance = round(att_class / total_class * 100, 2)
-        return attendance
+        total_class = Attendance.objects.filter(course=cr, student=stud, attendanceclass__status=1).count()
+        att_class = Attendance.objects.filter(course=cr, student=stud, attendanceclass__status=1, status='True').count()
+        return attendance_percentage(att_class, total_class)
 
     @property
     def classes_to_attend(self):
         stud = Student.objects.get(name=self.student)
         cr = Course.objects.get(name=self.course)
-        total_class = Attendance.objects.filter(course=cr, student=stud).count()
-        att_class = Attendance.objects.filter(course=cr, student=stud, status='True').count()
-        cta = math.ceil((0.75 * total_class - att_class) / 0.25)
-        if cta < 0:
-            return 0
-        return cta
+        total_class = Attendance.objects.filter(course=cr, student=stud, attendanceclass__status=1).count()
+        att_class = Attendance.objects.filter(course=cr, student=stud, attendanceclass__status=1, status='True').count()
+        return classes_to_attend(att_class, total_class)
 
 
 class StudentCourse(models.Model):
     student = models.ForeignKey(Student, on_delete=models.CASCADE)
     course = models.ForeignKey(Course, on_delete=models.CASCADE)
 
+    objects = ShardedQuerySet.as_manager()
+
     class Meta:
         unique_together = (('student', 'course'),)
         verbose_name_plural = 'Marks'
+        indexes = [
+            models.Index(fields=['course', 'student'], name='info_sc_course_student'),
+        ]
 
     def __str__(self):
         sname = Student.objects.get(name=self.student)
@@ -232,6 +337,9 @@ class Marks(models.Model):
     studentcourse = models.ForeignKey(StudentCourse, on_delete=models.CASCADE)
     name = models.CharField(max_length=50, choices=test_name, default='Internal test 1')
     marks1 = models.IntegerField(default=0, validators=[MinValueValidator(0), MaxValueValidator(100)])
+    modified = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = ShardedQuerySet.as_manager()
 
     class Meta:
         unique_together = (('studentcourse', 'name'),)
@@ -248,6 +356,8 @@ class MarksClass(models.Model):
     name = models.CharField(max_length=50, choices=test_name, default='Internal test 1')
     status = models.BooleanField(default='False')
 
+    objects = ShardedQuerySet.as_manager()
+
     class Meta:
         unique_together = (('assign', 'name'),)
 
@@ -263,6 +373,147 @@ class AttendanceRange(models.Model):
     end_date = models.DateField()
 
 
+class Holiday(models.Model):
+    name = models.CharField(max_length=100)
+    start_date = models.DateField()
+    end_date = models.DateField()
+    # a holiday without a department closes the whole college
+    dept = models.ForeignKey(Dept, on_delete=models.CASCADE, null=True, blank=True)
+
+    def __str__(self):
+        return self.name
+
+
+class Leave(models.Model):
+    teacher = models.ForeignKey(Teacher, on_delete=models.CASCADE)
+    start_date = models.DateField()
+    end_date = models.DateField()
+
+    def __str__(self):
+        return '%s : %s - %s' % (self.teacher, self.start_date, self.end_date)
+
+
+class Substitution(models.Model):
+    attendanceclass = models.ForeignKey(AttendanceClass, on_delete=models.CASCADE)
+    assigntime = models.ForeignKey(AssignTime, on_delete=models.CASCADE)
+    teacher = models.ForeignKey(Teacher, on_delete=models.CASCADE)
+    leave = models.ForeignKey(Leave, on_delete=models.CASCADE, null=True, blank=True)
+
+    objects = ShardedQuerySet.as_manager()
+
+    class Meta:
+        unique_together = (('attendanceclass', 'assigntime'),)
+
+
+class ClassDayRollup(models.Model):
+    # attendance counts of a class in a course on a day, see info.rollups
+    class_id = models.ForeignKey(Class, on_delete=models.CASCADE)
+    course = models.ForeignKey(Course, on_delete=models.CASCADE)
+    date = models.DateField()
+    present = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+
+    objects = ShardedQuerySet.as_manager()
+
+    class Meta:
+        unique_together = (('class_id', 'course', 'date'),)
+
+
+class StudentWeekRollup(models.Model):
+    # attendance counts of a student in a course in the week starting on Monday week
+    student = models.ForeignKey(Student, on_delete=models.CASCADE)
+    course = models.ForeignKey(Course, on_delete=models.CASCADE)
+    week = models.DateField()
+    present = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+
+    objects = ShardedQuerySet.as_manager()
+
+    class Meta:
+        unique_together = (('student', 'course', 'week'),)
+
+
+class DeviceEvent(models.Model):
+    # client dedupe key, a batch sent twice is recorded once
+    key = models.CharField(max_length=100, unique=True)
+    device = models.CharField(max_length=100)
+    usn = models.CharField(max_length=100)
+    timestamp = models.DateTimeField()
+    # the class the tap was recorded in, null when it matched none
+    attendanceclass = models.ForeignKey(AttendanceClass, on_delete=models.SET_NULL, null=True, blank=True)
+    received = models.DateTimeField(auto_now_add=True)
+
+    objects = ShardedQuerySet.as_manager()
+
+    def __str__(self):
+        return '%s : %s' % (self.device, self.usn)
+
+
+notification_kind = (
+    ('shortage', 'Attendance shortage'),
+    ('marks', 'Marks published'),
+)
+
+
+class Notification(models.Model):
+    # queued by the write paths, mailed to the student and parent by send_notifications
+    student = models.ForeignKey(Student, on_delete=models.CASCADE)
+    kind = models.CharField(max_length=20, choices=notification_kind)
+    text = models.TextField()
+    created = models.DateTimeField(auto_now_add=True)
+    sent = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    objects = ShardedQuerySet.as_manager()
+
+    def __str__(self):
+        return '%s : %s' % (self.student, self.get_kind_display())
+
+
+job_status = (
+    ('queued', 'Queued'),
+    ('running', 'Running'),
+    ('done', 'Done'),
+    ('failed', 'Failed'),
+)
+
+
+class Job(models.Model):
+    # a call of a function registered with info.jobs.job, run by run_worker
+    name = models.CharField(max_length=100)
+    args = models.JSONField(default=list, blank=True)
+    kwargs = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=job_status, default='queued')
+    progress = models.PositiveSmallIntegerField(default=0)
+    message = models.CharField(max_length=200, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    worker = models.CharField(max_length=100, blank=True)
+
+    class Meta:
+        indexes = [
+            # the next queued job of the workers
+            models.Index(fields=['status', 'run_after'], name='info_job_status_run_after'),
+        ]
+
+    def __str__(self):
+        return '%s #%d : %s' % (self.name, self.id, self.status)
+
+
+class VersionStamp(models.Model):
+    # time of the last change of the data behind a version key of info.versions
+    key = models.CharField(max_length=100, primary_key=True)
+    stamp = models.FloatField()
+
+    def __str__(self):
+        return self.key
+
+
 # Triggers
 
 
@@ -281,19 +532,41 @@ days = {
 }
 
 
+def class_dates(day, start_date, end_date, closed=()):
+    for single_date in daterange(start_date, end_date):
+        if single_date.isoweekday() == days[day] and single_date not in closed:
+            yield single_date
+
+
+def closed_dates(start_date, end_date):
+    """Return {dept id: set of dates} closed by holidays, whole college closures are under None."""
+    closed = {}
+    for h in Holiday.objects.filter(start_date__lt=end_date, end_date__gte=start_date):
+        dates = closed.setdefault(h.dept_id, set())
+        dates.update(daterange(max(h.start_date, start_date), min(h.end_date + timedelta(1), end_date)))
+    return closed
+
+
+def dept_closed_dates(closed, dept_id):
+    return closed.get(None, set()) | closed.get(dept_id, set())
+
+
+@on_shard_of(lambda sender, instance, **kwargs: instance)
 def create_attendance(sender, instance, **kwargs):
-    if kwargs['created']:
+    # in lazy mode rows are created when a class is recorded or cancelled
+    if kwargs['created'] and not settings.ATTENDANCE_LAZY:
         start_date = AttendanceRange.objects.all()[:1].get().start_date
         end_date = AttendanceRange.objects.all()[:1].get().end_date
-        for single_date in daterange(start_date, end_date):
-            if single_date.isoweekday() == days[instance.day]:
-                try:
-                    AttendanceClass.objects.get(date=single_date.strftime("%Y-%m-%d"), assign=instance.assign)
-                except AttendanceClass.DoesNotExist:
-                    a = AttendanceClass(date=single_date.strftime("%Y-%m-%d"), assign=instance.assign)
-                    a.save()
+        closed = dept_closed_dates(closed_dates(start_date, end_date), instance.assign.class_id.dept_id)
+        for single_date in class_dates(instance.day, start_date, end_date, closed):
+            try:
+                AttendanceClass.objects.get(date=single_date.strftime("%Y-%m-%d"), assign=instance.assign)
+            except AttendanceClass.DoesNotExist:
+                a = AttendanceClass(date=single_date.strftime("%Y-%m-%d"), assign=instance.assign)
+                a.save()
 
 
+@on_shard_of(lambda sender, instance, **kwargs: instance)
 def create_marks(sender, instance, **kwargs):
     if kwargs['created']:
         if hasattr(instance, 'name'):
@@ -327,6 +600,7 @@ def create_marks(sender, instance, **kwargs):
                     sc.marks_set.create(name='Semester End Exam')
 
 
+@on_shard_of(lambda sender, instance, **kwargs: instance)
 def create_marks_class(sender, instance, **kwargs):
     if kwargs['created']:
         for name in test_name:
@@ -337,13 +611,96 @@ def create_marks_class(sender, instance, **kwargs):
                 m.save()
 
 
+def holiday_classes(holiday):
+    ass_c = AttendanceClass.objects.filter(date__range=(holiday.start_date, holiday.end_date))
+    if holiday.dept_id is not None:
+        ass_c = ass_c.filter(assign__class_id__dept_id=holiday.dept_id)
+    return ass_c
+
+
+def reopen_classes(holiday, ass_c):
+    """Open again the classes of ass_c closed by holiday, unless another holiday covers them."""
+    dates = ass_c.aggregate(first=models.Min('date'), last=models.Max('date'))
+    if dates['first'] is None:
+        return
+    for h in Holiday.objects.exclude(id=holiday.id).filter(start_date__lte=dates['last'], end_date__gte=dates['first']):
+        ass_c.filter(id__in=holiday_classes(h).values('id')).update(holiday=h)
+    # classes taken meanwhile stay taken
+    ass_c.filter(status=2).update(status=0, holiday=None)
+
+
+def holiday_shards(holiday):
+    """The databases holding the classes of the departments closed by holiday."""
+    return [shard_for(holiday.dept_id)] if holiday.dept_id is not None else shard_aliases()
+
+
+def close_classes(sender, instance, **kwargs):
+    for alias in holiday_shards(instance):
+        with use_alias(alias):
+            ass_c = holiday_classes(instance)
+            if not kwargs['created']:
+                # the classes closed by the previous dates of the holiday
+                reopen_classes(instance, AttendanceClass.objects.filter(holiday=instance).exclude(
+                    id__in=ass_c.values('id')))
+            # classes already taken keep their attendance
+            ass_c.filter(status=0).update(status=2, holiday=instance)
+
+
+def holiday_deleted(sender, instance, **kwargs):
+    for alias in holiday_shards(instance):
+        with use_alias(alias):
+            reopen_classes(instance, AttendanceClass.objects.filter(holiday=instance))
+
+
+@on_shard_of(lambda sender, instance, **kwargs: instance)
+def timetable_changed(sender, instance, **kwargs):
+    class_ids = Assign.objects.filter(id=instance.assign_id).values_list('class_id', flat=True)
+    versions.bump('timetable', classes=list(class_ids))
+
+
+def profile_changed(sender, instance, **kwargs):
+    versions.bump('profile', students=[instance.USN])
+
+
+def store_roles(sender, request, user, **kwargs):
+    request.session[ROLES_SESSION_KEY] = sorted(user.roles)
+
+
+def assign_changed(sender, instance, **kwargs):
+    # the class gains or loses a course in its attendance and marks
+    if kwargs.get('created', True):
+        versions.bump('attendance', classes=[instance.class_id_id])
+        versions.bump('marks', classes=[instance.class_id_id])
+
+
+@on_shard_of(lambda sender, instance, **kwargs: instance)
+def assign_deleting(sender, instance, **kwargs):
+    # the attendance of the assign leaves the rollups before the cascade
+    from .records import delete_classes
+    delete_classes(AttendanceClass.objects.filter(assign=instance))
+
+
+@on_shard_of(lambda sender, instance, **kwargs: instance)
 def delete_marks(sender, instance, **kwargs):
     stud_list = instance.class_id.student_set.all()
     StudentCourse.objects.filter(course=instance.course, student__in=stud_list).delete()
 
 
+# shared rows are copied to the shards first, the rows created by the other triggers refer to them
+for model in (User, Dept, Course, Teacher, Holiday, Leave):
+    post_save.connect(copy_to_shards, sender=model)
 post_save.connect(create_marks, sender=Student)
 post_save.connect(create_marks, sender=Assign)
 post_save.connect(create_marks_class, sender=Assign)
 post_save.connect(create_attendance, sender=AssignTime)
+post_save.connect(timetable_changed, sender=AssignTime)
+post_delete.connect(timetable_changed, sender=AssignTime)
+post_save.connect(profile_changed, sender=Student)
+post_save.connect(close_classes, sender=Holiday)
+pre_delete.connect(holiday_deleted, sender=Holiday)
 post_delete.connect(delete_marks, sender=Assign)
+post_save.connect(assign_changed, sender=Assign)
+pre_delete.connect(assign_deleting, sender=Assign)
+post_delete.connect(assign_changed, sender=Assign)
+user_logged_in.connect(store_roles)
+connection_created.connect(configure_sqlite)
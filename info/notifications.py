@@ -0,0 +1,90 @@
+"""
+Emails to students and their parents.
+
+The write paths only queue Notification rows, in their own transaction.
+send_pending, run by the send_notifications command, mails the queued rows
+with one message per address, which holds the notifications of all its
+students, in batches over a single connection.
+"""
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.utils import timezone
+
+from .models import Course, Notification
+from .sharding import run_on_shards
+
+
+def shortages(totals, threshold):
+    """Queue a notification for the AttendanceTotal rows that fell under threshold."""
+    names = dict(Course.objects.filter(id__in={t.course_id for t in totals}).values_list('id', 'name'))
+    Notification.objects.bulk_create(
+        Notification(student_id=t.student_id, kind='shortage', text='Your attendance in %s is %s%%, under %s%%.' % (
+            names.get(t.course_id, t.course_id), t.percentage, threshold)) for t in totals)
+
+
+def marks_published(mc, marks):
+    """Queue a notification of the marks of a test, {USN: marks}."""
+    course = mc.assign.course
+    Notification.objects.bulk_create(
+        Notification(student_id=usn, kind='marks', text='%s marks in %s: %s.' % (mc.name, course.name, m))
+        for usn, m in marks.items())
+
+
+def recipients(student):
+    return [e for e in (student.user.email if student.user else '', student.parent_email) if e]
+
+
+def send_pending(batch_size=None):
+    """
+    Mail the queued notifications of every department shard, grouped into one
+    message per address, and return the number of messages sent. A parent of two
+    students gets one message about both. Notifications of students without any
+    address are marked sent without a message.
+    """
+    return sum(run_on_shards(_send_pending, batch_size or getattr(settings, 'NOTIFICATION_BATCH', 100)).values())
+
+
+def message(address, group):
+    """The message to address of its notifications, grouped by student."""
+    students = {}
+    for n in group:
+        students.setdefault(n.student, []).append(n.text)
+    if len(students) == 1:
+        text = '\n'.join(*students.values())
+    else:
+        text = '\n\n'.join('%s:\n%s' % (student.name, '\n'.join(texts)) for student, texts in students.items())
+    return EmailMessage('College ERP: %s' % ', '.join(sorted({n.get_kind_display() for n in group})),
+                        'Dear %s,\n\n%s\n' % (', '.join(student.name for student in students), text), to=[address])
+
+
+def _send_pending(batch_size):
+    by_address = {}
+    left = {}      # notification id: addresses not mailed yet
+    for n in Notification.objects.filter(sent__isnull=True).select_related('student__user').order_by('id'):
+        to = recipients(n.student)
+        left[n.id] = len(to)
+        for address in to:
+            by_address.setdefault(address, []).append(n)
+    if not left:
+        return 0
+    addresses = list(by_address)
+    done = [i for i, count in left.items() if not count]
+    count = 0
+    # the backend keeps the connection open between send_messages calls
+    with get_connection() as conn:
+        for i in range(0, len(addresses), batch_size):
+            messages = []
+            for address in addresses[i:i + batch_size]:
+                messages.append(message(address, by_address[address]))
+                for n in by_address[address]:
+                    left[n.id] -= 1
+                    if not left[n.id]:
+                        done.append(n.id)
+            count += conn.send_messages(messages) or 0
+            # sent once mailed to all its addresses
+            if done:
+                Notification.objects.filter(id__in=done).update(sent=timezone.now())
+                done = []
+    if done:
+        Notification.objects.filter(id__in=done).update(sent=timezone.now())
+    return count
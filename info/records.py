@@ -0,0 +1,213 @@
+"""
+Bulk write paths for attendance and marks, shared by the teacher views and the APIs.
+"""
+from collections import Counter
+from itertools import chain
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .attendance_engine import engine
+from .models import Attendance, AttendanceClass, DeviceEvent, Marks, Student
+from .sharding import current_alias, locate, on_shard_of, use_alias, use_shard_of
+from .timetable import index as timetable_index
+from . import notifications, rollups, versions
+
+
+def record_attendance(assc, statuses, taken=True):
+    """
+    Save the attendance of one class, {USN: present}, and mark the class as taken
+    unless taken is False. Students already recorded are updated in place.
+    Returns {USN: (previous status or None, new status)} for the rows that changed.
+    """
+    return record_classes([(assc, statuses)], taken)[assc.id]
+
+
+@on_shard_of(lambda classes, taken=True: classes[0][0] if classes else None)
+def record_classes(classes, taken=True):
+    """
+    Save the attendance of several classes, [(AttendanceClass, {USN: present})], with one
+    read and bulk writes, keeping the rollups, the engine and the version stamps
+    current. The classes need their assign loaded.
+    Returns {class id: {USN: (previous status or None, new status)}} for the rows that changed.
+    """
+    now = timezone.now()
+    changes = {assc.id: {} for assc, statuses in classes}
+    with transaction.atomic(using=current_alias()):
+        # all the rows of the classes, a class taken now counts the rows recorded before
+        existing = {(a.attendanceclass_id, a.student_id): a for a in Attendance.objects.filter(
+            attendanceclass__in=list(changes)).only(
+            'id', 'attendanceclass', 'student', 'course', 'date', 'status')}
+        new, changed = [], []
+        for assc, statuses in classes:
+            for usn, present in statuses.items():
+                a = existing.get((assc.id, usn))
+                if a is None:
+                    new.append(Attendance(course_id=assc.assign.course_id, student_id=usn, attendanceclass=assc,
+                                          date=assc.date, status=present))
+                    changes[assc.id][usn] = (None, present)
+                elif a.status != present:
+                    changes[assc.id][usn] = (a.status, present)
+                    a.status = present
+                    a.modified = now
+                    changed.append(a)
+        if connection.features.supports_update_conflicts_with_target:
+            # one INSERT .. ON CONFLICT, rows added meanwhile by another writer are updated too
+            Attendance.objects.bulk_create(new + [
+                Attendance(course_id=a.course_id, student_id=a.student_id, attendanceclass_id=a.attendanceclass_id,
+                           date=a.date, status=a.status, modified=now) for a in changed],
+                update_conflicts=True, unique_fields=['attendanceclass', 'student'], update_fields=['status', 'modified'])
+        else:
+            Attendance.objects.bulk_create(new)
+            Attendance.objects.bulk_update(changed, ['status', 'modified'])
+        # only taken classes count in the rollups, a class taken now with all its rows
+        counted = {assc.id: changes[assc.id] for assc, statuses in classes if assc.status == 1}
+        to_take = [assc for assc, statuses in classes if taken and assc.status != 1]
+        if to_take:
+            AttendanceClass.objects.filter(id__in=[assc.id for assc in to_take]).update(status=1)
+            taking = {assc.id: {} for assc in to_take}
+            for a in chain(existing.values(), new):
+                if a.attendanceclass_id in taking:
+                    taking[a.attendanceclass_id][a.student_id] = (None, a.status)
+            counted.update(taking)
+            for assc in to_take:
+                assc.status = 1
+        rollups.apply_changes([assc for assc, statuses in classes if assc.id in counted], counted)
+
+    class_ids = {assc.assign.class_id_id for assc, statuses in classes}
+    previous = {class_id: versions.class_version('attendance', class_id) for class_id in class_ids}
+    stamp = versions.bump('attendance', classes=class_ids)
+    for assc, statuses in classes:
+        if assc.id in counted:
+            class_id = assc.assign.class_id_id
+            engine.record(class_id, assc.assign.course_id, assc.id, assc.date,
+                          {usn: new for usn, (old, new) in counted[assc.id].items()}, previous[class_id], stamp)
+    return changes
+
+
+def delete_classes(classes):
+    """
+    Delete AttendanceClass rows of a queryset with their attendance, keeping the
+    rollups, the engine and the version stamps current.
+    """
+    classes = list(classes.select_related('assign'))
+    if not classes:
+        return
+    with use_shard_of(classes[0]), transaction.atomic(using=current_alias()):
+        # classes not taken are not counted in the rollups
+        changes = {assc.id: {} for assc in classes if assc.status == 1}
+        for class_id, usn, present in Attendance.objects.filter(attendanceclass__in=list(changes)).values_list(
+                'attendanceclass', 'student', 'status'):
+            changes[class_id][usn] = (present, None)
+        rollups.apply_changes([assc for assc in classes if assc.id in changes], changes)
+        AttendanceClass.objects.filter(id__in=[assc.id for assc in classes]).delete()
+    for assc in classes:
+        engine.evict(assc.assign.class_id_id, assc.assign.course_id)
+    versions.bump('attendance', classes={assc.assign.class_id_id for assc in classes})
+
+
+@on_shard_of(lambda mc, marks: mc)
+def record_marks(mc, marks):
+    """
+    Save the marks of a test, {USN: marks}, with one read and one bulk update,
+    mark the test as entered and queue a notification to the students. After the
+    first entry only the students whose marks changed are notified.
+    """
+    ass = mc.assign
+    now = timezone.now()
+    with transaction.atomic(using=current_alias()):
+        m_list = list(Marks.objects.filter(studentcourse__course=ass.course_id, studentcourse__student__in=list(marks),
+                                           name=mc.name).select_related('studentcourse'))
+        changed = {}
+        for m in m_list:
+            usn = m.studentcourse.student_id
+            if not mc.status or m.marks1 != marks[usn]:
+                changed[usn] = marks[usn]
+            m.marks1 = marks[usn]
+            m.modified = now
+        Marks.objects.bulk_update(m_list, ['marks1', 'modified'])
+        if not mc.status:
+            mc.status = True
+            mc.save()
+        if changed:
+            notifications.marks_published(mc, changed)
+    versions.bump('marks', classes=[ass.class_id_id])
+
+
+def class_meetings(pairs):
+    """
+    Return {(assign id, date): AttendanceClass} for the pairs, creating the missing
+    classes in bulk. The first class of a date is used when there are several.
+    """
+    def fetch():
+        found = {}
+        for assc in AttendanceClass.objects.filter(
+                assign__in={a for a, d in pairs}, date__in={d for a, d in pairs}).select_related(
+                'assign').order_by('-id'):
+            found[assc.assign_id, assc.date] = assc
+        return found
+
+    found = fetch()
+    missing = [AttendanceClass(assign_id=a, date=d) for a, d in pairs if (a, d) not in found]
+    if missing:
+        AttendanceClass.objects.bulk_create(missing)
+        found = fetch()
+    return found
+
+
+def record_taps(events):
+    """
+    Record device taps, [{'key', 'usn', 'timestamp', 'device'}], as presence in the
+    class taught to the student at that time. Keys already recorded are skipped, so
+    a batch can be retried. Taps in cancelled classes are unmatched. The classes are
+    not marked as taken, the teacher still confirms the absents, and they count in
+    the rollups once taken. With DEPT_SHARDS the taps of each shard are recorded there.
+    Returns the number of accepted, duplicate and unmatched events.
+    """
+    sharded = getattr(settings, 'DEPT_SHARDS', None)
+    by_shard = {}
+    for e in events:
+        by_shard.setdefault(locate(Student, pk=e['usn']) if sharded else None, []).append(e)
+    counts = Counter(accepted=0, duplicates=0, unmatched=0)
+    for alias, shard_events in by_shard.items():
+        with use_alias(alias):
+            counts.update(_record_taps(shard_events))
+    return dict(counts)
+
+
+def _record_taps(events):
+    with transaction.atomic(using=current_alias()):
+        seen = set(DeviceEvent.objects.filter(key__in={e['key'] for e in events}).values_list('key', flat=True))
+        fresh = {}
+        for e in events:
+            if e['key'] not in seen:
+                fresh.setdefault(e['key'], e)
+        classes = dict(Student.objects.filter(USN__in={e['usn'] for e in fresh.values()}).values_list(
+            'USN', 'class_id'))
+
+        taps = {}
+        meeting_of = {}
+        for e in fresh.values():
+            moment = timezone.localtime(e['timestamp'])
+            assign_id = timetable_index.lookup(classes.get(e['usn']), moment)
+            if assign_id is not None:
+                taps.setdefault((assign_id, moment.date()), []).append(e)
+        meetings = class_meetings(list(taps)) if taps else {}
+        # no attendance is taken in cancelled classes
+        taps = {pair: tap_list for pair, tap_list in taps.items() if meetings[pair].status != 2}
+        for pair, tap_list in taps.items():
+            for e in tap_list:
+                meeting_of[e['key']] = meetings[pair].id
+        record_classes([(meetings[pair], {e['usn']: True for e in tap_list}) for pair, tap_list in taps.items()],
+                       taken=False)
+
+        DeviceEvent.objects.bulk_create([
+            DeviceEvent(key=e['key'], device=e['device'], usn=e['usn'], timestamp=e['timestamp'],
+                        attendanceclass_id=meeting_of.get(e['key'])) for e in fresh.values()],
+            ignore_conflicts=True)
+    return {
+        'accepted': len(fresh),
+        'duplicates': len(events) - len(fresh),
+        'unmatched': len(fresh) - len(meeting_of),
+    }
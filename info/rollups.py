@@ -0,0 +1,131 @@
+"""
+Rollups of the attendance per (class, course, day) and per (student, course, week),
+and the counts and percentage of AttendanceTotal behind the shortage list.
+
+Only the attendance of taken classes is counted. They are kept current by
+record_classes from the changes of each write, and rebuilt from the Attendance
+table by rebuild(), e.g. after rows were deleted.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.db.models.functions import TruncWeek
+
+from . import notifications
+from .models import Attendance, AttendanceTotal, ClassDayRollup, StudentWeekRollup, attendance_percentage
+from .sharding import current_alias, run_on_shards
+
+
+def week_of(d):
+    """Monday of the week of d."""
+    return d - timedelta(days=d.weekday())
+
+
+def _apply(model, keys, deltas, fields=('present', 'total'), update=None, drop_empty=True):
+    """
+    Add {key values: [present, total]} to the fields of the rows of model, keys being
+    field attnames. update(row) is called on each row before it is saved. Rows left
+    without classes are deleted, unless drop_empty is False.
+    """
+    if not deltas:
+        return
+    # rows matching each key value separately, then the exact keys
+    filters = {k + '__in': {key[i] for key in deltas} for i, k in enumerate(keys)}
+    rows = {tuple(getattr(r, k) for k in keys): r for r in model.objects.select_for_update().filter(**filters)}
+    new, changed, empty = [], [], []
+    for key, (present, total) in deltas.items():
+        r = rows.get(key)
+        if r is None:
+            if drop_empty and total <= 0:
+                continue
+            r = model(**dict(zip(keys, key)))
+            new.append(r)
+        elif drop_empty and getattr(r, fields[1]) + total <= 0:
+            empty.append(r.pk)
+            continue
+        elif present or total:
+            changed.append(r)
+        else:
+            continue
+        setattr(r, fields[0], getattr(r, fields[0]) + present)
+        setattr(r, fields[1], getattr(r, fields[1]) + total)
+        if update:
+            update(r)
+    model.objects.bulk_create(new)
+    model.objects.bulk_update(changed, list(fields) + (['percentage'] if update else []))
+    if empty:
+        model.objects.filter(pk__in=empty).delete()
+
+
+def _percentage(total):
+    total.percentage = attendance_percentage(total.present_count, total.total_count)
+
+
+def apply_changes(classes, changes):
+    """
+    Update the rollups from the result of record_classes.
+    classes are the recorded AttendanceClass, changes {class id: {USN: (old, new)}},
+    old is None for a new row and new is None for a deleted one.
+    """
+    days, weeks, totals = {}, {}, {}
+    for assc in classes:
+        ass = assc.assign
+        day = days.setdefault((ass.class_id_id, ass.course_id, assc.date), [0, 0])
+        for usn, (old, new) in changes[assc.id].items():
+            present = int(bool(new)) - int(bool(old))
+            total = int(new is not None) - int(old is not None)
+            day[0] += present
+            day[1] += total
+            week = weeks.setdefault((usn, ass.course_id, week_of(assc.date)), [0, 0])
+            week[0] += present
+            week[1] += total
+            student = totals.setdefault((usn, ass.course_id), [0, 0])
+            student[0] += present
+            student[1] += total
+    _apply(ClassDayRollup, ('class_id_id', 'course_id', 'date'), days)
+    _apply(StudentWeekRollup, ('student_id', 'course_id', 'week'), weeks)
+
+    # students who fall under the shortage threshold with this write are notified
+    threshold = settings.ATTENDANCE_SHORTAGE_THRESHOLD
+    dropped = []
+
+    def update(total):
+        was_short = total.total_count > totals[total.student_id, total.course_id][1] and total.percentage < threshold
+        _percentage(total)
+        if total.total_count and total.percentage < threshold and not was_short:
+            dropped.append(total)
+    _apply(AttendanceTotal, ('student_id', 'course_id'), totals, ('present_count', 'total_count'), update,
+           drop_empty=False)
+    if dropped:
+        notifications.shortages(dropped, threshold)
+
+
+def rebuild():
+    """Recompute all the rollups from the Attendance table, of each department shard."""
+    run_on_shards(_rebuild)
+
+
+def _rebuild():
+    counts = {'present': Count('id', filter=Q(status=True)), 'total': Count('id')}
+    taken = Attendance.objects.filter(attendanceclass__status=1)
+    with transaction.atomic(using=current_alias()):
+        ClassDayRollup.objects.all().delete()
+        StudentWeekRollup.objects.all().delete()
+        ClassDayRollup.objects.bulk_create(
+            (ClassDayRollup(**r) for r in taken.values(
+                'course_id', 'date', class_id_id=F('attendanceclass__assign__class_id')).annotate(
+                **counts).order_by()), batch_size=1000)
+        StudentWeekRollup.objects.bulk_create(
+            (StudentWeekRollup(**r) for r in taken.values(
+                'student_id', 'course_id', week=TruncWeek('date')).annotate(**counts).order_by()),
+            batch_size=1000)
+        AttendanceTotal.objects.update(present_count=0, total_count=0, percentage=0)
+        totals = []
+        for r in taken.values('student_id', 'course_id').annotate(
+                present_count=counts['present'], total_count=counts['total']).order_by():
+            totals.append(AttendanceTotal(percentage=attendance_percentage(r['present_count'], r['total_count']), **r))
+        AttendanceTotal.objects.bulk_create(
+            totals, batch_size=1000, update_conflicts=True, unique_fields=['student', 'course'],
+            update_fields=['present_count', 'total_count', 'percentage'])
@@ -0,0 +1,56 @@
+"""
+Routing of reporting reads to an optional read replica.
+
+Reads go to the READ_REPLICA alias only inside replica_reads(): during GET
+requests to views marked with @read_replica, admin changelists and the APIs
+whose view class does not set read_replica = False, see ReplicaMiddleware.
+A request that writes reads its own writes from the primary for the rest of
+the request, and the client that wrote keeps reading from the primary for
+REPLICA_STICKY_SECONDS, while the replica catches up.
+"""
+import contextvars
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+_replica_reads = contextvars.ContextVar('replica_reads', default=False)
+_wrote = contextvars.ContextVar('wrote', default=False)
+
+
+@contextmanager
+def replica_reads():
+    """Send the reads of the block to the replica, when one is configured."""
+    reads, wrote = _replica_reads.set(True), _wrote.set(False)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(reads)
+        _wrote.reset(wrote)
+
+
+def read_replica(view):
+    """Mark a view whose GET requests can be served from the replica."""
+    view.read_replica = True
+    return view
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        replica = getattr(settings, 'READ_REPLICA', None)
+        if replica and _replica_reads.get() and not _wrote.get():
+            return replica
+        return None
+
+    def db_for_write(self, model, **hints):
+        _wrote.set(True)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replica holds the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # the replica is migrated by replication
+        return db != getattr(settings, 'READ_REPLICA', None)
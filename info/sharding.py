@@ -0,0 +1,377 @@
+"""
+Optional sharding of the department data over several databases.
+
+DEPT_SHARDS maps department ids to database aliases. The classes, students,
+timetables, attendance, marks and rollups of a mapped department live on its
+shard, the other departments and the shared tables (users, departments,
+courses, teachers, holidays, ...) on the default database. Shards have the full
+schema and a copy of the shared rows for their foreign keys, made by the
+sync_shards command and kept current when the shared rows are saved. Every
+shard gives ids from its own block of SHARD_ID_BLOCK, so the id of a department
+row is unique over the shards and the row can be looked up with locate.
+
+The queries of department rows go to, in order:
+- the database of the row they are reached from, or the shard of its department
+  for a new row, found through the related rows it holds, also when created
+  through the manager,
+- the shard selected with use_shard(dept_id) or use_alias(alias),
+- the shard of the row named in the URL of the request, or else of the student
+  or teacher making it, see ShardMiddleware,
+- the default database.
+A user's student profile is looked up on every shard. The rows reached from a
+teacher or a course can be on any shard, as can reads over all the departments,
+they go through fan_out, which runs a function on every database in parallel, or
+run_on_shards, which runs it inside use_alias of each shard.
+"""
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import wraps
+from itertools import chain
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections, models
+
+# models whose rows belong to a department, with the foreign key leading to it
+DEPT_PATHS = {
+    'class': 'dept',
+    'student': 'class_id',
+    'assign': 'class_id',
+    'assigntime': 'assign',
+    'attendanceclass': 'assign',
+    'attendance': 'student',
+    'attendancetotal': 'student',
+    'studentcourse': 'student',
+    'marks': 'studentcourse',
+    'marksclass': 'assign',
+    'substitution': 'attendanceclass',
+    'deviceevent': 'attendanceclass',
+    'classdayrollup': 'class_id',
+    'studentweekrollup': 'student',
+    'notification': 'student',
+}
+SHARDED_MODELS = set(DEPT_PATHS)
+
+# URL arguments naming a department row, whose database serves the request
+URL_ROWS = {
+    'class_id': 'class',
+    'stud_id': 'student',
+    'assign_id': 'assign',
+    'asst_id': 'assigntime',
+    'ass_c_id': 'attendanceclass',
+    'att_id': 'attendance',
+    'marks_c_id': 'marksclass',
+}
+
+_shard = contextvars.ContextVar('shard', default=None)
+_request = contextvars.ContextVar('shard_request', default=None)
+
+
+def shard_for(dept_id):
+    """Database alias of a department."""
+    return getattr(settings, 'DEPT_SHARDS', {}).get(dept_id, DEFAULT_DB_ALIAS)
+
+
+def shard_aliases():
+    """Every database holding department rows, the default one first."""
+    aliases = [DEFAULT_DB_ALIAS]
+    for alias in getattr(settings, 'DEPT_SHARDS', {}).values():
+        if alias not in aliases:
+            aliases.append(alias)
+    return aliases
+
+
+def id_start(alias):
+    """Ids of the department rows created on a database start after this one, new shards go last."""
+    return shard_aliases().index(alias) * getattr(settings, 'SHARD_ID_BLOCK', 10 ** 8)
+
+
+def reserve_ids(alias):
+    """Make the department tables of a shard give ids from its own block, run by sync_shards."""
+    start = id_start(alias)
+    connection = connections[alias]
+    qn = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        for model in apps.get_app_config('info').get_models():
+            if not is_sharded(model) or not isinstance(model._meta.pk, models.AutoField):
+                continue
+            table, column = model._meta.db_table, model._meta.pk.column
+            if connection.vendor == 'sqlite':
+                cursor.execute('UPDATE sqlite_sequence SET seq = %s WHERE name = %s AND seq < %s', [start, table, start])
+                cursor.execute('INSERT INTO sqlite_sequence (name, seq) SELECT %s, %s WHERE NOT EXISTS '
+                               '(SELECT 1 FROM sqlite_sequence WHERE name = %s)', [table, start, table])
+            elif connection.vendor == 'postgresql':
+                cursor.execute('SELECT setval(pg_get_serial_sequence(%%s, %%s), GREATEST(%%s, (SELECT COALESCE(MAX(%s), 0) '
+                               'FROM %s)))' % (qn(column), qn(table)), [qn(table), column, start])
+            else:
+                raise NotImplementedError('ids of %s databases' % connection.vendor)
+
+
+@contextmanager
+def use_alias(alias):
+    """Send the queries of department rows in the block to the database alias."""
+    token = _shard.set(alias)
+    try:
+        yield
+    finally:
+        _shard.reset(token)
+
+
+def use_shard(dept_id):
+    """Send the queries of department rows in the block to the shard of dept_id."""
+    return use_alias(shard_for(dept_id))
+
+
+def current_alias():
+    """Database the queries of department rows go to without a row to follow."""
+    return _shard.get() or request_shard() or DEFAULT_DB_ALIAS
+
+
+@contextmanager
+def use_shard_of(instance):
+    """Send the queries of department rows in the block to the database of instance, if any."""
+    alias = None
+    if instance is not None and getattr(settings, 'DEPT_SHARDS', None):
+        alias = instance_shard(instance)
+    with use_alias(alias or _shard.get()):
+        yield
+
+
+def on_shard_of(row):
+    """
+    Run the decorated function inside use_shard_of(row(*args, **kwargs)), for the
+    write paths whose queries and transaction go to the database of their rows.
+    """
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with use_shard_of(row(*args, **kwargs)):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def run_on_shards(fn, *args, **kwargs):
+    """Run fn(*args, **kwargs) inside use_alias of every shard in turn, returns {alias: result}."""
+    results = {}
+    for alias in shard_aliases():
+        with use_alias(alias):
+            results[alias] = fn(*args, **kwargs)
+    return results
+
+
+def locate(model, **filters):
+    """
+    Alias of the database holding a row of model matching filters, or None.
+    Found rows are remembered in the cache, rows do not move between shards
+    unless their department is moved.
+    """
+    key = 'shard:%s:%s' % (model._meta.label_lower, ':'.join('%s=%s' % f for f in sorted(filters.items())))
+    alias = cache.get(key)
+    if alias is None:
+        for alias in shard_aliases():
+            if model._base_manager.using(alias).filter(**filters).exists():
+                cache.set(key, alias)
+                return alias
+        return None
+    return alias
+
+
+def instance_shard(instance):
+    """
+    Database of a department row from the related rows it holds: the database
+    the first of them was loaded from, or the shard of the department. Rows only
+    referenced by id are looked up. The database Django guesses for a new row
+    from the first related row assigned to it is not used.
+    """
+    while instance._state.adding:
+        name = DEPT_PATHS.get(instance._meta.model_name)
+        if name is None:
+            return None
+        field = instance._meta.get_field(name)
+        # from __dict__, the fields of a row being built are not all set yet
+        value = instance.__dict__.get(field.attname)
+        if name == 'dept':
+            return shard_for(value) if value is not None else None
+        if field.is_cached(instance):
+            instance = field.get_cached_value(instance)
+            if instance is None:
+                return None
+        else:
+            if value is None:
+                return None
+            return locate(field.related_model, pk=value)
+    return instance._state.db
+
+
+def user_shard(user):
+    """Shard of the department of a student or teacher user, None for the others."""
+    Teacher, Student = apps.get_model('info', 'Teacher'), apps.get_model('info', 'Student')
+    dept_id = Teacher.objects.filter(user=user.pk).values_list('dept', flat=True).first()
+    if dept_id is not None:
+        return shard_for(dept_id)
+    return locate(Student, user=user.pk)
+
+
+def request_shard():
+    """Shard of the user of the current request, see ShardMiddleware."""
+    request = _request.get()
+    if request is None:
+        return None
+    if not hasattr(request, 'shard'):
+        user = getattr(request, 'user', None)
+        if user is None or not user.is_authenticated:
+            # API views authenticate the user later in the request
+            return None
+        request.shard = user_shard(user)
+    return request.shard
+
+
+def url_shard(view_kwargs):
+    """Database of the first department row named in the URL arguments of a view, or None."""
+    for name, model_name in URL_ROWS.items():
+        if view_kwargs.get(name) is not None:
+            try:
+                return locate(apps.get_model('info', model_name), pk=view_kwargs[name])
+            except (TypeError, ValueError):
+                return None
+    return None
+
+
+@contextmanager
+def request_shard_of(request):
+    """Send the queries of department rows in the block to the shard of the user of request."""
+    token = _request.set(request)
+    try:
+        yield
+    finally:
+        _request.reset(token)
+
+
+def copy_shared(instance, alias):
+    """Copy a shared row to a shard, as sync_shards does, before shard rows refer to it."""
+    if alias == DEFAULT_DB_ALIAS:
+        return
+    model = type(instance)
+    fields = model._meta.concrete_fields
+    model.objects.using(alias).bulk_create(
+        [model(**{f.attname: getattr(instance, f.attname) for f in fields})], update_conflicts=True,
+        unique_fields=[model._meta.pk.name], update_fields=[f.name for f in fields if not f.primary_key])
+
+
+def copy_to_shards(sender, instance, raw=False, using=DEFAULT_DB_ALIAS, **kwargs):
+    """post_save handler keeping the copies of a shared row on the shards current."""
+    if getattr(settings, 'DEPT_SHARDS', None) and not raw and using == DEFAULT_DB_ALIAS:
+        for alias in shard_aliases():
+            copy_shared(instance, alias)
+
+
+def fan_out(fn, aliases=None):
+    """
+    Run fn(alias) on every shard in parallel, each in its own thread and connection.
+    Returns {alias: result}.
+    """
+    aliases = aliases or shard_aliases()
+
+    def run(alias):
+        try:
+            return fn(alias)
+        finally:
+            connections.close_all()
+
+    if len(aliases) == 1:
+        return {aliases[0]: fn(aliases[0])}
+    with ThreadPoolExecutor(max_workers=len(aliases)) as executor:
+        return dict(zip(aliases, executor.map(run, aliases)))
+
+
+def shard_rows(queryset):
+    """The rows of a queryset of department rows from every shard, as one list."""
+    if not getattr(settings, 'DEPT_SHARDS', None):
+        return list(queryset)
+    return list(chain.from_iterable(fan_out(lambda alias: list(queryset.using(alias))).values()))
+
+
+class ShardedQuerySet(models.QuerySet):
+    """
+    QuerySet of department rows. Without a database picked with using(), rows
+    created through it go to the database of the rows they refer to, as saved
+    instances do.
+    """
+
+    def _for_new(self, values):
+        if self._db or not getattr(settings, 'DEPT_SHARDS', None):
+            return self
+        names = {f.name for f in self.model._meta.concrete_fields} | {f.attname for f in self.model._meta.concrete_fields}
+        alias = instance_shard(self.model(**{k: v for k, v in values.items() if k in names}))
+        return self.using(alias) if alias else self
+
+    def create(self, **kwargs):
+        return super(ShardedQuerySet, self._for_new(kwargs)).create(**kwargs)
+
+    def get_or_create(self, defaults=None, **kwargs):
+        return super(ShardedQuerySet, self._for_new(dict(defaults or {}, **kwargs))).get_or_create(defaults, **kwargs)
+
+    def update_or_create(self, defaults=None, create_defaults=None, **kwargs):
+        values = dict(create_defaults if create_defaults is not None else defaults or {}, **kwargs)
+        return super(ShardedQuerySet, self._for_new(values)).update_or_create(defaults, create_defaults, **kwargs)
+
+
+def is_sharded(model):
+    return model._meta.app_label == 'info' and model._meta.model_name in SHARDED_MODELS
+
+
+class ShardRouter:
+
+    def _db(self, model, hints):
+        if not getattr(settings, 'DEPT_SHARDS', None) or not is_sharded(model):
+            return None
+        instance = hints.get('instance')
+        if instance is not None:
+            if is_sharded(type(instance)):
+                # related rows stay on the database of the row they are reached from
+                alias = instance_shard(instance)
+            else:
+                alias = self._shared_db(instance)
+            if alias:
+                return alias
+        return _shard.get() or request_shard()
+
+    def _shared_db(self, instance):
+        # department rows reached from a shared row, the profile of a user wherever it is
+        if instance._meta.model_name == 'user':
+            return locate(apps.get_model('info', 'Student'), user=instance.pk)
+        # teachers teach and courses are taken in the classes of other departments too
+        if _shard.get() or instance._meta.model_name in ('teacher', 'course'):
+            return None
+        if instance._meta.model_name == 'dept':
+            return shard_for(instance.pk)
+        dept_id = getattr(instance, 'dept_id', None)
+        return shard_for(dept_id) if dept_id is not None else None
+
+    def db_for_read(self, model, **hints):
+        return self._db(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._db(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if not getattr(settings, 'DEPT_SHARDS', None):
+            return None
+        # shared rows are copied to every shard, new rows are saved where their rows are
+        if obj1._state.db == obj2._state.db or not is_sharded(type(obj1)) or not is_sharded(type(obj2)):
+            return True
+        if obj1._state.adding or obj2._state.adding:
+            return True
+        return False
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # every shard has the full schema
+        return None
+
+
+def shared_models():
+    """Models copied to every shard, in foreign key order."""
+    return [m for m in apps.get_app_config('info').get_models() if not is_sharded(m)]
@@ -0,0 +1,68 @@
+"""
+The heavy operations of the admin and the management commands, registered as
+jobs so they can be queued with .enqueue() instead of run inside a request.
+"""
+from datetime import date
+
+from django.conf import settings
+
+from . import rollups, versions
+from .attendance_engine import engine
+from .jobs import job, progress
+from .models import Attendance, AttendanceClass, AttendanceRange, AttendanceTotal, AssignTime
+from .models import ClassDayRollup, StudentWeekRollup, class_dates, closed_dates, dept_closed_dates
+from .notifications import send_pending
+from .sharding import run_on_shards
+
+
+@job(name='reset_attendance', max_attempts=1)
+def reset_attendance(start_date, end_date):
+    """
+    Delete all the attendance and create the classes of the new range, dates
+    given as YYYY-MM-DD. Returns the number of classes created.
+    """
+    start_date, end_date = date.fromisoformat(start_date), date.fromisoformat(end_date)
+    a = AttendanceRange.objects.first() or AttendanceRange()
+    a.start_date = start_date
+    a.end_date = end_date
+    a.save()
+
+    closed = closed_dates(start_date, end_date)
+    created = sum(run_on_shards(reset_classes, start_date, end_date, closed).values())
+    engine.evict()
+    versions.bump('attendance', everyone=True)
+    return created
+
+
+def reset_classes(start_date, end_date, closed):
+    """The department rows of reset_attendance, on the current shard."""
+    Attendance.objects.all().delete()
+    AttendanceClass.objects.all().delete()
+    ClassDayRollup.objects.all().delete()
+    StudentWeekRollup.objects.all().delete()
+    AttendanceTotal.objects.update(present_count=0, total_count=0, percentage=0)
+    created = 0
+    # in lazy mode meetings are computed from AssignTime and AttendanceRange when viewed
+    if not settings.ATTENDANCE_LAZY:
+        times = list(AssignTime.objects.select_related('assign__class_id'))
+        for i, asst in enumerate(times):
+            dept_closed = dept_closed_dates(closed, asst.assign.class_id.dept_id)
+            dates = set(class_dates(asst.day, start_date, end_date, dept_closed))
+            existing = set(AttendanceClass.objects.filter(assign=asst.assign, date__in=dates).values_list('date', flat=True))
+            new = [AttendanceClass(date=d, assign=asst.assign) for d in sorted(dates - existing)]
+            AttendanceClass.objects.bulk_create(new)
+            created += len(new)
+            progress((i + 1) * 100 / len(times), '%d of %d timetable slots' % (i + 1, len(times)))
+    return created
+
+
+@job(name='rebuild_rollups')
+def rebuild_rollups():
+    rollups.rebuild()
+    counts = run_on_shards(lambda: (ClassDayRollup.objects.count(), StudentWeekRollup.objects.count())).values()
+    return {'class_days': sum(c[0] for c in counts), 'student_weeks': sum(c[1] for c in counts)}
+
+
+@job(name='send_notifications')
+def send_notifications():
+    return send_pending()
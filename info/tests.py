@@ -1,9 +1,36 @@
-from django.test import TestCase
+import time
+from datetime import date, timedelta
+from http.cookies import SimpleCookie
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.core import mail
+from django.core.cache import cache
+from django.db import connection, router
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.urls import resolve
+from django.views import View
+from info.attendance_engine import AttendanceEngine
 from info.models import Dept, Class, Course, User, Student, Teacher, Assign, AssignTime, AttendanceTotal, Attendance, StudentCourse, Marks, MarksClass
 from django.urls import reverse
 from django.test.client import Client
 from django.db.utils import IntegrityError # Import IntegrityError for potential try-except blocks if needed
 from info.models import Dept, Class, Course, User, Student, Teacher, Assign, AssignTime, AttendanceTotal, Attendance, StudentCourse, Marks, MarksClass, AttendanceClass # Add AttendanceClass here
+from info.models import AttendanceRange, Holiday, Leave, Substitution
+from info.leave import plan_leaves
+from info.writebehind import WriteBehind, write, writer
+from info.db import configure_sqlite
+from info.middleware import ReplicaMiddleware, ShardMiddleware
+from info.routers import read_replica
+from info.sharding import use_shard, fan_out, shared_models, request_shard_of, locate, url_shard, id_start, reserve_ids
+from info.models import ClassDayRollup, StudentWeekRollup, Notification
+from info.records import record_attendance, record_marks, delete_classes
+from info.notifications import send_pending
+from info.models import Job
+from info.jobs import job, progress, claim, work
+from django.utils import timezone
+from info import rollups, versions
 
 # Create your tests here.
 
@@ -223,3 +250,695 @@ def test_attendance_view(self):
     #     resp = self.client.get(reverse('t_clas', args=(t.id, 1)))
     #     self.assertEqual(resp.status_code, 200)
     #     self.assertContains(resp, "Enter Attendance")
+
+
+class AttendanceEngineTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        dept = Dept.objects.create(id='EN', name='Engine Dept')
+        cls.cl = Class.objects.create(id='EN1A', dept=dept, sem=1, section='A')
+        cls.cr = Course.objects.create(id='EN101', dept=dept, name='Engines', shortname='EN')
+        t = Teacher.objects.create(id='EN_T', dept=dept, name='Engine Teacher')
+        cls.ass = Assign.objects.create(class_id=cls.cl, course=cls.cr, teacher=t)
+        cls.s1 = Student.objects.create(USN='EN001', name='Engine One', class_id=cls.cl)
+        cls.s2 = Student.objects.create(USN='EN002', name='Engine Two', class_id=cls.cl)
+        for day, (p1, p2) in enumerate([(True, True), (True, False), (False, False)], start=1):
+            assc = AttendanceClass.objects.create(assign=cls.ass, date='2025-01-0%d' % day, status=1)
+            Attendance.objects.create(course=cls.cr, student=cls.s1, attendanceclass=assc, date=assc.date, status=p1)
+            Attendance.objects.create(course=cls.cr, student=cls.s2, attendanceclass=assc, date=assc.date, status=p2)
+
+    def setUp(self):
+        self.engine = AttendanceEngine(max_sections=1)
+
+    def test_percentages_and_range(self):
+        p = self.engine.percentages(self.cl.id, self.cr.id)
+        self.assertEqual(p['EN001'], (2, 3, 66.67))
+        self.assertEqual(p['EN002'], (1, 3, 33.33))
+        p = self.engine.percentages(self.cl.id, self.cr.id, start=date(2025, 1, 2), end=date(2025, 1, 2))
+        self.assertEqual(p['EN002'], (0, 1, 0.0))
+        self.assertEqual([u for u, _ in self.engine.below(self.cl.id, self.cr.id, 50)], ['EN002'])
+
+    def test_record_without_queries(self):
+        self.engine.section(self.cl.id, self.cr.id)
+        self.engine.record(self.cl.id, self.cr.id, 999, date(2025, 1, 4), {'EN002': True})
+        with self.assertNumQueries(0):
+            p = self.engine.percentages(self.cl.id, self.cr.id)
+        self.assertEqual(p['EN002'], (2, 4, 50.0))
+        self.assertEqual(p['EN001'], (2, 3, 66.67))
+
+    def test_write_of_another_process(self):
+        self.engine.section(self.cl.id, self.cr.id)
+        # a write of another process only shows in the shared version stamps
+        assc = AttendanceClass.objects.create(assign=self.ass, date='2025-01-04', status=1)
+        Attendance.objects.create(course=self.cr, student=self.s2, attendanceclass=assc, date=assc.date, status=True)
+        foreign = versions.bump('attendance', classes=[self.cl.id])
+        # a local write made after it drops the section instead of patching it
+        self.engine.record(self.cl.id, self.cr.id, 999, date(2025, 1, 5), {'EN002': True}, foreign, time.time())
+        self.assertFalse(self.engine.is_loaded(self.cl.id, self.cr.id))
+        self.engine.section(self.cl.id, self.cr.id)
+        versions.bump('attendance', everyone=True)
+        self.assertEqual(self.engine.percentages(self.cl.id, self.cr.id)['EN002'], (2, 4, 50.0))
+
+    def test_lru_eviction(self):
+        self.engine.section(self.cl.id, self.cr.id)
+        self.engine.section(self.cl.id, 'OTHER')
+        self.assertFalse(self.engine.is_loaded(self.cl.id, self.cr.id))
+        self.assertTrue(self.engine.is_loaded(self.cl.id, 'OTHER'))
+
+
+@override_settings(ATTENDANCE_LAZY=True)
+class LazyAttendanceClassTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        dept = Dept.objects.create(id='LZ', name='Lazy Dept')
+        cl = Class.objects.create(id='LZ1A', dept=dept, sem=1, section='A')
+        cr = Course.objects.create(id='LZ101', dept=dept, name='Lazy', shortname='LZ')
+        cls.user = User.objects.create(username='lazy_teacher')
+        t = Teacher.objects.create(id='LZ_T', dept=dept, name='Lazy Teacher', user=cls.user)
+        cls.ass = Assign.objects.create(class_id=cl, course=cr, teacher=t)
+        cls.stud = Student.objects.create(USN='LZ001', name='Lazy Student', class_id=cl)
+        AttendanceRange.objects.create(start_date=date(2025, 1, 1), end_date=date(2025, 1, 31))
+        AssignTime.objects.create(assign=cls.ass, day='Monday', period='7:30 - 8:30')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_no_rows_until_recorded(self):
+        self.assertFalse(AttendanceClass.objects.exists())
+        att_list = self.ass.scheduled_classes(date(2025, 1, 20))
+        self.assertEqual([a.date for a in att_list], [date(2025, 1, 20), date(2025, 1, 13), date(2025, 1, 6)])
+        self.assertTrue(all(a.id is None for a in att_list))
+
+    def test_confirm_scheduled_class(self):
+        resp = self.client.post(reverse('confirm_date', args=(self.ass.id, '2025-01-13')), {'LZ001': 'present'})
+        self.assertEqual(resp.status_code, 302)
+        assc = AttendanceClass.objects.get()
+        self.assertEqual((assc.date, assc.status), (date(2025, 1, 13), 1))
+        self.assertTrue(Attendance.objects.get(attendanceclass=assc, student=self.stud).status)
+        self.client.get(reverse('cancel_class_date', args=(self.ass.id, '2025-01-20')))
+        self.assertEqual(AttendanceClass.objects.get(date=date(2025, 1, 20)).status, 2)
+        self.assertEqual(AttendanceClass.objects.count(), 2)
+
+
+class HolidayTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.dept = Dept.objects.create(id='HD', name='Holiday Dept')
+        other = Dept.objects.create(id='HO', name='Other Dept')
+        t = Teacher.objects.create(id='HD_T', dept=cls.dept, name='Holiday Teacher')
+        cls.ass = Assign.objects.create(
+            class_id=Class.objects.create(id='HD1A', dept=cls.dept, sem=1, section='A'),
+            course=Course.objects.create(id='HD101', dept=cls.dept, name='Holidays', shortname='HD'), teacher=t)
+        cls.other_ass = Assign.objects.create(
+            class_id=Class.objects.create(id='HO1A', dept=other, sem=1, section='A'),
+            course=Course.objects.create(id='HO101', dept=other, name='Others', shortname='HO'), teacher=t)
+        AttendanceRange.objects.create(start_date=date(2025, 1, 1), end_date=date(2025, 1, 31))
+
+    def test_holiday_cancels_classes(self):
+        taken = AttendanceClass.objects.create(assign=self.ass, date='2025-01-06', status=1)
+        open_c = AttendanceClass.objects.create(assign=self.ass, date='2025-01-07')
+        other_c = AttendanceClass.objects.create(assign=self.other_ass, date='2025-01-07')
+        # one INSERT for the holiday and one UPDATE for its classes
+        with self.assertNumQueries(2):
+            Holiday.objects.create(name='Dept day', start_date=date(2025, 1, 6), end_date=date(2025, 1, 8), dept=self.dept)
+        statuses = dict(AttendanceClass.objects.values_list('id', 'status'))
+        self.assertEqual((statuses[taken.id], statuses[open_c.id], statuses[other_c.id]), (1, 2, 0))
+        Holiday.objects.create(name='College day', start_date=date(2025, 1, 7), end_date=date(2025, 1, 7))
+        self.assertEqual(AttendanceClass.objects.get(id=other_c.id).status, 2)
+
+    def test_holiday_removed(self):
+        monday = AttendanceClass.objects.create(assign=self.ass, date='2025-01-06')
+        tuesday = AttendanceClass.objects.create(assign=self.ass, date='2025-01-07')
+        cancelled = AttendanceClass.objects.create(assign=self.ass, date='2025-01-08', status=2)
+        h = Holiday.objects.create(name='Dept days', start_date=date(2025, 1, 6), end_date=date(2025, 1, 8), dept=self.dept)
+        college = Holiday.objects.create(name='College day', start_date=date(2025, 1, 7), end_date=date(2025, 1, 7))
+
+        def statuses():
+            return [AttendanceClass.objects.get(id=a.id).status for a in (monday, tuesday, cancelled)]
+        # shrinking the holiday opens the dates it no longer covers
+        h.start_date = date(2025, 1, 7)
+        h.save()
+        self.assertEqual(statuses(), [0, 2, 2])
+        # the college holiday still covers tuesday, the teacher cancelled wednesday
+        h.delete()
+        self.assertEqual(statuses(), [0, 2, 2])
+        college.delete()
+        self.assertEqual(statuses(), [0, 0, 2])
+
+    def test_closed_dates_skipped(self):
+        Holiday.objects.create(name='College day', start_date=date(2025, 1, 13), end_date=date(2025, 1, 13))
+        AssignTime.objects.create(assign=self.ass, day='Monday', period='7:30 - 8:30')
+        dates = set(self.ass.attendanceclass_set.values_list('date', flat=True))
+        self.assertEqual(dates, {date(2025, 1, 6), date(2025, 1, 20), date(2025, 1, 27)})
+
+
+class LeaveTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        dept = Dept.objects.create(id='LV', name='Leave Dept')
+        cl = Class.objects.create(id='LV1A', dept=dept, sem=1, section='A')
+        cr = Course.objects.create(id='LV101', dept=dept, name='Leave', shortname='LV')
+        cls.absent, cls.b, cls.c, cls.busy = [
+            Teacher.objects.create(id='LV_%s' % n, dept=dept, name=n) for n in 'ABCD']
+        AttendanceRange.objects.create(start_date=date(2025, 1, 1), end_date=date(2025, 1, 31))
+        cls.ass = Assign.objects.create(class_id=cl, course=cr, teacher=cls.absent)
+        AssignTime.objects.create(assign=cls.ass, day='Monday', period='7:30 - 8:30')
+        busy_ass = Assign.objects.create(class_id=cl, course=Course.objects.create(
+            id='LV102', dept=dept, name='Busy', shortname='BS'), teacher=cls.busy)
+        AssignTime.objects.create(assign=busy_ass, day='Monday', period='7:30 - 8:30')
+
+    def test_plan_balances_load(self):
+        leave = Leave.objects.create(teacher=self.absent, start_date=date(2025, 1, 6), end_date=date(2025, 1, 14))
+        planned, uncovered = plan_leaves([leave])
+        self.assertEqual(uncovered, [])
+        self.assertEqual(sorted(s.teacher_id for s in planned), ['LV_B', 'LV_C'])
+        self.assertEqual(Substitution.objects.count(), 2)
+        # planning again does not duplicate substitutions
+        self.assertEqual(plan_leaves([leave]), ([], []))
+
+    def test_uncovered_when_everyone_away(self):
+        leaves = [Leave.objects.create(teacher=t, start_date=date(2025, 1, 6), end_date=date(2025, 1, 6))
+                  for t in (self.absent, self.b, self.c)]
+        planned, uncovered = plan_leaves(leaves)
+        self.assertEqual(planned, [])
+        self.assertEqual(len(uncovered), 1)
+
+    def test_colleague_on_another_leave(self):
+        leave = Leave.objects.create(teacher=self.absent, start_date=date(2025, 1, 6), end_date=date(2025, 1, 6))
+        Leave.objects.create(teacher=self.b, start_date=date(2025, 1, 5), end_date=date(2025, 1, 7))
+        planned, uncovered = plan_leaves([leave])
+        self.assertEqual([s.teacher_id for s in planned], ['LV_C'])
+
+        self.c.user = User.objects.create(username='lv_c')
+        self.c.save()
+        self.client.force_login(self.c.user)
+        with mock.patch('django.utils.timezone.localdate', return_value=date(2025, 1, 6)):
+            resp = self.client.get(reverse('t_substitutions', args=(self.c.id,)))
+        self.assertContains(resp, 'Leave')
+        self.assertContains(resp, reverse('t_attendance', args=(planned[0].attendanceclass_id,)))
+
+
+class RolesTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        dept = Dept.objects.create(id='RL', name='Roles Dept')
+        cl = Class.objects.create(id='RL1A', dept=dept, sem=1, section='A')
+        cls.student_user = User.objects.create(username='roles_student')
+        Student.objects.create(USN='RL001', name='Roles Student', class_id=cl, user=cls.student_user)
+        cls.admin_user = User.objects.create(username='roles_admin', is_superuser=True)
+
+    def test_roles_single_query(self):
+        user = User.objects.get(pk=self.student_user.pk)
+        with self.assertNumQueries(1):
+            self.assertTrue(user.is_student)
+            self.assertFalse(user.is_teacher)
+
+    def test_roles_from_session(self):
+        self.client.force_login(self.admin_user)
+        self.assertEqual(self.client.session['roles'], [])
+        # session and user only
+        with self.assertNumQueries(2):
+            resp = self.client.get(reverse('index'))
+        self.assertTemplateUsed(resp, 'info/admin_page.html')
+        self.client.force_login(self.student_user)
+        self.assertEqual(self.client.session['roles'], ['student'])
+        self.assertTemplateUsed(self.client.get(reverse('index')), 'info/homepage.html')
+
+
+class WriteBehindTest(TransactionTestCase):
+    # the writer thread opens its own transactions
+
+    def setUp(self):
+        self.writer = WriteBehind(interval=0.05, max_batch=10)
+        self.addCleanup(self.writer.close)
+
+    def test_writes_are_batched(self):
+        done = []
+        futures = [self.writer.submit(done.append, i) for i in range(5)]
+        for f in futures:
+            self.assertIsNone(f.result(timeout=5))
+        self.assertEqual(done, [0, 1, 2, 3, 4])
+        self.assertEqual(self.writer.batches, 1)
+
+    def test_old_connections_closed(self):
+        # checked before each batch, as Django does at the start of a request
+        with mock.patch('info.writebehind.close_old_connections') as close:
+            self.writer.submit(lambda: None).result(timeout=5)
+            self.writer.close()
+            self.writer.submit(lambda: None).result(timeout=5)
+        self.assertEqual(close.call_count, 2)
+
+    def test_failing_write(self):
+        ok = self.writer.submit(lambda: 'ok')
+        failing = self.writer.submit(lambda: 1 / 0)
+        self.assertEqual(ok.result(timeout=5), 'ok')
+        with self.assertRaises(ZeroDivisionError):
+            failing.result(timeout=5)
+
+    def test_disabled(self):
+        # without ATTENDANCE_WRITE_BEHIND writes run in the calling thread
+        self.assertEqual(write(lambda x: x * 2, 21), 42)
+
+    @override_settings(ATTENDANCE_WRITE_BEHIND=True)
+    def test_confirm_through_writer(self):
+        self.addCleanup(writer.close)
+        dept = Dept.objects.create(id='WB', name='Writer Dept')
+        cl = Class.objects.create(id='WB1A', dept=dept, sem=1, section='A')
+        cr = Course.objects.create(id='WB101', dept=dept, name='Writes', shortname='WB')
+        ass = Assign.objects.create(class_id=cl, course=cr, teacher=Teacher.objects.create(id='WB_T', dept=dept, name='t'))
+        for i in range(2):
+            Student.objects.create(USN='WB00%d' % i, name='s', class_id=cl)
+        assc = AttendanceClass.objects.create(assign=ass, date=date(2026, 10, 19))
+        self.client.force_login(User.objects.create(username='writer_teacher'))
+        batches = writer.batches
+        resp = self.client.post(reverse('confirm', args=(assc.id,)), {'WB000': 'present', 'WB001': 'absent'})
+        self.assertEqual(resp.status_code, 302)
+        # written and committed by the writer thread before the response
+        self.assertEqual(writer.batches, batches + 1)
+        self.assertEqual(dict(Attendance.objects.filter(attendanceclass=assc).values_list('student', 'status')),
+                         {'WB000': True, 'WB001': False})
+        assc.refresh_from_db()
+        self.assertEqual(assc.status, 1)
+        self.assertEqual(AttendanceTotal.objects.get(student='WB000', course=cr).percentage, 100)
+
+
+class SQLiteProfileTest(TestCase):
+
+    def test_pragmas(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite only')
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA cache_size')
+            default = cursor.fetchone()[0]
+            with override_settings(SQLITE_PRAGMAS={'cache_size': -32000}):
+                configure_sqlite(None, connection)
+            cursor.execute('PRAGMA cache_size')
+            self.assertEqual(cursor.fetchone()[0], -32000)
+            cursor.execute('PRAGMA cache_size = %d' % default)
+
+
+class MarksConfirmTest(TestCase):
+
+    def test_marks_confirm(self):
+        dept = Dept.objects.create(id='MK', name='Marks Dept')
+        cl = Class.objects.create(id='MK1A', dept=dept, sem=1, section='A')
+        cr = Course.objects.create(id='MK101', dept=dept, name='Marks', shortname='MK')
+        ass = Assign.objects.create(class_id=cl, course=cr, teacher=Teacher.objects.create(id='MK_T', dept=dept, name='t'))
+        for i in range(2):
+            Student.objects.create(USN='MK00%d' % i, name='s', class_id=cl)
+        mc = MarksClass.objects.get(assign=ass, name='Internal test 1')
+        self.client.force_login(User.objects.create(username='marks_teacher'))
+        resp = self.client.post(reverse('marks_confirm', args=(mc.id,)), {'MK000': '15', 'MK001': '18'})
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(dict(Marks.objects.filter(name='Internal test 1', studentcourse__course=cr).values_list(
+            'studentcourse__student', 'marks1')), {'MK000': 15, 'MK001': 18})
+        mc.refresh_from_db()
+        self.assertTrue(mc.status)
+
+
+@read_replica
+def report_view(request):
+    return HttpResponse(router.db_for_read(Student))
+
+
+def writing_report_view(request):
+    Student.objects.filter(USN='nobody').update(name='x')
+    return HttpResponse(router.db_for_read(Student))
+
+
+class PrimaryView(View):
+    read_replica = False
+
+    def get(self, request):
+        return HttpResponse(router.db_for_read(Student))
+
+
+@override_settings(READ_REPLICA='replica')
+class ReplicaRoutingTest(TestCase):
+    # only the routing decisions are tested, no replica database is configured
+
+    def setUp(self):
+        self.user = User.objects.create(username='replica_teacher')
+        self.cookies = SimpleCookie()
+
+    def request(self, view, method='get', path='/teacher/1/Report/'):
+        factory = RequestFactory()
+        factory.cookies = self.cookies
+        request = getattr(factory, method)(path)
+        request.user = self.user
+        request.resolver_match = resolve(path)
+        middleware = ReplicaMiddleware(lambda r: middleware.process_view(r, view, (), {}) or view(r))
+        response = middleware(request)
+        self.cookies.update(response.cookies)
+        return response.content.decode()
+
+    def test_reports_read_from_replica(self):
+        self.assertEqual(self.request(report_view), 'replica')
+        self.assertEqual(self.request(lambda r: HttpResponse(router.db_for_read(Student))), 'default')
+        # outside of a request
+        self.assertEqual(router.db_for_read(Student), 'default')
+
+    def test_primary_api_view(self):
+        self.assertEqual(self.request(lambda r: HttpResponse(router.db_for_read(Student)), path='/api/marks/'),
+                         'replica')
+        self.assertEqual(self.request(PrimaryView.as_view(), path='/api/changes/'), 'default')
+        # the views whose results are kept by version stamp
+        for path in ('/api/changes/', '/api/teacher/assigns/1/roster/'):
+            self.assertIs(resolve(path).func.view_class.read_replica, False)
+
+    def test_read_your_writes(self):
+        self.assertEqual(self.request(read_replica(writing_report_view)), 'default')
+        self.request(report_view, method='post')
+        # the pin is in a cookie, not in the memory of the process
+        cache.clear()
+        self.assertEqual(self.request(report_view), 'default')
+        with mock.patch('time.time', return_value=time.time() + 11):
+            self.assertEqual(self.request(report_view), 'replica')
+        # another client is not pinned
+        self.cookies = SimpleCookie()
+        self.assertEqual(self.request(report_view), 'replica')
+
+
+@override_settings(DEPT_SHARDS={'SH': 'shard1'})
+class ShardRouterTest(TestCase):
+    # only the routing decisions are tested, no shard database is configured
+
+    def test_routing(self):
+        self.assertEqual(router.db_for_read(Attendance), 'default')
+        with use_shard('SH'):
+            self.assertEqual(router.db_for_read(Attendance), 'shard1')
+            self.assertEqual(router.db_for_write(Student), 'shard1')
+            # shared tables stay on the default database
+            self.assertEqual(router.db_for_read(Course), 'default')
+        with use_shard('OTHER'):
+            self.assertEqual(router.db_for_write(Attendance), 'default')
+        stud = Student(USN='SH001')
+        stud._state.db, stud._state.adding = 'shard1', False
+        self.assertEqual(router.db_for_read(Attendance, instance=stud), 'shard1')
+        self.assertNotIn(Student, shared_models())
+        self.assertIn(Dept, shared_models())
+
+    def test_new_rows(self):
+        # a new row goes to the shard of its department, through the rows it holds
+        cl = Class(id='SH1A', dept_id='SH')
+        self.assertEqual(router.db_for_write(Class, instance=cl), 'shard1')
+        stud = Student(USN='SH001', class_id=cl)
+        self.assertEqual(router.db_for_write(Student, instance=stud), 'shard1')
+        self.assertEqual(router.db_for_write(Attendance, instance=Attendance(student=stud)), 'shard1')
+        self.assertEqual(router.db_for_write(Class, instance=Class(id='OT1A', dept_id='OTHER')), 'default')
+        # a student referenced by id is looked up
+        with mock.patch('info.sharding.locate', return_value='shard1') as locate:
+            self.assertEqual(router.db_for_write(Attendance, instance=Attendance(student_id='SH002')), 'shard1')
+        locate.assert_called_once_with(Student, pk='SH002')
+        # a saved student, after a shared course from which Django guesses the default database
+        saved = Student(USN='SH003')
+        saved._state.db, saved._state.adding = 'shard1', False
+        self.assertEqual(router.db_for_write(Attendance, instance=Attendance(course=Course(id='SH101'), student=saved)),
+                         'shard1')
+        # and so are the rows created through the manager
+        self.assertEqual(Class.objects.all()._for_new({'id': 'SH1B', 'dept_id': 'SH'}).db, 'shard1')
+        with mock.patch('info.sharding.locate', return_value='shard1') as locate:
+            self.assertEqual(AttendanceClass.objects.all()._for_new({'assign_id': 7, 'date__gte': None}).db, 'shard1')
+        locate.assert_called_once_with(Assign, pk=7)
+
+    def test_url_shard(self):
+        with mock.patch('info.sharding.locate', return_value='shard1') as locate:
+            self.assertEqual(url_shard({'assign_id': 7, 'date': '2026-10-19'}), 'shard1')
+        locate.assert_called_once_with(Assign, pk=7)
+        self.assertIsNone(url_shard({'teacher_id': 'SH_T'}))
+        request = RequestFactory().get('/')
+        with mock.patch('info.sharding.locate', return_value='shard1'), request_shard_of(request):
+            ShardMiddleware(lambda r: None).process_view(request, None, (), {'stud_id': 'SH001'})
+            self.assertEqual(router.db_for_read(Attendance), 'shard1')
+
+    def test_shared_rows(self):
+        self.assertEqual(router.db_for_read(Class, instance=Dept(id='SH')), 'shard1')
+        # the classes of a teacher or a course can be in any department
+        self.assertEqual(router.db_for_read(Assign, instance=Teacher(id='SH_T', dept_id='SH')), 'default')
+        self.assertEqual(router.db_for_read(Assign, instance=Course(id='SH101', dept_id='SH')), 'default')
+        # user.student is looked up on every shard
+        user = User(pk=1)
+        user._state.db = 'default'
+        with mock.patch('info.sharding.locate', return_value='shard1'):
+            self.assertEqual(router.db_for_read(Student, instance=user), 'shard1')
+
+    def test_request_shard(self):
+        with self.settings(DEPT_SHARDS={}):
+            dept = Dept.objects.create(id='SH', name='Sharded')
+            user = User.objects.create(username='shard_teacher')
+            Teacher.objects.create(id='SH_T', dept=dept, name='t', user=user)
+        request = RequestFactory().get('/')
+        request.user = user
+        with request_shard_of(request):
+            self.assertEqual(router.db_for_read(Attendance), 'shard1')
+            # rows of the department picked explicitly
+            with use_shard('OTHER'):
+                self.assertEqual(router.db_for_read(Attendance), 'default')
+        self.assertEqual(router.db_for_read(Attendance), 'default')
+
+    def test_fan_out(self):
+        self.assertEqual(fan_out(lambda alias: alias.upper()), {'default': 'DEFAULT', 'shard1': 'SHARD1'})
+
+
+@override_settings(DEPT_SHARDS={'SH': 'default'})
+class ShardAdminTest(TestCase):
+    # the shard of SH is the default database, the one configured in the tests
+
+    def test_changelist(self):
+        dept = Dept.objects.create(id='SH', name='Sharded')
+        Class.objects.create(id='SH1A', dept=dept, sem=1, section='A')
+        self.client.force_login(User.objects.create(username='shard_admin', is_staff=True, is_superuser=True))
+        resp = self.client.get('/admin/info/class/')
+        self.assertContains(resp, 'default (1)')
+        self.assertContains(self.client.get('/admin/info/class/', {'shard': 'default'}), 'SH1A')
+        self.assertEqual(locate(Class, pk='SH1A'), 'default')
+        self.assertIsNone(locate(Class, pk='NONE'))
+
+
+# a second database, configured with DB_SHARDS=shard1=/path/shard1.sqlite3
+SHARD_DB = next((alias for alias in settings.DATABASES
+                 if alias not in ('default', getattr(settings, 'READ_REPLICA', None))), None)
+
+
+@skipUnless(SHARD_DB, 'needs a second database in DB_SHARDS')
+class CrossShardTest(TransactionTestCase):
+    # fan_out reads the shards from other threads, which only see committed rows
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+
+    def test_teacher_of_other_department(self):
+        with self.settings(DEPT_SHARDS={'XB': SHARD_DB}):
+            reserve_ids(SHARD_DB)
+            a = Dept.objects.create(id='XA', name='Dept A')
+            b = Dept.objects.create(id='XB', name='Dept B')
+            user = User.objects.create(username='xa_teacher')
+            teacher = Teacher.objects.create(id='XA_T', dept=a, name='t', user=user)
+            cr = Course.objects.create(id='XB101', dept=b, name='Sharded', shortname='SH')
+            # created through the manager, on the shard of the class
+            cl = Class.objects.create(id='XB1A', dept=b, sem=1, section='A')
+            ass = Assign.objects.create(class_id=cl, course=cr, teacher=teacher)
+            self.assertEqual((cl._state.db, ass._state.db), (SHARD_DB, SHARD_DB))
+            self.assertGreater(ass.id, id_start(SHARD_DB))
+            self.assertFalse(Assign.objects.using('default').filter(teacher=teacher).exists())
+
+            self.client.force_login(user)
+            self.assertContains(self.client.get(reverse('t_clas', args=(teacher.id, 1))),
+                                reverse('t_class_date', args=(ass.id,)))
+            self.assertEqual(self.client.get(reverse('t_class_date', args=(ass.id,))).status_code, 200)
+            resp = self.client.get(reverse('cancel_class_date', args=(ass.id, '2026-10-19')))
+            self.assertEqual(resp.status_code, 302)
+            self.assertTrue(AttendanceClass.objects.using(SHARD_DB).filter(assign=ass.id, status=2).exists())
+
+
+    def test_staff_reports(self):
+        with self.settings(DEPT_SHARDS={'XB': SHARD_DB}):
+            reserve_ids(SHARD_DB)
+            for d in ('XA', 'XB'):
+                dept = Dept.objects.create(id=d, name=d)
+                cr = Course.objects.create(id=d + '101', dept=dept, name=d, shortname=d)
+                cl = Class.objects.create(id=d + '1A', dept=dept, sem=1, section='A')
+                stud = Student.objects.create(USN=d + '001', name=d, class_id=cl)
+                AttendanceTotal.objects.create(student=stud, course=cr, present_count=1, total_count=4,
+                                               percentage=25.0 if d == 'XA' else 20.0)
+                ClassDayRollup.objects.create(class_id=cl, course=cr, date=date(2026, 10, 19), present=1, total=4)
+            self.client.force_login(User.objects.create(username='x_staff', is_staff=True))
+            resp = self.client.get('/api/shortages/')
+            self.assertEqual([r['USN'] for r in resp.json()['shortages']], ['XB001', 'XA001'])
+            self.assertEqual([r['USN'] for r in self.client.get('/api/shortages/', {'limit': 1}).json()['shortages']],
+                             ['XB001'])
+            resp = self.client.get('/api/trends/XB1A/')
+            self.assertEqual([(t['present'], t['total']) for t in resp.json()['trend']], [(1, 4)])
+
+
+class RollupTest(TestCase):
+
+    def test_incremental_matches_rebuild(self):
+        dept = Dept.objects.create(id='RU', name='Rollup Dept')
+        cl = Class.objects.create(id='RU1A', dept=dept, sem=1, section='A')
+        cr = Course.objects.create(id='RU101', dept=dept, name='Rollups', shortname='RU')
+        ass = Assign.objects.create(class_id=cl, course=cr, teacher=Teacher.objects.create(id='RU_T', dept=dept, name='t'))
+        for i in range(3):
+            Student.objects.create(USN='RU00%d' % i, name='s', class_id=cl)
+        monday = AttendanceClass.objects.create(assign=ass, date=date(2026, 10, 19))
+        tuesday = AttendanceClass.objects.create(assign=ass, date=date(2026, 10, 20))
+        record_attendance(monday, {'RU000': True, 'RU001': False, 'RU002': True})
+        record_attendance(tuesday, {'RU000': True, 'RU001': True})
+        record_attendance(monday, {'RU001': True, 'RU002': False})
+
+        def snapshot():
+            return (sorted(ClassDayRollup.objects.values_list('class_id', 'course', 'date', 'present', 'total')),
+                    sorted(StudentWeekRollup.objects.values_list('student', 'course', 'week', 'present', 'total')),
+                    sorted(AttendanceTotal.objects.values_list('student', 'course', 'present_count', 'total_count',
+                                                                'percentage')))
+        incremental = snapshot()
+        self.assertEqual(incremental[0], [('RU1A', 'RU101', date(2026, 10, 19), 2, 3),
+                                          ('RU1A', 'RU101', date(2026, 10, 20), 2, 2)])
+        self.assertIn(('RU002', 'RU101', date(2026, 10, 19), 0, 1), incremental[1])
+        self.assertEqual(incremental[2], [('RU000', 'RU101', 2, 2, 100.0), ('RU001', 'RU101', 2, 2, 100.0),
+                                          ('RU002', 'RU101', 0, 1, 0.0)])
+        rollups.rebuild()
+        self.assertEqual(snapshot(), incremental)
+
+        # deleting a class takes its attendance out of the rollups
+        delete_classes(AttendanceClass.objects.filter(id=monday.id))
+        incremental = snapshot()
+        self.assertEqual(incremental[2], [('RU000', 'RU101', 1, 1, 100.0), ('RU001', 'RU101', 1, 1, 100.0),
+                                          ('RU002', 'RU101', 0, 0, 0)])
+        rollups.rebuild()
+        self.assertEqual(snapshot()[:2], incremental[:2])
+        # deleting the assign takes the rest
+        ass.delete()
+        self.assertFalse(AttendanceTotal.objects.filter(present_count__gt=0).exists())
+
+
+class NotificationTest(TestCase):
+
+    def setUp(self):
+        dept = Dept.objects.create(id='NT', name='Notify Dept')
+        cl = Class.objects.create(id='NT1A', dept=dept, sem=1, section='A')
+        self.cr = Course.objects.create(id='NT101', dept=dept, name='Notices', shortname='NO')
+        self.ass = Assign.objects.create(class_id=cl, course=self.cr,
+                                         teacher=Teacher.objects.create(id='NT_T', dept=dept, name='t'))
+        Student.objects.create(USN='NT000', name='Asha', class_id=cl, parent_email='parent@example.com',
+                               user=User.objects.create(username='nt_asha', email='asha@example.com'))
+        Student.objects.create(USN='NT001', name='Ravi', class_id=cl, parent_email='ravi.parent@example.com')
+        Student.objects.create(USN='NT002', name='Nobody', class_id=cl)
+
+    def test_shortage_and_marks(self):
+        for day, statuses in ((19, {'NT000': True, 'NT001': True, 'NT002': False}),
+                              (20, {'NT000': False, 'NT001': True, 'NT002': False}),
+                              (21, {'NT000': False, 'NT001': True, 'NT002': False})):
+            record_attendance(AttendanceClass.objects.create(assign=self.ass, date=date(2026, 10, day)), statuses)
+        # notified when falling under the threshold, not again while under it
+        self.assertEqual(sorted(Notification.objects.filter(kind='shortage').values_list('student', flat=True)),
+                         ['NT000', 'NT002'])
+        record_marks(MarksClass.objects.get(assign=self.ass, name='Internal test 1'), {'NT000': 15, 'NT001': 18})
+
+        with self.assertNumQueries(2):
+            self.assertEqual(send_pending(), 3)
+        self.assertEqual(sorted(m.to for m in mail.outbox),
+                         [['asha@example.com'], ['parent@example.com'], ['ravi.parent@example.com']])
+        asha = next(m for m in mail.outbox if 'asha@example.com' in m.to)
+        self.assertIn('Notices is 50.0%', asha.body)
+        self.assertIn('Internal test 1 marks in Notices: 15', asha.body)
+        self.assertFalse(Notification.objects.filter(sent__isnull=True).exists())
+        self.assertEqual(send_pending(), 0)
+
+    def test_one_message_per_address(self):
+        # Mira shares the parent of Asha
+        Student.objects.create(USN='NT003', name='Mira', class_id=Class.objects.get(id='NT1A'),
+                               parent_email='parent@example.com')
+        record_marks(MarksClass.objects.get(assign=self.ass, name='Internal test 1'),
+                     {'NT000': 15, 'NT001': 18, 'NT003': 12})
+        self.assertEqual(send_pending(batch_size=1), 3)
+        self.assertEqual(sorted(m.to for m in mail.outbox),
+                         [['asha@example.com'], ['parent@example.com'], ['ravi.parent@example.com']])
+        parent = next(m for m in mail.outbox if m.to == ['parent@example.com'])
+        self.assertEqual(parent.body, 'Dear Asha, Mira,\n\nAsha:\nInternal test 1 marks in Notices: 15.\n\n'
+                                      'Mira:\nInternal test 1 marks in Notices: 12.\n')
+        self.assertFalse(Notification.objects.filter(sent__isnull=True).exists())
+
+    def test_marks_resubmitted(self):
+        mc = MarksClass.objects.get(assign=self.ass, name='Internal test 1')
+        self.client.force_login(User.objects.create(username='nt_teacher'))
+        for post in ({'NT000': '15', 'NT001': '18', 'NT002': '0'}, {'NT000': '15', 'NT001': '18', 'NT002': '0'},
+                     {'NT000': '15', 'NT001': '19', 'NT002': '0'}):
+            self.client.post(reverse('marks_confirm', args=(mc.id,)), post)
+        # everyone on the first entry, then only the changed marks
+        self.assertEqual(sorted(Notification.objects.filter(kind='marks').values_list('student', 'text')), [
+            ('NT000', 'Internal test 1 marks in Notices: 15.'), ('NT001', 'Internal test 1 marks in Notices: 18.'),
+            ('NT001', 'Internal test 1 marks in Notices: 19.'), ('NT002', 'Internal test 1 marks in Notices: 0.')])
+        resp = self.client.post(reverse('marks_confirm', args=(mc.id,)), {'NT000': 'x', 'NT001': '19', 'NT002': '0'})
+        self.assertEqual(resp.status_code, 400)
+
+
+calls = []
+
+
+@job(name='tests.flaky', max_attempts=2)
+def flaky(n):
+    calls.append(n)
+    progress(50, 'half way')
+    if len(calls) == 1:
+        raise ValueError('first attempt fails')
+    return n * 2
+
+
+@override_settings(JOB_RETRY_DELAY=0)
+class JobTest(TestCase):
+
+    def setUp(self):
+        calls.clear()
+
+    def test_retry(self):
+        j = flaky.enqueue(21)
+        self.assertEqual(work('w1', limit=1), 1)
+        j.refresh_from_db()
+        self.assertEqual((j.status, j.attempts, j.progress, j.message), ('queued', 1, 50, 'half way'))
+        self.assertIn('first attempt fails', j.error)
+        self.assertEqual(work('w1'), 1)
+        j.refresh_from_db()
+        self.assertEqual((j.status, j.attempts, j.progress, j.result, j.worker), ('done', 2, 100, 42, 'w1'))
+
+    def test_failed_after_max_attempts(self):
+        calls.append(0)
+        j = Job.objects.create(name='tests.flaky', args=[None], max_attempts=1)
+        work('w1')
+        j.refresh_from_db()
+        self.assertEqual(j.status, 'failed')
+        self.assertIn('TypeError', j.error)
+
+    def test_claim_once(self):
+        j = flaky.enqueue(1, run_after=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(claim('w1').id, j.id)
+        self.assertIsNone(claim('w2'))
+        # a worker that died is replaced after JOB_TIMEOUT
+        with override_settings(JOB_TIMEOUT=0):
+            self.assertEqual(claim('w2').worker, 'w2')
+
+    @override_settings(BACKGROUND_JOBS=True, ATTENDANCE_LAZY=False)
+    def test_reset_attendance_job(self):
+        dept = Dept.objects.create(id='JB', name='Job Dept')
+        cl = Class.objects.create(id='JB1A', dept=dept, sem=1, section='A')
+        cr = Course.objects.create(id='JB101', dept=dept, name='Jobs', shortname='JB')
+        ass = Assign.objects.create(class_id=cl, course=cr, teacher=Teacher.objects.create(id='JB_T', dept=dept, name='t'))
+        AttendanceRange.objects.create(start_date=date(2026, 10, 1), end_date=date(2026, 10, 2))
+        AssignTime.objects.create(assign=ass, day='Monday', period='7:30 - 8:30')
+        AssignTime.objects.create(assign=ass, day='Monday', period='8:30 - 9:30')
+        self.client.force_login(User.objects.create(username='job_admin', is_staff=True, is_superuser=True))
+        resp = self.client.post(reverse('admin:reset_attd'), {'startdate': '2026-10-19', 'enddate': '2026-11-02'})
+        j = Job.objects.get()
+        self.assertRedirects(resp, reverse('admin:info_job_change', args=(j.id,)))
+        self.assertEqual(AttendanceRange.objects.get().start_date, date(2026, 10, 1))
+        work('w1')
+        j.refresh_from_db()
+        self.assertEqual((j.status, j.result), ('done', 2))
+        self.assertEqual(sorted(AttendanceClass.objects.values_list('date', flat=True)),
+                         [date(2026, 10, 19), date(2026, 10, 26)])
@@ -0,0 +1,82 @@
+"""
+In-process index of the weekly timetable, resolving a class and a moment to the
+assignment being taught then.
+
+The index is built from AssignTime in one query per department shard. It is dropped on timetable changes
+made in this process and rebuilt at least every DEVICE_TIMETABLE_TTL seconds, for
+changes made by other processes.
+"""
+import threading
+import time
+from bisect import bisect_right
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+
+from .models import AssignTime, DAYS_OF_WEEK, time_slots
+from .sharding import fan_out
+
+
+def parse_slot(slot):
+    """Return the (start, end) times of a time slot label like '12:40 - 1:30'."""
+    times = []
+    for part in slot.split('-'):
+        h, m = (int(x) for x in part.strip().split(':'))
+        # labels use a 12 hour clock, the college day runs from 7:30 to 5:30
+        if h < 7:
+            h += 12
+        times.append(datetime.strptime('%d:%02d' % (h, m), '%H:%M').time())
+    return tuple(times)
+
+
+class TimetableIndex:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._assigns = None
+        self._built = 0
+        self.slots = sorted((parse_slot(p[0]) + (p[0],) for p in time_slots))
+        self.starts = [s[0] for s in self.slots]
+
+    def invalidate(self, *args, **kwargs):
+        self._assigns = None
+
+    def assigns(self):
+        """{(class id, day, period): assign id}"""
+        assigns = self._assigns
+        if assigns is None or time.monotonic() - self._built > getattr(settings, 'DEVICE_TIMETABLE_TTL', 60):
+            with self._lock:
+                # class ids are unique over the department shards, the assign ids on each of them
+                rows = fan_out(lambda alias: list(AssignTime.objects.using(alias).values_list(
+                    'assign__class_id', 'day', 'period', 'assign_id')))
+                assigns = {(c, d, p): a for shard_rows in rows.values() for c, d, p, a in shard_rows}
+                self._assigns = assigns
+                self._built = time.monotonic()
+        return assigns
+
+    def period(self, moment):
+        """
+        The period a local datetime falls in, or None.
+        Taps up to DEVICE_TAP_EARLY minutes before a period count for it.
+        """
+        early = timedelta(minutes=getattr(settings, 'DEVICE_TAP_EARLY', 10))
+        i = bisect_right(self.starts, (moment + early).time()) - 1
+        if i < 0 or moment.time() >= self.slots[i][1]:
+            return None
+        return self.slots[i][2]
+
+    def lookup(self, class_id, moment):
+        """The assign id taught to class_id at a local datetime, or None."""
+        if class_id is None or moment.weekday() >= len(DAYS_OF_WEEK):
+            return None
+        period = self.period(moment)
+        if period is None:
+            return None
+        return self.assigns().get((class_id, DAYS_OF_WEEK[moment.weekday()][0], period))
+
+
+index = TimetableIndex()
+
+post_save.connect(index.invalidate, sender=AssignTime)
+post_delete.connect(index.invalidate, sender=AssignTime)
@@ -20,12 +20,20 @@ urlpatterns = [
          views.t_clas, name='t_clas'),
     path('teacher/<int:assign_id>/Students/attendance/',
          views.t_student, name='t_student'),
+    path('teacher/<slug:teacher_id>/Substitutions/',
+         views.t_substitutions, name='t_substitutions'),
     path('teacher/<int:assign_id>/ClassDates/',
          views.t_class_date, name='t_class_date'),
     path('teacher/<int:ass_c_id>/Cancel/',
          views.cancel_class, name='cancel_class'),
     path('teacher/<int:ass_c_id>/attendance/',
          views.t_attendance, name='t_attendance'),
+    path('teacher/<int:assign_id>/<slug:date>/Scheduled_class/',
+         views.t_attendance_date, name='t_attendance_date'),
+    path('teacher/<int:assign_id>/<slug:date>/Scheduled_class/confirm/',
+         views.confirm_date, name='confirm_date'),
+    path('teacher/<int:assign_id>/<slug:date>/Scheduled_class/Cancel/',
+         views.cancel_class_date, name='cancel_class_date'),
     path('teacher/<int:ass_c_id>/Edit_att/', views.edit_att, name='edit_att'),
     path('teacher/<int:ass_c_id>/attendance/confirm/',
          views.confirm, name='confirm'),
@@ -55,6 +63,7 @@ urlpatterns = [
     path('teacher/<int:marks_c_id>/Edit_marks/',
          views.edit_marks, name='edit_marks'),
     path('api/auth/', include('djoser.urls')),
+    path('api/auth/', include('djoser.urls.authtoken')),
     path('add-teacher/', views.add_teacher, name='add_teacher'),
     path('add-student/', views.add_student, name='add_student'),
 ]
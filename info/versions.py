@@ -0,0 +1,94 @@
+"""
+Version stamps of the data served by the student APIs.
+
+Write paths bump the stamp of the students, classes or the whole college they
+change. A stamp is the time of the last change, stored in the VersionStamp table
+of the primary database and kept in the cache, so validating a client's copy
+needs no access to the main tables.
+
+Cached stamps expire after API_VERSION_TIMEOUT seconds and are read again from
+the table, so with a cache local to each process a bump made by another process
+is seen at the latest when the stamp expires, and an unchanged stamp stays the
+same. With a shared cache the setting can be None. A stamp never bumped is the
+time it was first read.
+"""
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+
+KINDS = ('profile', 'attendance', 'marks', 'timetable')
+
+
+def version_cache():
+    return caches[getattr(settings, 'API_VERSION_CACHE', 'default')]
+
+
+def version_timeout():
+    return getattr(settings, 'API_VERSION_TIMEOUT', 60)
+
+
+def version_key(kind, scope, id=''):
+    return 'version:%s:%s:%s' % (kind, scope, id)
+
+
+def stamp_table():
+    return apps.get_model('info', 'VersionStamp').objects.using(DEFAULT_DB_ALIAS)
+
+
+def bump(kind, students=(), classes=(), everyone=False):
+    now = time.time()
+    stamps = {version_key(kind, 'student', usn): now for usn in students}
+    stamps.update({version_key(kind, 'class', class_id): now for class_id in classes})
+    if everyone:
+        stamps[version_key(kind, 'all')] = now
+    table = stamp_table()
+    table.bulk_create([table.model(key=k, stamp=now) for k in stamps], update_conflicts=True,
+                      unique_fields=['key'], update_fields=['stamp'])
+    version_cache().set_many(stamps, version_timeout())
+    return now
+
+
+def stored(keys):
+    """Stamps of keys read from the table, storing the current time for the keys not there yet."""
+    table = stamp_table()
+    stamps = dict(table.filter(key__in=keys).values_list('key', 'stamp'))
+    missing = [k for k in keys if k not in stamps]
+    if missing:
+        now = time.time()
+        table.bulk_create([table.model(key=k, stamp=now) for k in missing], ignore_conflicts=True)
+        stamps.update(table.filter(key__in=missing).values_list('key', 'stamp'))
+    return stamps
+
+
+def _stamps(keys):
+    cache = version_cache()
+    stamps = cache.get_many(keys)
+    missing = [k for k in keys if k not in stamps]
+    if missing:
+        # add does not replace a stamp bumped in the meantime
+        for k, stamp in stored(missing).items():
+            cache.add(k, stamp, version_timeout())
+        stamps.update(cache.get_many(missing))
+    return [stamps.get(k, 0) for k in keys]
+
+
+def versions(kinds, usn, class_id, cached=True):
+    """
+    Return the stamps of the given kinds for a student, its class and the college,
+    read from the table rather than the cache when cached is False.
+    """
+    keys = []
+    for kind in kinds:
+        keys += [version_key(kind, 'student', usn), version_key(kind, 'class', class_id), version_key(kind, 'all')]
+    if cached:
+        return _stamps(keys)
+    stamps = stored(keys)
+    return [stamps.get(k, 0) for k in keys]
+
+
+def class_version(kind, class_id):
+    """Stamp of the last change of kind for a whole class, or for the college."""
+    return max(_stamps([version_key(kind, 'class', class_id), version_key(kind, 'all')]))
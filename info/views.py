@@ -1,11 +1,17 @@
+from datetime import datetime
+
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import HttpResponseRedirect
+from django.http import HttpResponseRedirect, HttpResponseBadRequest, Http404
 from .models import Dept, Class, Student, Attendance, Course, Teacher, Assign, AttendanceTotal, time_slots, \
-    DAYS_OF_WEEK, AssignTime, AttendanceClass, StudentCourse, Marks, MarksClass
+    DAYS_OF_WEEK, AssignTime, AttendanceClass, StudentCourse, Marks, MarksClass, Substitution
 from django.urls import reverse
 from django.utils import timezone
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import get_user_model
+from .records import record_attendance, record_marks
+from .writebehind import write
+from .routers import read_replica
+from .sharding import current_alias, locate, shard_rows
 
 
 User = get_user_model()
@@ -24,6 +30,7 @@ def index(request):
     return render(request, 'info/logout.html')
 
 
+@read_replica
 @login_required()
 def attendance(request, stud_id):
     stud = Student.objects.get(USN=stud_id)
@@ -39,6 +46,7 @@ def attendance(request, stud_id):
     return render(request, 'info/attendance.html', {'att_list': att_list})
 
 
+@read_replica
 @login_required()
 def attendance_detail(request, stud_id, course_id):
     stud = get_object_or_404(Student, USN=stud_id)
@@ -52,9 +60,13 @@ def attendance_detail(request, stud_id, course_id):
 @login_required
 def t_clas(request, teacher_id, choice):
     teacher1 = get_object_or_404(Teacher, id=teacher_id)
-    return render(request, 'info/t_clas.html', {'teacher1': teacher1, 'choice': choice})
+    # the classes of other departments can be on other shards
+    ass_list = sorted(shard_rows(Assign.objects.filter(teacher=teacher1).select_related('class_id', 'course')),
+                      key=lambda a: a.id)
+    return render(request, 'info/t_clas.html', {'teacher1': teacher1, 'ass_list': ass_list, 'choice': choice})
 
 
+@read_replica
 @login_required()
 def t_student(request, assign_id):
     ass = Assign.objects.get(id=assign_id)
@@ -69,22 +81,54 @@ def t_student(request, assign_id):
     return render(request, 'info/t_students.html', {'att_list': att_list})
 
 
+@login_required()
+def t_substitutions(request, teacher_id):
+    teacher1 = get_object_or_404(Teacher, id=teacher_id)
+    sub_list = shard_rows(Substitution.objects.filter(
+        teacher=teacher1, attendanceclass__date__gte=timezone.localdate()).select_related(
+        'attendanceclass__assign__class_id__dept', 'attendanceclass__assign__course', 'assigntime', 'leave__teacher'))
+    sub_list.sort(key=lambda s: (s.attendanceclass.date, s.assigntime.period))
+    return render(request, 'info/t_substitutions.html', {'sub_list': sub_list})
+
+
 @login_required()
 def t_class_date(request, assign_id):
-    now = timezone.now()
     ass = get_object_or_404(Assign, id=assign_id)
-    att_list = ass.attendanceclass_set.filter(date__lte=now).order_by('-date')
+    att_list = ass.scheduled_classes(timezone.localdate())
     return render(request, 'info/t_class_date.html', {'att_list': att_list})
 
 
+def scheduled_class(assign_id, date):
+    # unsaved AttendanceClass for a scheduled date in lazy mode
+    ass = get_object_or_404(Assign, id=assign_id)
+    try:
+        date = datetime.strptime(date, '%Y-%m-%d').date()
+    except ValueError:
+        raise Http404('Invalid date')
+    return AttendanceClass(assign=ass, date=date)
+
+
 @login_required()
 def cancel_class(request, ass_c_id):
     assc = get_object_or_404(AttendanceClass, id=ass_c_id)
+    # cancelled by the teacher, a holiday removed later does not open it again
     assc.status = 2
+    assc.holiday = None
     assc.save()
     return HttpResponseRedirect(reverse('t_class_date', args=(assc.assign_id,)))
 
 
+@login_required()
+def cancel_class_date(request, assign_id, date):
+    assc = scheduled_class(assign_id, date)
+    assc, created = AttendanceClass.objects.get_or_create(assign=assc.assign, date=assc.date, defaults={'status': 2})
+    if not created:
+        assc.status = 2
+        assc.holiday = None
+        assc.save()
+    return HttpResponseRedirect(reverse('t_class_date', args=(assc.assign_id,)))
+
+
 @login_required()
 def t_attendance(request, ass_c_id):
     assc = get_object_or_404(AttendanceClass, id=ass_c_id)
@@ -98,6 +142,18 @@ def t_attendance(request, ass_c_id):
     return render(request, 'info/t_attendance.html', context)
 
 
+@login_required()
+def t_attendance_date(request, assign_id, date):
+    assc = scheduled_class(assign_id, date)
+    ass = assc.assign
+    context = {
+        'ass': ass,
+        'c': ass.class_id,
+        'assc': assc,
+    }
+    return render(request, 'info/t_attendance.html', context)
+
+
 @login_required()
 def edit_att(request, ass_c_id):
     assc = get_object_or_404(AttendanceClass, id=ass_c_id)
@@ -113,32 +169,26 @@ def edit_att(request, ass_c_id):
 @login_required()
 def confirm(request, ass_c_id):
     assc = get_object_or_404(AttendanceClass, id=ass_c_id)
-    ass = assc.assign
-    cr = ass.course
-    cl = ass.class_id
-    for i, s in enumerate(cl.student_set.all()):
-        status = request.POST[s.USN]
-        if status == 'present':
-            status = 'True'
-        else:
-            status = 'False'
-        if assc.status == 1:
-            try:
-                a = Attendance.objects.get(course=cr, student=s, date=assc.date, attendanceclass=assc)
-                a.status = status
-                a.save()
-            except Attendance.DoesNotExist:
-                a = Attendance(course=cr, student=s, status=status, date=assc.date, attendanceclass=assc)
-                a.save()
-        else:
-            a = Attendance(course=cr, student=s, status=status, date=assc.date, attendanceclass=assc)
-            a.save()
-            assc.status = 1
-            assc.save()
+    return record_class(request, assc)
+
+
+@login_required()
+def confirm_date(request, assign_id, date):
+    assc = scheduled_class(assign_id, date)
+    assc, created = AttendanceClass.objects.get_or_create(assign=assc.assign, date=assc.date)
+    return record_class(request, assc)
+
 
+def record_class(request, assc):
+    ass = assc.assign
+    statuses = {}
+    for s in ass.class_id.student_set.all():
+        statuses[s.USN] = request.POST[s.USN] == 'present'
+    write(record_attendance, assc, statuses)
     return HttpResponseRedirect(reverse('t_class_date', args=(ass.id,)))
 
 
+@read_replica
 @login_required()
 def t_attendance_detail(request, stud_id, course_id):
     stud = get_object_or_404(Student, USN=stud_id)
@@ -149,9 +199,8 @@ def t_attendance_detail(request, stud_id, course_id):
 
 @login_required()
 def change_att(request, att_id):
-    a = get_object_or_404(Attendance, id=att_id)
-    a.status = not a.status
-    a.save()
+    a = get_object_or_404(Attendance.objects.select_related('attendanceclass__assign'), id=att_id)
+    write(record_attendance, a.attendanceclass, {a.student_id: not a.status}, taken=False)
     return HttpResponseRedirect(reverse('t_attendance_detail', args=(a.student.USN, a.course_id)))
 
 
@@ -169,24 +218,19 @@ def t_extra_class(request, assign_id):
 @login_required()
 def e_confirm(request, assign_id):
     ass = get_object_or_404(Assign, id=assign_id)
-    cr = ass.course
     cl = ass.class_id
-    assc = ass.attendanceclass_set.create(status=1, date=request.POST['date'])
-    assc.save()
+    date = datetime.strptime(request.POST['date'], '%Y-%m-%d').date()
+    assc = ass.attendanceclass_set.create(status=1, date=date)
 
-    for i, s in enumerate(cl.student_set.all()):
-        status = request.POST[s.USN]
-        if status == 'present':
-            status = 'True'
-        else:
-            status = 'False'
-        date = request.POST['date']
-        a = Attendance(course=cr, student=s, status=status, date=date, attendanceclass=assc)
-        a.save()
+    statuses = {}
+    for s in cl.student_set.all():
+        statuses[s.USN] = request.POST[s.USN] == 'present'
+    write(record_attendance, assc, statuses)
 
     return HttpResponseRedirect(reverse('t_clas', args=(ass.teacher_id, 1)))
 
 
+@read_replica
 @login_required()
 def t_report(request, assign_id):
     ass = get_object_or_404(Assign, id=assign_id)
@@ -223,7 +267,8 @@ def timetable(request, class_id):
 
 @login_required()
 def t_timetable(request, teacher_id):
-    asst = AssignTime.objects.filter(assign__teacher_id=teacher_id)
+    asst = {(a.day, a.period): a for a in shard_rows(
+        AssignTime.objects.filter(assign__teacher_id=teacher_id).select_related('assign__course'))}
     class_matrix = [[True for i in range(12)] for j in range(6)]
     for i, d in enumerate(DAYS_OF_WEEK):
         t = 0
@@ -233,11 +278,8 @@ def t_timetable(request, teacher_id):
                 continue
             if j == 4 or j == 8:
                 continue
-            try:
-                a = asst.get(period=time_slots[t][0], day=d[0])
-                class_matrix[i][j] = a
-            except AssignTime.DoesNotExist:
-                pass
+            if (d[0], time_slots[t][0]) in asst:
+                class_matrix[i][j] = asst[d[0], time_slots[t][0]]
             t += 1
 
     context = {
@@ -249,12 +291,12 @@ def t_timetable(request, teacher_id):
 @login_required()
 def free_teachers(request, asst_id):
     asst = get_object_or_404(AssignTime, id=asst_id)
-    ft_list = []
-    t_list = Teacher.objects.filter(assign__class_id__id=asst.assign.class_id_id)
-    for t in t_list:
-        at_list = AssignTime.objects.filter(assign__teacher=t)
-        if not any([True if at.period == asst.period and at.day == asst.day else False for at in at_list]):
-            ft_list.append(t)
+    # the teachers of the class, busy in that period in the classes of any department
+    t_list = Teacher.objects.using(asst._state.db).filter(assign__class_id__id=asst.assign.class_id_id)
+    busy = set(shard_rows(AssignTime.objects.filter(
+        assign__teacher__in=[t.id for t in t_list], period=asst.period, day=asst.day).values_list(
+        'assign__teacher', flat=True)))
+    ft_list = [t for t in t_list if t.id not in busy]
 
     return render(request, 'info/free_teachers.html', {'ft_list': ft_list})
 
@@ -262,6 +304,7 @@ def free_teachers(request, asst_id):
 # student marks
 
 
+@read_replica
 @login_required()
 def marks_list(request, stud_id):
     stud = Student.objects.get(USN=stud_id, )
@@ -311,16 +354,14 @@ def t_marks_entry(request, marks_c_id):
 def marks_confirm(request, marks_c_id):
     mc = get_object_or_404(MarksClass, id=marks_c_id)
     ass = mc.assign
-    cr = ass.course
     cl = ass.class_id
-    for s in cl.student_set.all():
-        mark = request.POST[s.USN]
-        sc = StudentCourse.objects.get(course=cr, student=s)
-        m = sc.marks_set.get(name=mc.name)
-        m.marks1 = mark
-        m.save()
-    mc.status = True
-    mc.save()
+    marks = {}
+    try:
+        for s in cl.student_set.all():
+            marks[s.USN] = int(request.POST[s.USN])
+    except ValueError:
+        return HttpResponseBadRequest('Invalid marks')
+    write(record_marks, mc, marks)
 
     return HttpResponseRedirect(reverse('t_marks_list', args=(ass.id,)))
 
@@ -342,6 +383,7 @@ def edit_marks(request, marks_c_id):
     return render(request, 'info/edit_marks.html', context)
 
 
+@read_replica
 @login_required()
 def student_marks(request, assign_id):
     ass = Assign.objects.get(id=assign_id)
@@ -394,7 +436,9 @@ def add_student(request):
 
     if request.method == 'POST':
         # Retrieving all the form data that has been inputted
-        class_id = get_object_or_404(Class, id=request.POST['class'])
+        # the class is looked up on the department shards
+        class_id = get_object_or_404(Class.objects.using(locate(Class, pk=request.POST['class']) or current_alias()),
+                                     id=request.POST['class'])
         name = request.POST['full_name']
         usn = request.POST['usn']
         dob = request.POST['dob']
@@ -420,6 +464,6 @@ def add_student(request):
         ).save()
         return redirect('/')
     
-    all_classes = Class.objects.order_by('-id')
+    all_classes = sorted(shard_rows(Class.objects.all()), key=lambda c: c.id, reverse=True)
     context = {'all_classes': all_classes}
     return render(request, 'info/add_student.html', context)
\ No newline at end of file
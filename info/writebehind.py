@@ -0,0 +1,116 @@
+"""
+Optional write-behind queue for the attendance and marks writes.
+
+On SQLite every write transaction takes the database lock, so concurrent
+submissions wait on each other and some fail with "database is locked". With
+ATTENDANCE_WRITE_BEHIND set, the writes are handed to a single writer thread,
+which runs the writes received within ATTENDANCE_WRITE_BEHIND_INTERVAL seconds
+in one transaction. Each request waits for the result of its own write.
+"""
+import contextvars
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from functools import partial
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+
+
+class WriteBehind:
+
+    def __init__(self, interval=None, max_batch=None):
+        if interval is None:
+            interval = getattr(settings, 'ATTENDANCE_WRITE_BEHIND_INTERVAL', 0.005)
+        if max_batch is None:
+            max_batch = getattr(settings, 'ATTENDANCE_WRITE_BEHIND_BATCH', 100)
+        self.interval = interval
+        self.max_batch = max_batch
+        self.batches = 0      # transactions run, for monitoring
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue fn(*args, **kwargs) and return a Future of its result."""
+        future = Future()
+        # run in the context of the caller, which selects the department shard
+        self._queue.put((future, partial(contextvars.copy_context().run, fn), args, kwargs))
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+                self._thread.start()
+        return future
+
+    def close(self):
+        """Run the queued writes and stop the writer thread."""
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+    def _run(self):
+        stop = False
+        while not stop:
+            op = self._queue.get()
+            if op is None:
+                break
+            batch = [op]
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.max_batch:
+                try:
+                    op = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if op is None:
+                    stop = True
+                    break
+                batch.append(op)
+            # like a request, drop the connections past CONN_MAX_AGE or broken by an error
+            close_old_connections()
+            self._execute([op for op in batch if op[0].set_running_or_notify_cancel()])
+        connection.close()
+
+    def _execute(self, batch):
+        results = []
+        try:
+            with transaction.atomic():
+                for future, fn, args, kwargs in batch:
+                    # a savepoint per write, a failing write does not undo the others
+                    try:
+                        with transaction.atomic():
+                            results.append((future, fn(*args, **kwargs), None))
+                    except Exception as e:
+                        results.append((future, None, e))
+        except Exception:
+            # the batch could not be committed, run the writes one by one
+            for future, fn, args, kwargs in batch:
+                try:
+                    with transaction.atomic():
+                        future.set_result(fn(*args, **kwargs))
+                except Exception as e:
+                    future.set_exception(e)
+            return
+        finally:
+            self.batches += 1
+        for future, result, error in results:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+
+writer = WriteBehind()
+
+
+def write(fn, *args, **kwargs):
+    """
+    Run a write, through the writer thread when ATTENDANCE_WRITE_BEHIND is set.
+    Returns its result or raises its exception in both cases.
+    """
+    if not getattr(settings, 'ATTENDANCE_WRITE_BEHIND', False):
+        return fn(*args, **kwargs)
+    return writer.submit(fn, *args, **kwargs).result()